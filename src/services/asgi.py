@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import re
+
+from a2wsgi import WSGIMiddleware
+
+import oldApi
+from oldApi import config, bulk_executor, create_app, ensure_drug_index, warm_up
+
+# ASGI entry point for the admin API: uvicorn asgi:application
+#
+# Routes and responses are the Flask ones unchanged. Requests run on two separate thread pools, so
+# bulk writes, roster and formulary imports and roster exports can only ever occupy the bulk pool and never
+# queue dashboard reads behind them. Streaming bulk jobs run on bulk_executor and outlive their request.
+
+host = config.get("asgi", "host", fallback="0.0.0.0")
+port = config.getint("asgi", "port", fallback=3000)
+read_workers = config.getint("asgi", "read_workers", fallback=16)
+bulk_workers = config.getint("asgi", "bulk_workers", fallback=4)
+warm_up_on_startup = config.getboolean("startup", "warm_up", fallback=True)
+
+BULK_ROUTES = re.compile(
+    r"^/user/bulk(/stream)?/?$|^/company/[^/]+/(ingest|diff|stage)/?$|^/company/[^/]+/stage/[^/]+/approve/?$|^/drugs/import/?$"
+)
+# Long-running downloads: they hold a worker for as long as the client takes to receive the file
+EXPORT_ROUTES = re.compile(r"^/company/[^/]+/export/?$")
+
+app = create_app()
+read_app = WSGIMiddleware(app, workers=read_workers)
+bulk_app = WSGIMiddleware(app, workers=bulk_workers)
+
+
+def is_bulk_request(scope):
+    if scope["method"] == "GET":
+        return EXPORT_ROUTES.match(scope["path"]) is not None
+    return scope["method"] == "POST" and BULK_ROUTES.match(scope["path"]) is not None
+
+
+def build_drug_index():
+    try:
+        ensure_drug_index()
+    except Exception:
+        logging.exception("Could not build the drug search index at startup")
+
+
+def warm_up_app():
+    try:
+        logging.info("Warm-up: %s", warm_up())
+    except Exception:
+        logging.exception("Could not warm up the database pool and reference caches")
+
+
+def drain_change_outbox():
+    # Records a previous process committed but could not move to the change log
+    try:
+        logging.info("Change log: moved %d records out of change_outbox", oldApi.drain_change_outbox())
+    except Exception:
+        logging.exception("Could not drain change_outbox")
+
+
+def stop_workers():
+    if oldApi.age_recompute_job is not None:
+        oldApi.age_recompute_job.stop()
+    bulk_executor.shutdown(wait=True)
+    if oldApi.validation_executor is not None:
+        oldApi.validation_executor.shutdown(wait=True)
+    # After the bulk jobs, whose commits may still add records; summarizes the active segment
+    drain_change_outbox()
+    oldApi.change_log.close()
+
+
+async def lifespan(receive, send):
+    message = await receive()
+    if message["type"] == "lifespan.startup":
+        # Connections and reference caches are ready before the first request is accepted
+        if warm_up_on_startup:
+            await asyncio.get_running_loop().run_in_executor(None, warm_up_app)
+        # Build the formulary search index in the background; the first search builds it otherwise
+        asyncio.get_running_loop().run_in_executor(None, build_drug_index)
+        asyncio.get_running_loop().run_in_executor(None, drain_change_outbox)
+        if oldApi.age_recompute_job is not None:
+            oldApi.age_recompute_job.start()
+        await send({"type": "lifespan.startup.complete"})
+        message = await receive()
+    if message["type"] == "lifespan.shutdown":
+        # Let queued bulk jobs finish committing their chunks before the process exits
+        await asyncio.get_running_loop().run_in_executor(None, stop_workers)
+        await send({"type": "lifespan.shutdown.complete"})
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and is_bulk_request(scope):
+        await bulk_app(scope, receive, send)
+    else:
+        await read_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(application, host=host, port=port)
@@ -0,0 +1,400 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from itertools import islice
+
+from sqlalchemy import create_engine, event, func, insert, text
+
+from models import Base, InsuranceCompany, MagicPillPlan, User, Admin, Drug
+
+# Benchmarks the admin API against a local stand-in database seeded with synthetic data.
+#
+#   python bench_api.py seed --database-url postgresql://localhost/magicpill_bench --users 100000 --reset
+#   python bench_api.py run --database-url postgresql://localhost/magicpill_bench > bench-$(git rev-parse --short HEAD).json
+#   python bench_api.py compare bench-abc123.json bench-def456.json
+#
+# `run` drives the routes in-process through Flask's test client, so it measures the app and the
+# database and not a web server. Each scenario reports latency percentiles, throughput, SQL
+# statements per request and the process's peak RSS as one JSON document.
+# SQLite works as a stand-in for the read scenarios; user_bulk needs Postgres.
+# Never point this at a real database: `seed --reset` drops every table in models.py.
+
+SEED = 20240501
+DRUG_NAMES = [
+    "Atorvastatin", "Amlodipine", "Metformin", "Lisinopril", "Levothyroxine", "Omeprazole",
+    "Simvastatin", "Losartan", "Albuterol", "Gabapentin", "Hydrochlorothiazide", "Sertraline",
+]
+MANUFACTURERS = ["Pfizer Inc", "Teva", "Mylan", "Sandoz", "Lupin", "Aurobindo"]
+FIRST_NAMES = ["Avery", "Jordan", "Riley", "Casey", "Morgan", "Taylor", "Quinn", "Rowan"]
+LAST_NAMES = ["Nguyen", "Garcia", "Smith", "Kim", "Patel", "Okafor", "Silva", "Kowalski"]
+
+
+# SEEDING
+
+def _insert(connection, model, rows, batch_size):
+    count = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return count
+        connection.execute(insert(model.__table__), batch)
+        count += len(batch)
+
+
+def _sync_sequences(connection):
+    # Rows are seeded with explicit ids; move the serial sequences past them so the app's inserts work
+    for table, column in (("insurance_companies", "companyId"), ("magic_pill_plans", "planId"),
+                          ("admins", "admin_id"), ("users", "documentId"), ("drugs", "drug_id")):
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+            f"GREATEST((SELECT max(\"{column}\") FROM {table}), 1))"
+        ))
+
+
+def seed(database_url, users, users_per_company, plans, drugs, reset, batch_size):
+    engine = create_engine(database_url)
+    if reset:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rnd = random.Random(SEED)
+    companies = max(1, math.ceil(users / users_per_company))
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        counts = {
+            "companies": _insert(connection, InsuranceCompany, (
+                {"companyId": company_id, "name": f"Bench Health {company_id}", "phoneNumber": f"555{company_id:07d}"}
+                for company_id in range(1, companies + 1)), batch_size),
+            "plans": _insert(connection, MagicPillPlan, (
+                {"planId": plan_id, "planName": f"Plan {plan_id}", "plan_details": "Synthetic benchmark plan"}
+                for plan_id in range(1, plans + 1)), batch_size),
+            "admins": _insert(connection, Admin, (
+                {"admin_id": company_id, "admin_username": f"admin{company_id}",
+                 "admin_email": f"admin{company_id}@bench.example", "companyId": company_id}
+                for company_id in range(1, companies + 1)), batch_size),
+            "users": _insert(connection, User, (
+                {
+                    "documentId": document_id,
+                    "username": f"user{document_id}",
+                    "email": f"user{document_id}@bench.example",
+                    "firstName": rnd.choice(FIRST_NAMES),
+                    "lastName": rnd.choice(LAST_NAMES),
+                    "phone": f"555{document_id:07d}",
+                    "address": f"{document_id} Benchmark Ave",
+                    "dob": date(rnd.randint(1940, 2020), rnd.randint(1, 12), rnd.randint(1, 28)),
+                    "age": None,
+                    "company": f"Bench Health {(document_id - 1) // users_per_company + 1}",
+                    "companyId": (document_id - 1) // users_per_company + 1,
+                    "planId": rnd.randint(1, plans),
+                    "isActive": rnd.random() > 0.1,
+                    "isDependant": rnd.random() < 0.3,
+                }
+                for document_id in range(1, users + 1)), batch_size),
+            "drugs": _insert(connection, Drug, (
+                {
+                    "drug_id": drug_id,
+                    "drug_name": f"{rnd.choice(DRUG_NAMES)} {rnd.randint(5, 500)}mg",
+                    "manufacturer_name": rnd.choice(MANUFACTURERS),
+                    "brand_name": None,
+                    "cost": round(rnd.uniform(1, 900), 2),
+                    "is_urgent": rnd.random() < 0.05,
+                    "is_high_cost": rnd.random() < 0.1,
+                    "is_free": rnd.random() < 0.2,
+                    "plan_type": rnd.choice(["gold", "silver", "bronze"]),
+                    "drug_form": rnd.choice(["tablet", "capsule", "inhaler"]),
+                    "dosage": "1 daily",
+                    "max_supply_30": 30,
+                    "max_supply_90": 90,
+                }
+                for drug_id in range(1, drugs + 1)), batch_size),
+        }
+        if connection.dialect.name == "postgresql":
+            _sync_sequences(connection)
+            connection.execute(text("ANALYZE"))
+    return dict(counts, seconds=round(time.perf_counter() - started, 2))
+
+
+# SCENARIOS
+
+class Context:
+    # What the seeded database holds, read once before the scenarios run
+    def __init__(self, oldApi, bulk_size, cold_cache):
+        self.oldApi = oldApi
+        self.bulk_size = bulk_size
+        self.cold_cache = cold_cache
+        with oldApi.session_factory() as session:
+            self.companies = session.query(func.max(InsuranceCompany.companyId)).scalar() or 0
+            self.users = session.query(func.max(User.documentId)).scalar() or 0
+            self.plans = session.query(func.max(MagicPillPlan.planId)).scalar() or 0
+        if not self.companies or not self.users:
+            raise SystemExit("The database has no companies or users; run `bench_api.py seed` first.")
+
+
+# Each scenario builds one request as (method, url, json body); only sending it is timed
+
+def company_roster(ctx, rnd):
+    return "GET", f"/company/{rnd.randint(1, ctx.companies)}", None
+
+
+def users_page(ctx, rnd):
+    return "GET", f"/company/{rnd.randint(1, ctx.companies)}/users?limit=100", None
+
+
+def users_stream(ctx, rnd):
+    return "GET", f"/company/{rnd.randint(1, ctx.companies)}/users/stream?format=columnar", None
+
+
+def login_lookup(ctx, rnd):
+    if ctx.cold_cache:
+        ctx.oldApi.reference_cache.invalidate_prefix("admin_email")
+    return "GET", f"/admins/email/ADMIN{rnd.randint(1, ctx.companies)}@bench.example", None
+
+
+def drug_search(ctx, rnd):
+    return "GET", f"/drugs/search?q={rnd.choice(DRUG_NAMES)[:rnd.randint(2, 6)].lower()}", None
+
+
+def user_bulk(ctx, rnd):
+    # Half updates of existing users in one company, half new users in it
+    company_id = rnd.randint(1, ctx.companies)
+    with ctx.oldApi.session_factory() as session:
+        existing = [row[0] for row in session.query(User.documentId).filter(User.companyId == company_id).limit(ctx.bulk_size // 2)]
+    operations = []
+    for index in range(ctx.bulk_size):
+        user_data = {
+            "username": f"bench-{uuid.uuid4().hex[:12]}",
+            "email": f"bench-{uuid.uuid4().hex}@bench.example",
+            "firstName": rnd.choice(FIRST_NAMES),
+            "lastName": rnd.choice(LAST_NAMES),
+            "phone": "5550100",
+            "address": "1 Load Test Way",
+            "dob": "1990-01-01",
+            "companyId": company_id,
+            "planId": rnd.randint(1, ctx.plans),
+            "isActive": True,
+            "isDependant": False,
+        }
+        if index < len(existing):
+            user_data["documentId"] = existing[index]
+            operations.append({"action": "update", "user_data": user_data})
+        else:
+            operations.append({"action": "add", "user_data": user_data})
+    return "POST", "/user/bulk", operations
+
+
+SCENARIOS = {
+    "company_roster": company_roster,
+    "users_page": users_page,
+    "users_stream": users_stream,
+    "login_lookup": login_lookup,
+    "drug_search": drug_search,
+    "user_bulk": user_bulk,
+}
+POSTGRES_ONLY = {"user_bulk"}
+
+
+# MEASUREMENT
+
+class QueryCounter:
+    # SQL statements executed by the current thread since the last reset
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    def value(self):
+        return getattr(self._local, "count", 0)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def run_scenario(app, counter, ctx, scenario, requests, concurrency, warmup):
+    clients = threading.local()
+
+    def one(seed):
+        if not hasattr(clients, "client"):
+            clients.client = app.test_client()
+        method, url, body = scenario(ctx, random.Random(seed))
+        counter.reset()
+        started = time.perf_counter()
+        response = clients.client.open(url, method=method, json=body)
+        size = len(response.get_data())
+        elapsed = time.perf_counter() - started
+        return elapsed, counter.value(), response.status_code, size
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(-warmup, 0)))
+        started = time.perf_counter()
+        samples = list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = [sample[1] for sample in samples]
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for sample in samples if sample[2] >= 400),
+        "duration_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3),
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3),
+        },
+        "queries_per_request": {"mean": round(sum(queries) / len(queries), 2), "max": max(queries)},
+        "response_bytes_mean": round(sum(sample[3] for sample in samples) / len(samples)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(database_url, names, requests, concurrency, warmup, bulk_size, cold_cache):
+    # oldApi builds its engine from DATABASE_URL on first use
+    os.environ["DATABASE_URL"] = database_url
+    import oldApi
+    import fast_json
+
+    ctx = Context(oldApi, bulk_size, cold_cache)
+    app = oldApi.create_app()
+    engine = oldApi.get_engine()
+    counter = QueryCounter(engine)
+    dialect = engine.dialect.name
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "database": dialect,
+            "python": platform.python_version(),
+            "json_encoder": "orjson" if fast_json.orjson is not None else "json",
+            "companies": ctx.companies,
+            "users": ctx.users,
+            "requests": requests,
+            "concurrency": concurrency,
+        },
+        "scenarios": {},
+    }
+    for name in names:
+        if name in POSTGRES_ONLY and dialect != "postgresql":
+            report["scenarios"][name] = {"skipped": f"needs postgresql, not {dialect}"}
+            continue
+        report["scenarios"][name] = run_scenario(app, counter, ctx, SCENARIOS[name], requests, concurrency, warmup)
+    return report
+
+
+# COMPARISON
+
+COMPARED = [
+    ("p50_ms", lambda result: result["latency_ms"]["p50"], False),
+    ("p95_ms", lambda result: result["latency_ms"]["p95"], False),
+    ("p99_ms", lambda result: result["latency_ms"]["p99"], False),
+    ("rps", lambda result: result["throughput_rps"], True),
+    ("queries", lambda result: result["queries_per_request"]["mean"], False),
+]
+
+
+def compare(baseline, candidate, fail_over):
+    # Prints one line per scenario and metric; returns the regressions beyond `fail_over` percent
+    regressions = []
+    for name, after in candidate["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before or "skipped" in before or "skipped" in after:
+            continue
+        for metric, read, higher_is_better in COMPARED:
+            old, new = read(before), read(after)
+            change = 100.0 * (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if fail_over is not None and worse > fail_over:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, change))
+            print(f"{name:<16} {metric:<8} {old:>12.2f} -> {new:>12.2f}  {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a stand-in database and benchmark the admin API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="create the tables and fill them with synthetic data")
+    seed_parser.add_argument("--database-url", required=True)
+    seed_parser.add_argument("--users", type=int, default=10000)
+    seed_parser.add_argument("--users-per-company", type=int, default=1000)
+    seed_parser.add_argument("--plans", type=int, default=20)
+    seed_parser.add_argument("--drugs", type=int, default=20000)
+    seed_parser.add_argument("--batch-size", type=int, default=10000)
+    seed_parser.add_argument("--reset", action="store_true", help="drop the tables first")
+
+    run_parser = commands.add_parser("run", help="drive the endpoints and print a JSON report")
+    run_parser.add_argument("--database-url", required=True)
+    run_parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: " + ", ".join(SCENARIOS))
+    run_parser.add_argument("--requests", type=int, default=200, help="per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=4)
+    run_parser.add_argument("--warmup", type=int, default=10)
+    run_parser.add_argument("--bulk-size", type=int, default=200, help="operations per /user/bulk request")
+    run_parser.add_argument("--cold-cache", action="store_true", help="bypass the cached admin login lookup")
+    run_parser.add_argument("--output", help="write the report here instead of stdout")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports from `run`")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--fail-over", type=float, help="exit 1 if any metric is this many percent worse")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        print(json.dumps(seed(args.database_url, args.users, args.users_per_company, args.plans,
+                              args.drugs, args.reset, args.batch_size)))
+    elif args.command == "run":
+        names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(unknown)}")
+        report = json.dumps(run(args.database_url, names, args.requests, args.concurrency, args.warmup,
+                                args.bulk_size, args.cold_cache), indent=2)
+        if args.output:
+            with open(args.output, "w") as output:
+                output.write(report + "\n")
+        else:
+            print(report)
+    else:
+        with open(args.baseline) as baseline, open(args.candidate) as candidate:
+            regressions = compare(json.load(baseline), json.load(candidate), args.fail_over)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import statistics
+import time
+from datetime import date
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import make_transient_to_detached
+
+import fast_json
+from models import InsuranceCompany, MagicPillPlan, User, USER_FIELDS
+
+# Compares the serialize() path large roster responses used to take with the tuple + fast encoder path.
+#
+#   python bench_serialization.py --rows 50000            synthetic users, no database
+#   python bench_serialization.py --company-id 3          a real roster through oldApi's engine
+#
+# Paths:
+#   serialize  ORM User objects -> serialize_full() -> Flask's default provider's response()
+#   rows       column tuples -> serialize_full()-shaped dicts -> app.json.response(), as jsonify() sends them
+#   ndjson     column tuples -> fast_json.iter_ndjson
+#   columnar   column tuples -> fast_json.iter_columnar
+
+
+def serialize_full(users):
+    # The ORM path GET /company/<id> took before the tuple path; `cache` serializes each company and plan once
+    cache = {}
+    return [user.serialize_full(cache) for user in users]
+
+
+def synthetic_roster(count, plan_count=5):
+    company = InsuranceCompany(companyId=1, name="Benchmark Health", phoneNumber="5550100")
+    plans = [MagicPillPlan(planId=plan_id, planName=f"Plan {plan_id}", plan_details="Generic and brand coverage")
+             for plan_id in range(1, plan_count + 1)]
+    for reference in [company, *plans]:
+        make_transient_to_detached(reference)
+
+    users = []
+    for document_id in range(1, count + 1):
+        plan = plans[document_id % plan_count]
+        user = User(
+            documentId=document_id, username=f"user{document_id}", email=f"user{document_id}@example.com",
+            firstName="Jordan", lastName=f"Lee{document_id}", phone="5550100", address="1 Main St",
+            dob=date(1990, 1, 1), age=35, company=company.name, companyId=company.companyId, planId=plan.planId,
+            isActive=document_id % 10 != 0, isDependant=document_id % 4 == 0,
+        )
+        user.insurance_company = company
+        user.magic_pill_plan = plan
+        make_transient_to_detached(user)
+        users.append(user)
+    return company, plans, users
+
+
+def synthetic_paths(count):
+    company, plans, users = synthetic_roster(count)
+    rows = [tuple(getattr(user, field) for field in USER_FIELDS) for user in users]
+    companies = {company.companyId: company.serialize()}
+    plans_by_id = {plan.planId: plan.serialize() for plan in plans}
+    stdlib_app = Flask(__name__)
+    app = Flask(__name__)
+    app.json = fast_json.FastJSONProvider(app)
+    head = {"company": company.serialize(), "roster_version": 0}
+
+    def serialize():
+        return stdlib_app.json.response({"results": [dict(head, users=serialize_full(users))]}).get_data()
+
+    def as_dicts():
+        users = []
+        for row in rows:
+            user = dict(zip(USER_FIELDS, row))
+            user["insurance_company"] = companies.get(user["companyId"])
+            user["magic_pill_plan"] = plans_by_id.get(user["planId"])
+            users.append(user)
+        return app.json.response({"results": [dict(head, users=users)]}).get_data()
+
+    return {
+        "serialize": serialize,
+        "rows": as_dicts,
+        "ndjson": lambda: b"".join(fast_json.iter_ndjson(USER_FIELDS, rows)),
+        "columnar": lambda: b"".join(fast_json.iter_columnar(USER_FIELDS, rows, head)),
+    }
+
+
+def database_paths(company_id):
+    # Imported here so the synthetic benchmark runs without config.ini or a database
+    import oldApi
+
+    client = oldApi.app.test_client()
+    stdlib = DefaultJSONProvider(oldApi.app)
+
+    def serialize():
+        with oldApi.session_factory() as session:
+            company = session.get(InsuranceCompany, company_id)
+            users = session.query(User).options(*User.full_load_options()).filter_by(companyId=company_id).all()
+            payload = {"company": company.serialize(), "users": serialize_full(users),
+                       "roster_version": company.rosterVersion}
+            return stdlib.response({"results": [payload]}).get_data()
+
+    def fetch(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise SystemExit(f"GET {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response.get_data()
+
+    return {
+        "serialize": serialize,
+        "rows": lambda: fetch(f"/company/{company_id}"),
+        "ndjson": lambda: fetch(f"/company/{company_id}/users/stream?format=ndjson"),
+        "columnar": lambda: fetch(f"/company/{company_id}/users/stream?format=columnar"),
+    }
+
+
+def measure(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = run()
+        timings.append(time.perf_counter() - started)
+    return len(body), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark roster serialization paths.")
+    parser.add_argument("--rows", type=int, default=20000, help="synthetic roster size")
+    parser.add_argument("--company-id", type=int, help="benchmark this company's roster from the database instead")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="one JSON object per path instead of a table")
+    args = parser.parse_args()
+
+    paths = database_paths(args.company_id) if args.company_id is not None else synthetic_paths(args.rows)
+    encoder = "orjson" if fast_json.orjson is not None else "json"
+    baseline = None
+    for name, run in paths.items():
+        size, timings = measure(run, args.repeat)
+        result = {
+            "path": name,
+            "encoder": "json" if name == "serialize" else encoder,
+            "bytes": size,
+            "best_ms": round(1000 * min(timings), 2),
+            "median_ms": round(1000 * statistics.median(timings), 2),
+        }
+        baseline = baseline or result["median_ms"]
+        result["speedup"] = round(baseline / result["median_ms"], 2) if result["median_ms"] else None
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{name:<10} {result['encoder']:<7} {size:>12,d} B  best {result['best_ms']:>9.2f} ms"
+                  f"  median {result['median_ms']:>9.2f} ms  x{result['speedup']}")
+
+
+if __name__ == "__main__":
+    main()
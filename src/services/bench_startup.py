@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Measures the admin API's cold start: each run is a fresh interpreter that imports oldApi, calls
+# create_app(), optionally warms up, then serves the same GET twice through Flask's test client.
+#
+#   python bench_startup.py --path /plans --runs 5
+#   python bench_startup.py --path /company/1 --runs 5 --warm --imports 15
+#
+# Reported per run and as medians:
+#   import_ms         `import oldApi`
+#   create_app_ms     create_app(), including warm_up() with --warm
+#   first_request_ms  the first GET: without --warm it also creates the engine, connects and loads caches
+#   second_request_ms the same GET again, for comparison
+#   process_ms        interpreter start to exit, as seen by the parent
+# Runs from the current directory, so config.ini (or DATABASE_URL) is picked up as the app would.
+
+METRICS = ["import_ms", "create_app_ms", "first_request_ms", "second_request_ms", "process_ms"]
+
+
+def child(path, warm):
+    # One cold start; prints its timings as a JSON object
+    started = time.perf_counter()
+    import oldApi
+    imported = time.perf_counter()
+    app = oldApi.create_app(warm=warm)
+    created = time.perf_counter()
+
+    client = app.test_client()
+    timings = {}
+    for name in ("first_request_ms", "second_request_ms"):
+        request_started = time.perf_counter()
+        response = client.get(path)
+        timings[name] = round(1000 * (time.perf_counter() - request_started), 2)
+        if response.status_code >= 400:
+            raise SystemExit(f"GET {path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    print(json.dumps(dict(
+        timings,
+        import_ms=round(1000 * (imported - started), 2),
+        create_app_ms=round(1000 * (created - imported), 2),
+    )))
+
+
+def run_child(path, warm):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--path", path] + (["--warm"] if warm else [])
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, env=child_env())
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise SystemExit(f"Startup run failed:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = round(1000 * elapsed, 2)
+    return timings
+
+
+def child_env():
+    # The services modules import each other as top-level modules
+    env = dict(os.environ)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [here, env.get("PYTHONPATH")]))
+    return env
+
+
+def slowest_imports(limit):
+    # [(cumulative ms, module)] for oldApi and the modules it imports directly, from -X importtime
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import oldApi"],
+                            capture_output=True, text=True, env=child_env())
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Each level of nesting under the importing module adds two spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the admin API's import time and time to first request.")
+    parser.add_argument("--path", default="/plans", help="GET this route as the first request")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes to start")
+    parser.add_argument("--warm", action="store_true", help="create_app(warm=True): open connections and load caches first")
+    parser.add_argument("--imports", type=int, default=0, help="also list this many slowest imports made by oldApi")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.path, args.warm)
+        return
+
+    runs = [run_child(args.path, args.warm) for _ in range(args.runs)]
+    report = {
+        "path": args.path,
+        "warm": args.warm,
+        "runs": runs,
+        "median": {metric: round(statistics.median(run[metric] for run in runs), 2) for metric in METRICS},
+    }
+    if args.imports:
+        report["slowest_imports"] = [{"module": name, "cumulative_ms": ms} for ms, name in slowest_imports(args.imports)]
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for metric in METRICS:
+        print(f"{metric:<18} median {report['median'][metric]:>9.2f} ms   runs " +
+              " ".join(f"{run[metric]:.1f}" for run in runs))
+    for entry in report.get("slowest_imports", []):
+        print(f"import {entry['module']:<40} {entry['cumulative_ms']:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import codecs
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+READ_SIZE = 64 * 1024
+MAX_JOB_ERRORS = 100
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_WHITESPACE = " \t\n\r"
+# Characters that can follow a complete-looking number and still belong to it, e.g. "e+5"
+_NUMBER_LOOKAHEAD = 3
+
+
+def _is_number(element):
+    return isinstance(element, (int, float)) and not isinstance(element, bool)
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    # Yields the elements of a top-level JSON array while reading `stream` in fixed-size blocks,
+    # so only the element being decoded (plus one read block) is ever held in memory
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        block = stream.read(read_size)
+        if not block:
+            eof = True
+            buffer = buffer[position:] + utf8.decode(b"", final=True)
+        else:
+            if isinstance(block, bytes):
+                block = utf8.decode(block)
+            buffer = buffer[position:] + block
+        position = 0
+
+    def next_token():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return None
+            fill()
+
+    if next_token() != "[":
+        raise ValueError("Data should be a list of user operations.")
+    position += 1
+
+    if next_token() == "]":
+        return
+
+    while True:
+        if next_token() is None:
+            raise ValueError("Unexpected end of JSON array.")
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Malformed JSON element in array.")
+            fill()
+            continue
+        if not eof and (end == len(buffer) or (_is_number(element) and len(buffer) - end < _NUMBER_LOOKAHEAD)):
+            # A scalar cut at the block boundary decodes "successfully", as does a number cut just
+            # before its fraction or exponent ("-1500" of "-1500.0"); re-read to be sure
+            fill()
+            continue
+        position = end
+        yield element
+
+        token = next_token()
+        if token == ",":
+            position += 1
+        elif token == "]":
+            return
+        else:
+            raise ValueError("Expected ',' or ']' in JSON array.")
+
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BulkJob:
+    def __init__(self, chunk_size, path=None):
+        self.job_id = uuid.uuid4().hex
+        self.path = path
+        self.chunk_size = chunk_size
+        self.status = "queued"
+        self.rows_processed = 0
+        self.rows_succeeded = 0
+        self.rows_failed = 0
+        self.added = 0
+        self.updated = 0
+        self.toggled = 0
+        self.deactivated = 0
+        self.chunks_committed = 0
+        self.chunks_failed = 0
+        self.errors = []
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def save(self):
+        # Written to a temporary file and renamed, so readers never see half a job
+        if self.path is None:
+            return
+        state = self.serialize()
+        temporary = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary, "w") as saved:
+                json.dump(state, saved, separators=(",", ":"))
+            os.replace(temporary, self.path)
+        except OSError as e:
+            # The job keeps running; only other workers see a stale status
+            logging.warning("Could not save bulk job %s: %s", self.job_id, e)
+
+    def start(self):
+        with self._lock:
+            self.status = "running"
+        self.save()
+
+    def record_chunk(self, counts, errors, committed):
+        # `errors` holds (row index, result) pairs for the rows that did not make it in
+        with self._lock:
+            self.rows_processed += counts["rows"]
+            self.rows_succeeded += counts["added"] + counts["updated"] + counts["toggled"] + counts["deactivated"]
+            self.rows_failed += len(errors)
+            self.added += counts["added"]
+            self.updated += counts["updated"]
+            self.toggled += counts["toggled"]
+            self.deactivated += counts["deactivated"]
+            if committed:
+                self.chunks_committed += 1
+            else:
+                self.chunks_failed += 1
+            for row, result in errors[:MAX_JOB_ERRORS - len(self.errors)]:
+                self.errors.append(dict(result, row=row))
+        self.save()
+
+    def finish(self, status, message=None):
+        with self._lock:
+            self.status = status
+            self.finished_at = datetime.utcnow()
+            if message and len(self.errors) < MAX_JOB_ERRORS:
+                self.errors.append({"error": "Job Failed", "message": message})
+        self.save()
+
+    def serialize(self):
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'chunk_size': self.chunk_size,
+                'rows_processed': self.rows_processed,
+                'rows_succeeded': self.rows_succeeded,
+                'rows_failed': self.rows_failed,
+                'added': self.added,
+                'updated': self.updated,
+                'toggled': self.toggled,
+                'deactivated': self.deactivated,
+                'chunks_committed': self.chunks_committed,
+                'chunks_failed': self.chunks_failed,
+                'errors': list(self.errors),
+                'created_at': self.created_at.isoformat(),
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            }
+
+
+class BulkJobRegistry:
+    # Jobs run in the worker that received them, but every change is written through to
+    # <folder>/<job_id>.json, so any worker (or this one after a restart) can report on them.
+    # A job still queued or running whose file has not changed for `stale_seconds` belonged to a
+    # worker that went away and is reported as interrupted. Files are removed after `ttl_seconds`.
+    def __init__(self, folder=None, max_jobs=200, ttl_seconds=7 * 86400, stale_seconds=900):
+        self.folder = folder
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def create(self, chunk_size):
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+            self.purge_expired()
+        job = BulkJob(chunk_size)
+        if self.folder is not None:
+            job.path = self._path(job.job_id)
+        job.save()
+        with self._lock:
+            self._jobs[job.job_id] = job
+            # Forget the oldest finished jobs once the registry is full; their files remain
+            if len(self._jobs) > self.max_jobs:
+                finished = [j for j in self._jobs.values() if j.finished_at is not None]
+                for old in sorted(finished, key=lambda j: j.finished_at)[:len(self._jobs) - self.max_jobs]:
+                    del self._jobs[old.job_id]
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        # The serialized job, from memory when it runs here and from its file otherwise
+        job = self.get(job_id)
+        if job is not None:
+            return job.serialize()
+        if self.folder is None or not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as saved:
+                state = json.load(saved)
+            modified = os.stat(self._path(job_id)).st_mtime
+        except (FileNotFoundError, ValueError):
+            return None
+        if state["status"] in ("queued", "running") and modified + self.stale_seconds <= time.time():
+            state["status"] = "interrupted"
+        return state
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        purged = 0
+        for name in os.listdir(self.folder) if os.path.isdir(self.folder) else []:
+            if not (name.endswith(".json") and JOB_ID_PATTERN.match(name[:-len(".json")])):
+                continue
+            try:
+                if os.stat(os.path.join(self.folder, name)).st_mtime <= cutoff:
+                    os.remove(os.path.join(self.folder, name))
+                    purged += 1
+            except FileNotFoundError:
+                continue
+        return purged
@@ -0,0 +1,120 @@
+from datetime import date, datetime
+
+# Per-row checks for bulk user operations that need nothing but the row itself: required fields,
+# their types and the email address. They are CPU-bound and independent, so large payloads are
+# checked in a process pool, chunk by chunk, with results returned in input order. Checks that need
+# the database (plan, company and user lookups) stay with the caller.
+
+REQUIRED_FIELDS = {
+    "username": str,
+    "email": str,
+    "firstName": str,
+    "lastName": str,
+    "phone": str,
+    "address": str,
+    "dob": str,
+    "companyId": int,
+    "planId": int,
+    "isActive": bool,
+    "isDependant": bool
+}
+
+
+def _email_validator():
+    # Imported on first use, not at app startup: it compiles its RFC 5322 regexes at import time
+    import email_validator
+    return email_validator
+
+
+# Formats dob was stored in as text before it became a date column (see migrations/0004_typed_dob.sql);
+# clients and spreadsheets still send all of them
+DOB_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%Y/%m/%d")
+
+
+def parse_dob(value):
+    # users.dob is a date column; accepts a date or a string in any of DOB_FORMATS. Raises ValueError otherwise.
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str):
+        raise ValueError("'dob' should be a date in YYYY-MM-DD or MM/DD/YYYY format.")
+    for fmt in DOB_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"'{value}' is not a valid date of birth; use YYYY-MM-DD or MM/DD/YYYY.")
+
+
+def age_on(dob, day):
+    # Whole years from dob to `day`, as Postgres' age() counts them (29 February birthdays move to 1 March)
+    return day.year - dob.year - ((day.month, day.day) < (dob.month, dob.day))
+
+
+def with_age(data):
+    # `data` with dob parsed and age derived from it, so written rows never wait for the next recompute
+    if "dob" not in data:
+        return data
+    if data["dob"] is None:
+        return dict(data, age=None)
+    dob = parse_dob(data["dob"])
+    return dict(data, dob=dob, age=age_on(dob, date.today()))
+
+
+def check_user_row(data, action):
+    # The validation error for one row, or {} when it passes
+    if action in ["update", "toggle"] and "documentId" not in data:
+        return {"error": "Bad Request", "message": "'documentId' is required for update and toggle operations."}
+
+    if action == "deactivate":
+        # Roster removals: only the user and the company it must belong to
+        for field in ("documentId", "companyId"):
+            if data.get(field) is None:
+                return {"error": "Bad Request", "message": f"'{field}' is required for deactivate operations."}
+            if not isinstance(data[field], int) or isinstance(data[field], bool):
+                return {"error": "Bad Request", "message": f"'{field}' should be of type int."}
+        return {}
+
+    for field, expected_type in REQUIRED_FIELDS.items():
+        value = data.get(field)
+        if value is None:
+            return {"error": "Bad Request", "message": f"'{field}' is required."}
+        if not isinstance(value, expected_type):
+            return {"error": "Bad Request", "message": f"'{field}' should be of type {expected_type.__name__}."}
+
+    try:
+        parse_dob(data["dob"])
+    except ValueError as e:
+        return {"error": "Bad Request", "message": str(e)}
+
+    email_validator = _email_validator()
+    try:
+        email_validator.validate_email(data["email"], check_deliverability=False)
+    except email_validator.EmailNotValidError as e:
+        return {"error": "Bad Request", "message": f"'{data['email']}' is not a valid email address: {e}"}
+
+    return {}
+
+
+def _check_chunk(rows):
+    # Runs in a worker process; rows are (user_data, action) pairs
+    return [check_user_row(data, action) if isinstance(data, dict) else None for data, action in rows]
+
+
+def check_operations(operations, executor=None, min_parallel_rows=2000, chunk_size=1000):
+    # One result per operation, in order: the check_user_row() result, or None when the operation
+    # is not a dict with a dict user_data (the caller reports those). Payloads smaller than
+    # `min_parallel_rows`, or without an executor, are checked inline.
+    rows = [
+        (operation.get("user_data"), operation.get("action")) if isinstance(operation, dict) else (None, None)
+        for operation in operations
+    ]
+    if executor is None or len(rows) < min_parallel_rows:
+        return _check_chunk(rows)
+
+    chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+    checked = []
+    for results in executor.map(_check_chunk, chunks):
+        checked.extend(results)
+    return checked
@@ -0,0 +1,256 @@
+import argparse
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Append-only user change log: one compact JSON object per line in size-rotated segments. Every
+# writer (one per process) owns its own segments, so several workers never share a file, a sequence
+# or a summary:
+#
+#   changes-<writer>-000001.ndjson   rotated segment
+#   changes-<writer>-000001.idx      its summary (time range, companyIds, documentIds) used to skip it on queries
+#   changes-<writer>-000002.ndjson   active segment, no summary yet
+#
+# A segment is summarized when it rotates or its writer closes; segments of a writer that died
+# without closing have no summary and are always scanned. Queries merge every writer's records by time,
+# which relies on each writer stamping its records in order: ts is set under the writer's lock as a
+# batch is appended, never before, and never goes backwards.
+#
+# Records: {"ts": <epoch ms when written>, "op": "add"|"update"|"toggle", "source": <route or job>,
+#           "documentId": ..., "companyId": ..., "data": <row after the change>}
+# plus "id", the change_outbox row they came through (see oldApi.drain_change_outbox), when they did.
+
+# changes-000001.ndjson (no writer) is the layout from before per-writer segments
+SEGMENT_PATTERN = re.compile(r"^changes-(?:([0-9a-z]+)-)?(\d{6})\.ndjson$")
+
+
+def _segment_name(writer, sequence):
+    return f"changes-{writer}-{sequence:06d}" if writer else f"changes-{sequence:06d}"
+
+
+def _segment_path(folder, writer, sequence):
+    return os.path.join(folder, _segment_name(writer, sequence) + ".ndjson")
+
+
+def _index_path(folder, writer, sequence):
+    return os.path.join(folder, _segment_name(writer, sequence) + ".idx")
+
+
+def encode_record(record):
+    return json.dumps(record, separators=(",", ":"), default=str)
+
+
+class SegmentSummary:
+    def __init__(self):
+        self.records = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.company_ids = set()
+        self.document_ids = set()
+
+    def add(self, record):
+        self.records += 1
+        self.first_ts = record["ts"] if self.first_ts is None else min(self.first_ts, record["ts"])
+        self.last_ts = record["ts"] if self.last_ts is None else max(self.last_ts, record["ts"])
+        if record.get("companyId") is not None:
+            self.company_ids.add(record["companyId"])
+        if record.get("documentId") is not None:
+            self.document_ids.add(record["documentId"])
+
+    def serialize(self):
+        return {
+            'records': self.records,
+            'first_ts': self.first_ts,
+            'last_ts': self.last_ts,
+            'company_ids': sorted(self.company_ids),
+            'document_ids': sorted(self.document_ids),
+        }
+
+
+class ChangeLog:
+    def __init__(self, folder, max_segment_bytes=64 * 1024 * 1024):
+        self.folder = folder
+        self.max_segment_bytes = max_segment_bytes
+        self.writer = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._sequence = None
+        self._summary = None
+        self._last_ts = 0
+
+    def _open(self):
+        # A fresh writer id per process (and per reopen), so no other writer ever touches these files
+        os.makedirs(self.folder, exist_ok=True)
+        self.writer = f"{os.getpid():x}{uuid.uuid4().hex[:8]}"
+        self._sequence = 1
+        self._summary = SegmentSummary()
+        self._file = open(_segment_path(self.folder, self.writer, self._sequence), "ab")
+
+    def _write_summary(self):
+        index_path = _index_path(self.folder, self.writer, self._sequence)
+        with open(index_path + ".tmp", "w") as index:
+            json.dump(self._summary.serialize(), index, separators=(",", ":"))
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(index_path + ".tmp", index_path)
+
+    def _rotate(self):
+        self._file.close()
+        self._write_summary()
+        self._sequence += 1
+        self._summary = SegmentSummary()
+        self._file = open(_segment_path(self.folder, self.writer, self._sequence), "ab")
+
+    def append(self, records):
+        # One write and one fsync per batch, every record stamped with the same ts. Returns the
+        # stamped records.
+        if not records:
+            return []
+        with self._lock:
+            self._last_ts = max(int(time.time() * 1000), self._last_ts)
+            records = [dict(record, ts=self._last_ts) for record in records]
+            payload = b"".join(encode_record(record).encode("utf-8") + b"\n" for record in records)
+            if self._file is None:
+                self._open()
+            end = self._file.tell()
+            try:
+                self._file.write(payload)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                # Cut a partly written batch off, so the next append starts on a line boundary
+                self._file.truncate(end)
+                self._file.seek(end)
+                raise
+            for record in records:
+                self._summary.add(record)
+            if self._file.tell() >= self.max_segment_bytes:
+                self._rotate()
+        return records
+
+    def close(self):
+        # Summarizes the active segment so queries can skip it
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                if self._summary.records:
+                    self._write_summary()
+
+
+def make_record(op, source, row):
+    # ts is added by ChangeLog.append
+    return {
+        "op": op,
+        "source": source,
+        "documentId": row.get("documentId"),
+        "companyId": row.get("companyId"),
+        "data": dict(row),
+    }
+
+
+def list_segments(folder):
+    # {writer: [sequence, ...]} with sequences ascending; the pre-writer layout is writer ""
+    if not os.path.isdir(folder):
+        return {}
+    writers = {}
+    for match in map(SEGMENT_PATTERN.match, os.listdir(folder)):
+        if match:
+            writers.setdefault(match.group(1) or "", []).append(int(match.group(2)))
+    return {writer: sorted(sequences) for writer, sequences in writers.items()}
+
+
+def _read_segment(path):
+    # A torn write can leave a partial last line (no newline) or, from older versions, a corrupt one;
+    # both are skipped
+    with open(path, "rb") as segment:
+        for line_no, line in enumerate(segment, start=1):
+            if not line.endswith(b"\n"):
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning("Skipping corrupt change log line %d in %s", line_no, path)
+
+
+def _segment_may_match(summary, document_id, company_id, since, until):
+    if summary["records"] == 0:
+        return False
+    if since is not None and summary["last_ts"] < since:
+        return False
+    if until is not None and summary["first_ts"] > until:
+        return False
+    if document_id is not None and document_id not in summary["document_ids"]:
+        return False
+    if company_id is not None and company_id not in summary["company_ids"]:
+        return False
+    return True
+
+
+def _iter_writer(folder, writer, sequences, document_id, company_id, since, until):
+    for sequence in sequences:
+        index_path = _index_path(folder, writer, sequence)
+        if os.path.exists(index_path):
+            with open(index_path) as index:
+                if not _segment_may_match(json.load(index), document_id, company_id, since, until):
+                    continue
+        for record in _read_segment(_segment_path(folder, writer, sequence)):
+            if document_id is not None and record.get("documentId") != document_id:
+                continue
+            if company_id is not None and record.get("companyId") != company_id:
+                continue
+            if since is not None and record["ts"] < since:
+                continue
+            if until is not None and record["ts"] > until:
+                continue
+            yield record
+
+
+def query(folder, document_id=None, company_id=None, since=None, until=None, limit=None):
+    # Yields matching records oldest first, merged across writers; segments whose summary rules them
+    # out are never opened. `since`/`until` are epoch milliseconds.
+    if limit is not None and limit <= 0:
+        return
+    streams = [
+        _iter_writer(folder, writer, sequences, document_id, company_id, since, until)
+        for writer, sequences in sorted(list_segments(folder).items())
+    ]
+    found = 0
+    for record in heapq.merge(*streams, key=lambda record: record["ts"]):
+        yield record
+        found += 1
+        if limit is not None and found >= limit:
+            return
+
+
+def to_epoch_ms(value):
+    if value is None:
+        return None
+    if re.fullmatch(r"\d+", value):
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay or filter the user change log.")
+    parser.add_argument("folder", help="changelog folder (config.ini [DEFAULT] changelog)")
+    parser.add_argument("--document-id", type=int)
+    parser.add_argument("--company-id", type=int)
+    parser.add_argument("--since", help="ISO timestamp or epoch milliseconds")
+    parser.add_argument("--until", help="ISO timestamp or epoch milliseconds")
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    for record in query(args.folder, args.document_id, args.company_id,
+                        to_epoch_ms(args.since), to_epoch_ms(args.until), args.limit):
+        print(encode_record(record))
+
+
+if __name__ == "__main__":
+    main()
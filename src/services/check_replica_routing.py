@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+from sqlalchemy import create_engine, text
+
+# Checks read-replica routing against two local Postgres instances standing in for the primary and
+# the replica. They don't need to replicate: both are seeded the same way, then the company's name is
+# set to "primary" in one and "replica" in the other, so every response shows which database served it.
+#
+#   python bench_api.py seed --database-url postgresql://localhost:5432/magicpill_bench --users 1000 --reset
+#   python bench_api.py seed --database-url postgresql://localhost:5433/magicpill_bench --users 1000 --reset
+#   python check_replica_routing.py --primary-url postgresql://localhost:5432/magicpill_bench \
+#       --replica-url postgresql://localhost:5433/magicpill_bench
+#
+# Prints each check as JSON and exits 1 if any failed. Never point this at real databases: it renames
+# a company (restored afterwards) and creates and deletes an admin.
+
+COMPANY_NAME_SQL = 'UPDATE insurance_companies SET name = :name WHERE "companyId" = :company_id RETURNING 1'
+READ_NAME_SQL = 'SELECT name FROM insurance_companies WHERE "companyId" = :company_id'
+
+
+def set_company_name(url, company_id, name):
+    engine = create_engine(url)
+    try:
+        with engine.begin() as connection:
+            previous = connection.execute(text(READ_NAME_SQL), {"company_id": company_id}).scalar()
+            if connection.execute(text(COMPANY_NAME_SQL), {"name": name, "company_id": company_id}).first() is None:
+                raise SystemExit(f"Company {company_id} does not exist in {url}; seed it with bench_api.py first.")
+        return previous
+    finally:
+        engine.dispose()
+
+
+def company_name(client, path):
+    response = client.get(path)
+    if response.status_code != 200:
+        return f"HTTP {response.status_code}"
+    return response.get_json()["results"][0]["company"]["name"]
+
+
+def run_checks(company_id, sticky_seconds):
+    # Imported here so DATABASE_URL and REPLICA_DATABASE_URL are set first
+    import oldApi
+
+    oldApi.replica_sticky_seconds = sticky_seconds
+    client = oldApi.create_app().test_client()
+    checks = []
+
+    def check(name, actual, expected):
+        checks.append({"check": name, "expected": expected, "actual": actual, "ok": actual == expected})
+
+    check("read route uses the replica", company_name(client, f"/company/{company_id}"), "replica")
+    check("other routes use the primary", company_name(client, f"/company/{company_id}/users?limit=1"), "primary")
+
+    email = f"replica-check-{uuid.uuid4().hex[:12]}@example.com"
+    created = client.post("/admins", json={"admin_username": "replica-check", "admin_email": email, "companyId": company_id})
+    check("write succeeds on the primary", created.status_code, 201)
+    check("read after a write sees it", client.get(f"/admins/email/{email}").get_json().get("exists"), True)
+    check("read after a write uses the primary", company_name(client, f"/company/{company_id}"), "primary")
+    check("another client's read after the write uses the replica",
+          company_name(oldApi.create_app().test_client(), f"/company/{company_id}"), "replica")
+
+    time.sleep(sticky_seconds + 0.2)
+    check("read after the sticky window uses the replica", company_name(client, f"/company/{company_id}"), "replica")
+
+    if created.status_code == 201:
+        client.delete(f"/admins/{created.get_json()['admin_id']}")
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check read-replica routing against two local Postgres instances.")
+    parser.add_argument("--primary-url", required=True)
+    parser.add_argument("--replica-url", required=True)
+    parser.add_argument("--company-id", type=int, default=1)
+    parser.add_argument("--sticky-seconds", type=float, default=1.0, help="shortened sticky window for the check")
+    args = parser.parse_args()
+    if args.primary_url == args.replica_url:
+        parser.error("--primary-url and --replica-url must be different databases")
+
+    os.environ["DATABASE_URL"] = args.primary_url
+    os.environ["REPLICA_DATABASE_URL"] = args.replica_url
+    names = {
+        url: set_company_name(url, args.company_id, label)
+        for url, label in ((args.primary_url, "primary"), (args.replica_url, "replica"))
+    }
+    try:
+        checks = run_checks(args.company_id, args.sticky_seconds)
+    finally:
+        for url, name in names.items():
+            set_company_name(url, args.company_id, name)
+
+    print(json.dumps(checks, indent=2))
+    sys.exit(0 if all(check["ok"] for check in checks) else 1)
+
+
+if __name__ == "__main__":
+    main()
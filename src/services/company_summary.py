@@ -0,0 +1,92 @@
+import argparse
+import json
+
+from sqlalchemy import Integer, any_, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from models import CompanySummary
+
+# Company headcounts from company_summaries: at most (plans x 4) rows per company, so a summary
+# costs the same for ten members as for a million. The triggers in models.py keep the table current;
+# rebuild() recounts it from users when it has drifted (restored backups, writes with the triggers
+# disabled) and is also available from the command line:
+#
+#   python company_summary.py rebuild                    every company
+#   python company_summary.py rebuild --company-id 3     just these companies
+
+# Blocks writes to users (reads carry on) so no trigger delta lands between the delete and the recount
+LOCK_USERS_SQL = "LOCK TABLE users IN SHARE MODE"
+
+REBUILD_SQL = """
+INSERT INTO company_summaries ("companyId", "planId", "isActive", "isDependant", members)
+SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), count(*)
+FROM users
+WHERE "companyId" IS NOT NULL {companies}
+GROUP BY 1, 2, 3, 4
+"""
+
+
+def _counts(members, is_active, is_dependant):
+    return {
+        "members": members,
+        "active": members if is_active else 0,
+        "inactive": 0 if is_active else members,
+        "dependants": members if is_dependant else 0,
+    }
+
+
+def _add(totals, counts):
+    for key, value in counts.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def company_summary(session, company_id, plans):
+    # {"members", "active", "inactive", "dependants", "plans": [...]} for one company; `plans` maps
+    # planId to the serialized plan (see oldApi.cached_plans)
+    rows = session.query(CompanySummary).filter(CompanySummary.companyId == company_id, CompanySummary.members != 0)
+    totals = _counts(0, False, False)
+    by_plan = {}
+    for row in rows:
+        counts = _counts(row.members, row.isActive, row.isDependant)
+        _add(totals, counts)
+        _add(by_plan.setdefault(row.planId, {}), counts)
+
+    return dict(totals, plans=[
+        dict(counts, planId=plan_id or None, planName=(plans.get(plan_id) or {}).get("planName"))
+        for plan_id, counts in sorted(by_plan.items())
+    ])
+
+
+def rebuild(session, company_ids=None):
+    # Recounts the given companies (all when None) in the caller's transaction; returns the number
+    # of summary rows written
+    session.execute(text(LOCK_USERS_SQL))
+    summaries = CompanySummary.__table__
+    if company_ids is None:
+        session.execute(summaries.delete())
+        return session.execute(text(REBUILD_SQL.format(companies=""))).rowcount
+
+    ids = bindparam("ids", sorted(company_ids), type_=ARRAY(Integer))
+    session.execute(summaries.delete().where(summaries.c.companyId == any_(ids)))
+    statement = text(REBUILD_SQL.format(companies='AND "companyId" = ANY(:ids)')).bindparams(ids)
+    return session.execute(statement).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the company_summaries headcount table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="recount company_summaries from users")
+    rebuild_parser.add_argument("--company-id", type=int, action="append", help="repeatable; default every company")
+    args = parser.parse_args()
+
+    # Imported here for its engine and config; only the command needs a database
+    import oldApi
+
+    with oldApi.session_factory() as session:
+        rows = rebuild(session, args.company_id)
+        session.commit()
+    print(json.dumps({"companies": args.company_id or "all", "summary_rows": rows}))
+
+
+if __name__ == "__main__":
+    main()
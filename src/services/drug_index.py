@@ -0,0 +1,198 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import Counter
+
+# In-memory type-ahead index over the drugs table.
+#
+# The words of drug_name, brand_name and manufacturer_name form a sorted vocabulary, so each query
+# word is a bisect range over words; word -> drug_id sets turn that into candidates, intersected
+# across query words. A query word with no prefix match (a typo) is matched by trigram overlap
+# against the vocabulary instead, which is far smaller than the drug list.
+# Results come back in drug_name order, names starting with the query first, read straight off a
+# name-sorted list so the common case never sorts the candidate set.
+
+SEARCH_FIELDS = ("drug_name", "brand_name", "manufacturer_name")
+FACETS = ("plan_type", "is_free", "is_high_cost")
+MIN_TRIGRAM_SCORE = 0.5
+# Below this many candidates sorting them is cheaper than walking the name list
+SMALL_CANDIDATE_SET = 2000
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def words(text):
+    return _WORD.findall((text or "").lower())
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _name_key(drug):
+    return (" ".join(words(drug.get("drug_name"))), drug["drug_id"])
+
+
+class DrugIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+        self.built = False
+
+    def _reset(self):
+        self._drugs = {}
+        self._drug_words = {}
+        self._word_ids = {}
+        self._vocabulary = []
+        self._trigrams = {}
+        self._names = []
+        self._facets = {facet: {} for facet in FACETS}
+
+    def __len__(self):
+        return len(self._drugs)
+
+    def build(self, drugs):
+        # Full build into a fresh index that replaces this one in a single swap
+        fresh = DrugIndex()
+        for drug in drugs:
+            fresh._add(drug, sort_later=True)
+        fresh._vocabulary.sort()
+        fresh._names.sort()
+        with self._lock:
+            self.__dict__.update({key: value for key, value in fresh.__dict__.items() if key != "_lock"})
+            self.built = True
+
+    def upsert(self, drugs):
+        # Incremental refresh for a handful of changed or new rows
+        with self._lock:
+            for drug in drugs:
+                self._remove(drug["drug_id"])
+                self._add(drug)
+
+    def sync(self, drugs):
+        # Incremental refresh against the whole table: reindexes only rows that are new or differ from
+        # the indexed copy, and drops ids no longer present. Returns the number of rows changed.
+        drugs = {drug["drug_id"]: drug for drug in drugs}
+        with self._lock:
+            changed = [drug for drug_id, drug in drugs.items() if self._drugs.get(drug_id) != drug]
+            removed = [drug_id for drug_id in self._drugs if drug_id not in drugs]
+            self.upsert(changed)
+            self.remove(removed)
+        return len(changed) + len(removed)
+
+    def remove(self, drug_ids):
+        with self._lock:
+            for drug_id in drug_ids:
+                self._remove(drug_id)
+
+    def _add(self, drug, sort_later=False):
+        drug_id = drug["drug_id"]
+        drug_words = set()
+        for field in SEARCH_FIELDS:
+            drug_words.update(words(drug.get(field)))
+        self._drugs[drug_id] = drug
+        self._drug_words[drug_id] = drug_words
+        for word in drug_words:
+            ids = self._word_ids.get(word)
+            if ids is None:
+                ids = self._word_ids[word] = set()
+                if sort_later:
+                    self._vocabulary.append(word)
+                else:
+                    bisect.insort(self._vocabulary, word)
+                for trigram in trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+            ids.add(drug_id)
+        if sort_later:
+            self._names.append(_name_key(drug))
+        else:
+            bisect.insort(self._names, _name_key(drug))
+        for facet in FACETS:
+            self._facets[facet].setdefault(drug.get(facet), set()).add(drug_id)
+
+    def _remove(self, drug_id):
+        drug = self._drugs.pop(drug_id, None)
+        if drug is None:
+            return
+        for word in self._drug_words.pop(drug_id):
+            ids = self._word_ids[word]
+            ids.discard(drug_id)
+            if not ids:
+                del self._word_ids[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].discard(word)
+        position = bisect.bisect_left(self._names, _name_key(drug))
+        if position < len(self._names) and self._names[position][1] == drug_id:
+            del self._names[position]
+        for facet in FACETS:
+            self._facets[facet].get(drug.get(facet), set()).discard(drug_id)
+
+    def _prefix_words(self, prefix):
+        # Words are [a-z0-9] only, so every word starting with `prefix` sorts below prefix + "{"
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "{", start)
+        return self._vocabulary[start:end]
+
+    def _similar_words(self, word):
+        wanted = trigrams(word)
+        counts = Counter()
+        for trigram in wanted:
+            counts.update(self._trigrams.get(trigram, ()))
+        return [candidate for candidate, hits in counts.items() if hits / len(wanted) >= MIN_TRIGRAM_SCORE]
+
+    def _word_matches(self, word):
+        matched = self._prefix_words(word) or self._similar_words(word)
+        if len(matched) == 1:
+            return self._word_ids[matched[0]]
+        ids = set()
+        for candidate in matched:
+            ids |= self._word_ids[candidate]
+        return ids
+
+    def _ranked(self, candidates, limit, prefix=""):
+        # Name order, names starting with `prefix` first. Small candidate sets are sorted directly;
+        # large ones are dense enough that walking the name-sorted list finds `limit` hits quickly.
+        if candidates is not None and len(candidates) <= SMALL_CANDIDATE_SET:
+            def rank(drug_id):
+                key = _name_key(self._drugs[drug_id])
+                return (not key[0].startswith(prefix), key)
+            return heapq.nsmallest(limit, candidates, key=rank)
+
+        found = []
+        if prefix:
+            position = bisect.bisect_left(self._names, (prefix,))
+            while position < len(self._names) and len(found) < limit:
+                name, drug_id = self._names[position]
+                if not name.startswith(prefix):
+                    break
+                if drug_id in candidates:
+                    found.append(drug_id)
+                position += 1
+        leading = set(found)
+        for name, drug_id in self._names:
+            if len(found) == limit:
+                break
+            if (candidates is None or drug_id in candidates) and drug_id not in leading:
+                found.append(drug_id)
+        return found
+
+    def search(self, query, limit=20, plan_type=None, is_free=None, is_high_cost=None):
+        query_words = words(query)
+        with self._lock:
+            candidates = None
+            for facet, value in zip(FACETS, (plan_type, is_free, is_high_cost)):
+                if value is not None:
+                    ids = self._facets[facet].get(value, set())
+                    candidates = ids if candidates is None else candidates & ids
+
+            for word in query_words:
+                ids = self._word_matches(word)
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+
+            ranked = self._ranked(candidates, limit, prefix=query_words[0] if query_words else "")
+            return [self._drugs[drug_id] for drug_id in ranked]
@@ -0,0 +1,256 @@
+import io
+
+from ingest import TRUE_VALUES, FALSE_VALUES, MAX_ROW_ERRORS, cell_text, header_key
+
+# Monthly formulary import.
+#
+# The file is read in batches of rows, each batch cleaned column-at-a-time with pandas and streamed
+# with COPY into drugs_next, a fresh copy of the drugs table. drugs_next then replaces drugs by two
+# renames at the very end of the same transaction, so readers see the old formulary or the new one,
+# never a partial load. The replaced table is kept as drugs_previous until the next import.
+
+# Drug columns a formulary row is normalized to, in COPY order; drug_id is optional in the file
+DRUG_COLUMNS = [
+    "drug_id", "drug_name", "manufacturer_name", "brand_name", "cost",
+    "is_urgent", "is_high_cost", "is_free", "plan_type", "drug_form",
+    "dosage", "max_supply_30", "max_supply_90",
+]
+
+TEXT_COLUMNS = ["drug_name", "manufacturer_name", "brand_name", "plan_type", "drug_form", "dosage"]
+FLAG_COLUMNS = ["is_urgent", "is_high_cost", "is_free"]
+SUPPLY_COLUMNS = ["max_supply_30", "max_supply_90"]
+
+HEADER_ALIASES = {
+    "drugid": "drug_id",
+    "id": "drug_id",
+    "drugname": "drug_name",
+    "name": "drug_name",
+    "manufacturer": "manufacturer_name",
+    "manufacturername": "manufacturer_name",
+    "brand": "brand_name",
+    "brandname": "brand_name",
+    "cost": "cost",
+    "price": "cost",
+    "isurgent": "is_urgent",
+    "urgent": "is_urgent",
+    "ishighcost": "is_high_cost",
+    "highcost": "is_high_cost",
+    "isfree": "is_free",
+    "free": "is_free",
+    "plantype": "plan_type",
+    "drugform": "drug_form",
+    "form": "drug_form",
+    "dosage": "dosage",
+    "maxsupply30": "max_supply_30",
+    "maxsupply90": "max_supply_90",
+}
+
+FLAG_VALUES = {**{value: True for value in TRUE_VALUES}, **{value: False for value in FALSE_VALUES}}
+
+# Serializes concurrent imports; both would otherwise rebuild drugs_next
+IMPORT_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('formulary_import'))"
+
+
+def _pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ValueError("Formulary imports require pandas to be installed.")
+    return pandas
+
+
+def iter_formulary_batches(path, batch_size):
+    # Yields raw DataFrames of cell text, `batch_size` rows at a time
+    extension = path.rsplit('.', 1)[1].lower()
+    if extension == "csv":
+        return _iter_csv_batches(path, batch_size)
+    if extension == "xlsx":
+        return _iter_xlsx_batches(path, batch_size)
+    raise ValueError(f"Unsupported file type: {extension}")
+
+
+def _iter_csv_batches(path, batch_size):
+    pandas = _pandas()
+    with pandas.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig",
+                         chunksize=batch_size) as reader:
+        yield from reader
+
+
+def _iter_xlsx_batches(path, batch_size):
+    pandas = _pandas()
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX formularies require openpyxl to be installed.")
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(cell) if cell is not None else "" for cell in header]
+        batch = []
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            # openpyxl hands cells over one by one anyway; XLSX whole numbers lose their ".0" here
+            batch.append([cell_text(value) for value in values])
+            if len(batch) == batch_size:
+                yield pandas.DataFrame(batch, columns=header, dtype=str)
+                batch = []
+        if batch:
+            yield pandas.DataFrame(batch, columns=header, dtype=str)
+    finally:
+        workbook.close()
+
+
+def _strings(column):
+    # Stripped cell text, blanks as NA
+    text = column.astype("string").str.strip()
+    return text.mask(text == "")
+
+
+def _numbers(text):
+    # Parsed numbers as plain float64, anything unparseable as NaN, so comparisons give False not NA
+    pandas = _pandas()
+    numbers = pandas.to_numeric(text, errors="coerce").astype("Float64")
+    return pandas.Series(numbers.to_numpy(dtype="float64", na_value=float("nan")), index=text.index)
+
+
+def normalize_drug_batch(frame, first_row, errors, seen_ids=None):
+    # Cleans one raw batch into DRUG_COLUMNS; rows that fail land in `errors` (capped) and are dropped.
+    # Row numbers count data rows from 1, as in roster imports. `seen_ids` maps each drug_id loaded
+    # by earlier batches of the same file to its row, and is updated with this batch's.
+    pandas = _pandas()
+    frame = frame.rename(columns=lambda header: HEADER_ALIASES.get(header_key(header), None))
+    frame = frame.loc[:, [column for column in frame.columns if column is not None]]
+    frame = frame.loc[:, ~frame.columns.duplicated()].reset_index(drop=True)
+    if "drug_name" not in frame.columns:
+        raise ValueError("The formulary file has no drug name column.")
+
+    clean = pandas.DataFrame(index=frame.index)
+    problems = pandas.Series(pandas.NA, index=frame.index, dtype="string")
+
+    def reject(mask, messages):
+        nonlocal problems
+        problems = problems.mask(problems.isna() & mask.fillna(False).astype(bool), messages)
+
+    for column in TEXT_COLUMNS:
+        clean[column] = _strings(frame[column]) if column in frame.columns else pandas.Series(pandas.NA, index=frame.index, dtype="string")
+    reject(clean["drug_name"].isna(), "'drug_name' is required.")
+
+    if "drug_id" in frame.columns:
+        raw = _strings(frame["drug_id"])
+        drug_id = _numbers(raw)
+        reject(raw.isna(), "'drug_id' is required when the file has a drug_id column.")
+        valid = (drug_id > 0) & (drug_id % 1 == 0)
+        reject(raw.notna() & ~valid, "'" + raw + "' is not a valid drug_id.")
+        clean["drug_id"] = drug_id.where(valid).astype("Int64")
+
+    if "cost" in frame.columns:
+        raw = _strings(frame["cost"]).str.replace(r"[\s$,]", "", regex=True)
+        cost = _numbers(raw)
+        reject(raw.notna() & ~(cost >= 0), "'" + raw + "' is not a valid cost.")
+        clean["cost"] = cost.round(2)
+    else:
+        clean["cost"] = pandas.Series(float("nan"), index=frame.index)
+
+    for column in FLAG_COLUMNS:
+        if column not in frame.columns:
+            clean[column] = False
+            continue
+        raw = _strings(frame[column]).str.lower()
+        flag = raw.map(FLAG_VALUES, na_action="ignore")
+        reject(raw.notna() & flag.isna(), "'" + raw + "' is not a valid yes/no value.")
+        clean[column] = flag.fillna(False).astype(bool)
+
+    for column in SUPPLY_COLUMNS:
+        if column not in frame.columns:
+            clean[column] = pandas.Series(pandas.NA, index=frame.index, dtype="Int64")
+            continue
+        raw = _strings(frame[column]).str.replace(",", "", regex=False)
+        supply = _numbers(raw)
+        valid = (supply >= 0) & (supply % 1 == 0)
+        reject(raw.notna() & ~valid, f"'{column}' must be a whole number of units.")
+        clean[column] = supply.where(valid).astype("Int64")
+
+    if "drug_id" in clean.columns:
+        _reject_repeated_ids(clean["drug_id"].where(problems.isna()), first_row, seen_ids, reject)
+
+    bad = problems.notna()
+    if bad.any():
+        errors["count"] += int(bad.sum())
+        room = MAX_ROW_ERRORS - len(errors["rows"])
+        for position, message in problems[bad].head(max(room, 0)).items():
+            errors["rows"].append({"error": "Bad Request", "message": message, "row": first_row + position})
+
+    columns = [column for column in DRUG_COLUMNS if column in clean.columns]
+    return clean.loc[~bad, columns]
+
+
+def _reject_repeated_ids(drug_ids, first_row, seen_ids, reject):
+    # drug_id is the primary key of the new table: a repeat is a rejected row, not a failed import.
+    # `drug_ids` holds NA for rows already rejected, so they never claim an id.
+    pandas = _pandas()
+    seen_ids = {} if seen_ids is None else seen_ids
+    rows = pandas.Series(range(first_row, first_row + len(drug_ids)), index=drug_ids.index)
+    keyed = pandas.DataFrame({"drug_id": drug_ids, "row": rows}).dropna(subset=["drug_id"])
+    first_in_batch = keyed.drop_duplicates("drug_id").set_index("drug_id")["row"]
+    first_seen = keyed["drug_id"].map(seen_ids).fillna(keyed["drug_id"].map(first_in_batch)).astype("int64")
+    repeated = (keyed["row"] != first_seen).reindex(drug_ids.index, fill_value=False)
+    reject(repeated, "drug_id " + drug_ids.astype("string") + " is repeated; it first appears on row " + first_seen.astype("string") + ".")
+    seen_ids.update((drug_id, row) for drug_id, row in first_in_batch.items() if drug_id not in seen_ids)
+
+
+def _copy_batch(cursor, frame):
+    # CSV COPY: to_csv writes NA as an unquoted empty field, which COPY reads as NULL
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    columns = ", ".join(frame.columns)
+    cursor.copy_expert(f"COPY drugs_next ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load_formulary(session, batches, source, errors):
+    # Builds drugs_next from the raw batches and swaps it in for drugs. The caller owns the
+    # transaction; the swap takes effect when it commits. Returns the new formulary version.
+    dbapi_connection = session.connection().connection
+    cursor = dbapi_connection.cursor()
+    loaded = 0
+    first_row = 1
+    seen_ids = {}
+    try:
+        cursor.execute(IMPORT_LOCK_SQL)
+        cursor.execute("DROP TABLE IF EXISTS drugs_next")
+        # Indexes are left off until the data is in; the primary key is added once, after COPY
+        cursor.execute("CREATE TABLE drugs_next (LIKE drugs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        for batch in batches:
+            frame = normalize_drug_batch(batch, first_row, errors, seen_ids)
+            first_row += len(batch)
+            if len(frame):
+                _copy_batch(cursor, frame)
+                loaded += len(frame)
+        if not loaded:
+            raise ValueError("The formulary file has no valid drug rows.")
+
+        cursor.execute("INSERT INTO formulary_versions (source, drugs) VALUES (%s, %s) RETURNING version", (source, loaded))
+        version = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE drugs_next ADD CONSTRAINT drugs_pkey_v{version} PRIMARY KEY (drug_id)")
+        cursor.execute("ANALYZE drugs_next")
+
+        # The drug_id sequence belongs to the old table; move it over before that table is dropped
+        cursor.execute("SELECT pg_get_serial_sequence('drugs', 'drug_id')")
+        sequence = cursor.fetchone()[0]
+        if sequence:
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY drugs_next.drug_id")
+            cursor.execute(f"SELECT setval('{sequence}', GREATEST((SELECT max(drug_id) FROM drugs_next), 1))")
+
+        # Readers block on these renames only until commit, which follows immediately
+        cursor.execute("DROP TABLE IF EXISTS drugs_previous")
+        cursor.execute("ALTER TABLE drugs RENAME TO drugs_previous")
+        cursor.execute("ALTER TABLE drugs_next RENAME TO drugs")
+    finally:
+        cursor.close()
+
+    return {"version": version, "loaded": loaded}
@@ -0,0 +1,105 @@
+import logging
+import threading
+from datetime import timedelta
+
+from sqlalchemy import Date, Integer, and_, bindparam, cast, func, select, update
+
+from models import User, USER_FIELDS
+
+# Ages and age-based eligibility, derived from users.dob.
+#
+# users.age is a stored copy of the age as of the last recompute: one UPDATE per company sets it
+# from dob with Postgres' age(), touching only the rows whose age changed (birthdays since the last
+# run), and returns those rows for the change log. Upcoming changes (a dependant turning 26, say)
+# are dob range scans on ix_users_companyId_dob.
+
+ELIGIBILITY_FIELDS = [
+    "documentId", "firstName", "lastName", "email", "dob", "age", "planId", "isActive", "isDependant",
+]
+
+
+def age_expression(as_of):
+    # Whole years between dob and `as_of`; someone born on 29 February turns a year older on 1 March
+    return cast(func.date_part("year", func.age(bindparam("as_of", as_of, type_=Date), User.dob)), Integer)
+
+
+def recompute_company_ages(session, company_id, as_of):
+    # Rows whose age changed, after updating them; None when another process is already updating
+    # this company (every process that runs the schedule tries each company)
+    if session.get_bind().dialect.name == "postgresql":
+        locked = session.execute(select(func.pg_try_advisory_xact_lock(func.hashtext("user_ages"), company_id))).scalar()
+        if not locked:
+            return None
+    users = User.__table__
+    age = age_expression(as_of)
+    statement = (
+        update(users)
+        .where(users.c.companyId == company_id, users.c.dob.isnot(None), users.c.age.is_distinct_from(age))
+        .values(age=age)
+        .returning(*[users.c[field] for field in USER_FIELDS])
+    )
+    return session.execute(statement).mappings().all()
+
+
+def add_years(day, years):
+    # The date `years` after `day`, with 29 February landing on 1 March in other years (as age() does)
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return day.replace(year=day.year + years, month=3, day=1)
+
+
+def upcoming_birthdays(session, company_id, age, start, end, is_dependant=None, is_active=None):
+    # Users turning `age` on a day in [start, end], in the order they do, as dicts with a "turnsOn" date
+    #
+    # Births from one day earlier are read too: someone born on 29 February turns `age` on 1 March
+    # when that year has no 29 February, and the bounds below are plain year shifts.
+    lowest = add_years(start, -age) - timedelta(days=1)
+    highest = add_years(end, -age)
+    query = (
+        session.query(*[getattr(User, field) for field in ELIGIBILITY_FIELDS])
+        .filter(and_(User.companyId == company_id, User.dob.between(lowest, highest)))
+    )
+    if is_dependant is not None:
+        query = query.filter(User.isDependant == is_dependant)
+    if is_active is not None:
+        query = query.filter(User.isActive == is_active)
+
+    users = []
+    for row in query.order_by(User.dob, User.documentId):
+        turns_on = add_years(row.dob, age)
+        if start <= turns_on <= end:
+            users.append(dict(zip(ELIGIBILITY_FIELDS, row), turnsOn=turns_on))
+    users.sort(key=lambda user: (user["turnsOn"], user["documentId"]))
+    return users
+
+
+class PeriodicJob:
+    # Calls `run` every `interval_seconds` on a daemon thread until stop(); the first call comes
+    # after `initial_delay` seconds. Exceptions are logged and the schedule carries on.
+    def __init__(self, name, run, interval_seconds, initial_delay=0):
+        self.name = name
+        self.run = run
+        self.interval_seconds = interval_seconds
+        self.initial_delay = initial_delay
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        delay = self.initial_delay
+        while not self._stopped.wait(delay):
+            try:
+                self.run()
+            except Exception:
+                logging.exception("Scheduled job %s failed", self.name)
+            delay = self.interval_seconds
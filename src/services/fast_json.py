@@ -0,0 +1,77 @@
+import json
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding for large responses: orjson when it is installed, the stdlib encoder otherwise.
+# Output matches Flask's default provider (sorted keys, Decimal as string, datetimes as HTTP dates), so
+# switching encoders never changes what a response decodes to (orjson leaves non-ASCII characters
+# unescaped where the stdlib writes \u escapes). Plain dates such as User.dob are the exception:
+# both paths write them as ISO days (YYYY-MM-DD), the format clients send them in.
+
+ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+STREAM_BATCH_SIZE = 1000
+
+
+def default(value):
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+def dumps(payload):
+    # Compact JSON as bytes
+    if orjson is not None:
+        return orjson.dumps(payload, default=default, option=ORJSON_OPTIONS)
+    return json.dumps(payload, default=default, sort_keys=True,
+                      separators=(",", ":"), check_circular=False).encode("utf-8")
+
+
+# Arguments Flask's response() and the stdlib path may pass that orjson covers: output is always compact
+# with sorted keys, so `separators` and `sort_keys=True` need nothing, and `indent` becomes OPT_INDENT_2
+ORJSON_COMPATIBLE_KWARGS = {"separators", "indent", "sort_keys", "default", "ensure_ascii"}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # app.json provider: jsonify() and app.json.response() go through orjson, including the
+    # `separators`/`indent` arguments Flask always passes; anything else keeps the stdlib path
+    default = staticmethod(default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - ORJSON_COMPATIBLE_KWARGS or kwargs.get("sort_keys") is False:
+            return super().dumps(obj, **kwargs)
+        option = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if kwargs.get("indent") else 0)
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(tuple(row))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_ndjson(fields, rows, batch_size=STREAM_BATCH_SIZE):
+    # One JSON object per line, encoded and sent a batch at a time
+    for batch in _batches(rows, batch_size):
+        yield b"".join(dumps(dict(zip(fields, row))) + b"\n" for row in batch)
+
+
+def iter_columnar(fields, rows, head=None, batch_size=STREAM_BATCH_SIZE):
+    # {<head>..., "fields": [...], "rows": [[...], ...]}: field names once, then each row as an array
+    yield dumps(dict(head or {}, fields=fields))[:-1] + b',"rows":['
+    first = True
+    for batch in _batches(rows, batch_size):
+        # Encode the whole batch as one list and drop its brackets
+        yield (b"" if first else b",") + dumps(batch)[1:-1]
+        first = False
+    yield b"]}"
@@ -0,0 +1,294 @@
+import csv
+import re
+from datetime import date
+
+from bulk_validation import age_on, parse_dob
+
+MAX_ROW_ERRORS = 100
+
+# User columns a roster row is normalized to, in COPY order
+ROSTER_COLUMNS = [
+    "username", "email", "firstName", "lastName", "phone", "address",
+    "dob", "age", "company", "companyId", "planId", "isActive", "isDependant",
+]
+
+# Spreadsheet headers are matched case-, space- and underscore-insensitively
+HEADER_ALIASES = {
+    "username": "username",
+    "email": "email",
+    "emailaddress": "email",
+    "firstname": "firstName",
+    "lastname": "lastName",
+    "phone": "phone",
+    "phonenumber": "phone",
+    "address": "address",
+    "dob": "dob",
+    "dateofbirth": "dob",
+    "planid": "planId",
+    "plan": "planName",
+    "planname": "planName",
+    "isactive": "isActive",
+    "active": "isActive",
+    "isdependant": "isDependant",
+    "dependant": "isDependant",
+    "isdependent": "isDependant",
+    "dependent": "isDependant",
+}
+
+TRUE_VALUES = {"true", "t", "yes", "y", "1"}
+FALSE_VALUES = {"false", "f", "no", "n", "0"}
+
+CREATE_STAGING_SQL = (
+    "CREATE TEMP TABLE users_staging ON COMMIT DROP AS SELECT "
+    + ", ".join(f'"{column}"' for column in ROSTER_COLUMNS)
+    + " FROM users WITH NO DATA; ALTER TABLE users_staging ADD COLUMN line_no bigint"
+)
+
+COPY_STAGING_SQL = (
+    "COPY users_staging ("
+    + ", ".join(f'"{column}"' for column in ROSTER_COLUMNS)
+    + ", line_no) FROM STDIN"
+)
+
+_COLUMNS = ", ".join(f'"{column}"' for column in ROSTER_COLUMNS)
+
+# Emails match case-insensitively, as in the roster diff and ix_users_email_lower. One row per
+# lower(email), the last in the file winning, paired with the existing user it matches; a user in
+# this company is preferred over one elsewhere
+RESOLVE_STAGING_SQL = (
+    "CREATE TEMP TABLE users_incoming ON COMMIT DROP AS "
+    "SELECT DISTINCT ON (lower(staged.\"email\")) staged.*, existing.\"documentId\", existing.\"companyId\" AS current_company "
+    "FROM users_staging staged LEFT JOIN LATERAL ("
+    "SELECT \"documentId\", \"companyId\" FROM users WHERE lower(users.\"email\") = lower(staged.\"email\") "
+    "ORDER BY \"companyId\" IS NOT DISTINCT FROM staged.\"companyId\" DESC, \"documentId\" LIMIT 1"
+    ") existing ON true "
+    "ORDER BY lower(staged.\"email\"), staged.line_no DESC"
+)
+
+# Rows whose email already belongs to a user of another company; they are rejected, not merged
+CONFLICTS_SQL = (
+    "SELECT line_no, \"email\" FROM users_incoming "
+    "WHERE \"documentId\" IS NOT NULL AND current_company IS DISTINCT FROM \"companyId\" ORDER BY line_no"
+)
+
+# Matched rows update their user (keeping the stored email's case); unmatched rows are inserted.
+# ON CONFLICT only covers an exact-email insert racing this one.
+MERGE_STAGING_SQL = (
+    "WITH updated AS ("
+    "UPDATE users SET "
+    + ", ".join(f'"{column}" = incoming."{column}"' for column in ROSTER_COLUMNS if column != "email")
+    + " FROM users_incoming incoming "
+    "WHERE users.\"documentId\" = incoming.\"documentId\" AND incoming.current_company = incoming.\"companyId\" "
+    "RETURNING false AS inserted, users.*"
+    "), inserted AS ("
+    f"INSERT INTO users ({_COLUMNS}) SELECT {_COLUMNS} FROM users_incoming "
+    "WHERE \"documentId\" IS NULL ORDER BY line_no "
+    "ON CONFLICT (\"email\") DO NOTHING "
+    "RETURNING true AS inserted, users.*"
+    ") SELECT * FROM updated UNION ALL SELECT * FROM inserted"
+)
+
+
+def iter_roster_file(path):
+    extension = path.rsplit('.', 1)[1].lower()
+    if extension == "csv":
+        return _iter_csv(path)
+    if extension == "xlsx":
+        return _iter_xlsx(path)
+    raise ValueError(f"Unsupported file type: {extension}")
+
+
+def _iter_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as roster:
+        yield from csv.DictReader(roster)
+
+
+def _iter_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX rosters require openpyxl to be installed.")
+
+    # read_only mode streams rows from the sheet XML instead of building the whole workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(cell) if cell is not None else "" for cell in header]
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+# Spreadsheet cell helpers, shared with drug_loader's formulary import
+
+def header_key(header):
+    # Header text reduced to the form the alias tables are keyed on: "First Name" -> "firstname"
+    return re.sub(r"[\s_\-]", "", str(header or "")).lower()
+
+
+def cell_text(value):
+    # Cell value as stripped text; spreadsheet whole numbers lose their ".0"
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _boolean(value, default):
+    if value is None or cell_text(value) == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    text = cell_text(value).lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"'{value}' is not a valid yes/no value.")
+
+
+def _dob(value):
+    return parse_dob(value if isinstance(value, date) else cell_text(value)).isoformat()
+
+
+def normalize_roster_row(raw, company, plans_by_name, plan_ids):
+    # Maps one spreadsheet row onto the User columns, raising ValueError with a user-facing message
+    row = {}
+    for header, value in raw.items():
+        field = HEADER_ALIASES.get(header_key(header))
+        if field:
+            row[field] = value
+
+    for field in ("email", "firstName", "lastName", "phone", "address", "dob"):
+        if cell_text(row.get(field)) == "":
+            raise ValueError(f"'{field}' is required.")
+
+    email = cell_text(row["email"])
+    if "@" not in email:
+        raise ValueError(f"'{email}' is not a valid email address.")
+
+    plan_id = cell_text(row.get("planId"))
+    if plan_id:
+        if not plan_id.isdigit() or int(plan_id) not in plan_ids:
+            raise ValueError("Provided Magic Pill Plan ID not found.")
+        plan_id = int(plan_id)
+    else:
+        plan_id = plans_by_name.get(cell_text(row.get("planName")).lower())
+        if plan_id is None:
+            raise ValueError("Provided Magic Pill Plan ID not found.")
+
+    dob = _dob(row["dob"])
+    return {
+        "username": cell_text(row.get("username")) or email,
+        "email": email,
+        "firstName": cell_text(row["firstName"]),
+        "lastName": cell_text(row["lastName"]),
+        "phone": re.sub(r"[^0-9]", "", cell_text(row["phone"])),
+        "address": cell_text(row["address"]),
+        "dob": dob,
+        "age": age_on(date.fromisoformat(dob), date.today()),
+        "company": company.name,
+        "companyId": company.companyId,
+        "planId": plan_id,
+        "isActive": _boolean(row.get("isActive"), True),
+        "isDependant": _boolean(row.get("isDependant"), False),
+    }
+
+
+def add_row_error(errors, line_no, message, error="Bad Request"):
+    # `errors` is {"count", "rows"}; every rejected row is counted, the first MAX_ROW_ERRORS are listed
+    errors["count"] += 1
+    if len(errors["rows"]) < MAX_ROW_ERRORS:
+        errors["rows"].append({"error": error, "message": message, "row": line_no})
+
+
+def iter_normalized_rows(raw_rows, company, plans_by_name, plan_ids, errors):
+    # Yields (data row number, row) for good rows; bad rows land in `errors` (capped)
+    for line_no, raw in enumerate(raw_rows, start=1):
+        try:
+            yield line_no, normalize_roster_row(raw, company, plans_by_name, plan_ids)
+        except ValueError as e:
+            add_row_error(errors, line_no, str(e))
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class CopyRowReader:
+    # File-like adapter feeding COPY text-format lines from a row generator, one buffer at a time
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                line_no, row = next(self._rows)
+            except StopIteration:
+                break
+            # .get: rows staged before a column was added still load
+            values = [row.get(column) for column in ROSTER_COLUMNS] + [line_no]
+            self._buffer += "\t".join(_copy_value(value) for value in values) + "\n"
+            self.count += 1
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def load_roster(session, rows, on_merged=None, errors=None):
+    # COPY the rows into a transaction-scoped staging table, then merge them into users in one statement.
+    # The caller owns the transaction; nothing is visible until it commits.
+    # `on_merged(inserted, row)` is called for every row the merge wrote; rows whose email belongs to
+    # another company are added to `errors` (see add_row_error) with their row number.
+    dbapi_connection = session.connection().connection
+    cursor = dbapi_connection.cursor()
+    added = updated = 0
+    try:
+        cursor.execute(CREATE_STAGING_SQL)
+        reader = CopyRowReader(iter(rows))
+        cursor.copy_expert(COPY_STAGING_SQL, reader)
+        cursor.execute(RESOLVE_STAGING_SQL)
+        cursor.execute(CONFLICTS_SQL)
+        conflicts = cursor.fetchall()
+        for line_no, email in conflicts:
+            if errors is not None:
+                add_row_error(errors, line_no, f"'{email}' belongs to a user of another company.", "Conflict")
+        cursor.execute(MERGE_STAGING_SQL)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            merged = cursor.fetchmany(1000)
+            if not merged:
+                break
+            for values in merged:
+                if values[0]:
+                    added += 1
+                else:
+                    updated += 1
+                if on_merged is not None:
+                    on_merged(values[0], dict(zip(columns[1:], values[1:])))
+    finally:
+        cursor.close()
+
+    return {
+        "staged": reader.count,
+        "added": added,
+        "updated": updated,
+        "conflicts": len(conflicts),
+        # Duplicate emails collapsed to their last row, and inserts that lost a race on the same email
+        "skipped": reader.count - added - updated - len(conflicts),
+    }
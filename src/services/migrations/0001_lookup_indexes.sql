@@ -0,0 +1,15 @@
+-- Indexes declared on the models in services/models.py.
+-- CONCURRENTLY keeps the tables writable while they build; run with psql in autocommit mode:
+--   psql "$DATABASE_URL" -f migrations/0001_lookup_indexes.sql
+
+-- Admin login: filters on lower(admin_email)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_admins_admin_email_lower ON admins (lower(admin_email));
+
+-- Case-insensitive user lookups and roster matching: lower(email)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email_lower ON users (lower(email));
+
+-- Per-company roster reads, roster diffs and documentId keyset pagination
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_users_companyId_documentId" ON users ("companyId", "documentId");
+
+ANALYZE admins;
+ANALYZE users;
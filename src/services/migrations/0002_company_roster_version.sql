@@ -0,0 +1,4 @@
+-- Per-company roster version, bumped with every write to the company's users.
+--   psql "$DATABASE_URL" -f migrations/0002_company_roster_version.sql
+
+ALTER TABLE insurance_companies ADD COLUMN IF NOT EXISTS "rosterVersion" bigint NOT NULL DEFAULT 0;
@@ -0,0 +1,15 @@
+-- Formulary import history. Each import also leaves the table it replaced behind as drugs_previous;
+-- to roll back, hand it the drug_id sequence and swap it in again:
+--   BEGIN;
+--   ALTER SEQUENCE drugs_drug_id_seq OWNED BY drugs_previous.drug_id;
+--   ALTER TABLE drugs RENAME TO drugs_rejected;
+--   ALTER TABLE drugs_previous RENAME TO drugs;
+--   COMMIT;
+--   psql "$DATABASE_URL" -f migrations/0003_formulary_versions.sql
+
+CREATE TABLE IF NOT EXISTS formulary_versions (
+    version serial PRIMARY KEY,
+    source varchar,
+    drugs integer,
+    loaded_at timestamptz DEFAULT now()
+);
@@ -0,0 +1,21 @@
+-- users.dob becomes a date, indexed per company for age recomputation and eligibility range scans.
+-- The type change rewrites users under an exclusive lock, so run it in a quiet window. Values in
+-- the formats roster uploads accepted (YYYY-MM-DD, MM/DD/YYYY, YYYY/MM/DD) are converted; any other
+-- value aborts the migration. Find those first with:
+--   SELECT "documentId", dob FROM users
+--   WHERE dob !~ '^\d{4}-\d{1,2}-\d{1,2}$' AND dob !~ '^\d{1,2}/\d{1,2}/\d{4}$' AND dob !~ '^\d{4}/\d{1,2}/\d{1,2}$';
+-- Run with psql in autocommit mode (CREATE INDEX CONCURRENTLY cannot run in a transaction):
+--   psql "$DATABASE_URL" -f migrations/0004_typed_dob.sql
+
+ALTER TABLE users ALTER COLUMN dob TYPE date USING (
+    CASE
+        WHEN dob IS NULL OR btrim(dob) = '' THEN NULL
+        WHEN dob ~ '^\d{1,2}/\d{1,2}/\d{4}$' THEN to_date(dob, 'MM/DD/YYYY')
+        WHEN dob ~ '^\d{4}/\d{1,2}/\d{1,2}$' THEN to_date(dob, 'YYYY/MM/DD')
+        ELSE dob::date
+    END
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_users_companyId_dob" ON users ("companyId", dob);
+
+ANALYZE users;
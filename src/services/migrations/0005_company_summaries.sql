@@ -0,0 +1,63 @@
+-- Per-company headcounts (plan x active x dependant), kept current by statement-level triggers on
+-- users so every add/update/toggle, bulk write and COPY merge updates them in its own transaction.
+-- The function and triggers match COMPANY_SUMMARY_TRIGGERS in models.py. The initial count locks
+-- users against writes until the migration commits, so run it in one transaction:
+--   psql "$DATABASE_URL" -1 -f migrations/0005_company_summaries.sql
+-- To recount later: python company_summary.py rebuild
+
+CREATE TABLE IF NOT EXISTS company_summaries (
+    "companyId" integer NOT NULL REFERENCES insurance_companies ("companyId"),
+    "planId" integer NOT NULL,
+    "isActive" boolean NOT NULL,
+    "isDependant" boolean NOT NULL,
+    members bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY ("companyId", "planId", "isActive", "isDependant")
+);
+
+CREATE OR REPLACE FUNCTION apply_company_summary_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO company_summaries AS summary ("companyId", "planId", "isActive", "isDependant", members)
+        SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), count(*)
+        FROM new_rows WHERE "companyId" IS NOT NULL
+        GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        ON CONFLICT ("companyId", "planId", "isActive", "isDependant") DO UPDATE SET members = summary.members + excluded.members;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO company_summaries AS summary ("companyId", "planId", "isActive", "isDependant", members)
+        SELECT "companyId", "planId", "isActive", "isDependant", sum(change) FROM (
+            SELECT "companyId", coalesce("planId", 0) AS "planId", coalesce("isActive", false) AS "isActive",
+                   coalesce("isDependant", false) AS "isDependant", 1 AS change
+            FROM new_rows
+            UNION ALL
+            SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), -1
+            FROM old_rows
+        ) changes WHERE "companyId" IS NOT NULL
+        GROUP BY 1, 2, 3, 4 HAVING sum(change) <> 0 ORDER BY 1, 2, 3, 4
+        ON CONFLICT ("companyId", "planId", "isActive", "isDependant") DO UPDATE SET members = summary.members + excluded.members;
+    ELSE
+        INSERT INTO company_summaries AS summary ("companyId", "planId", "isActive", "isDependant", members)
+        SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), -count(*)
+        FROM old_rows WHERE "companyId" IS NOT NULL
+        GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        ON CONFLICT ("companyId", "planId", "isActive", "isDependant") DO UPDATE SET members = summary.members + excluded.members;
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS users_company_summary_insert ON users;
+CREATE TRIGGER users_company_summary_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_company_summary_changes();
+DROP TRIGGER IF EXISTS users_company_summary_update ON users;
+CREATE TRIGGER users_company_summary_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_company_summary_changes();
+DROP TRIGGER IF EXISTS users_company_summary_delete ON users;
+CREATE TRIGGER users_company_summary_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_company_summary_changes();
+
+LOCK TABLE users IN SHARE MODE;
+DELETE FROM company_summaries;
+INSERT INTO company_summaries ("companyId", "planId", "isActive", "isDependant", members)
+SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), count(*)
+FROM users
+WHERE "companyId" IS NOT NULL
+GROUP BY 1, 2, 3, 4;
@@ -0,0 +1,9 @@
+-- Change log records waiting to be moved to the change log files. Writes add their records here in
+-- their own transaction; after commit the app appends them to the files and deletes them, so an
+-- unwritable change log folder delays records instead of losing them. Matches ChangeOutbox in models.py.
+--   psql "$DATABASE_URL" -f migrations/0006_change_outbox.sql
+
+CREATE TABLE IF NOT EXISTS change_outbox (
+    id bigserial PRIMARY KEY,
+    record text NOT NULL
+);
@@ -1,15 +1,23 @@
-from sqlalchemy import Column, Integer, String, Boolean, Numeric, Text, ForeignKey, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Numeric, Text, ForeignKey, Date, DateTime, Index, DDL, event, func, inspect
+from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# Keys of User.serialize(), in order
+USER_FIELDS = [
+    'documentId', 'username', 'email', 'address', 'dob', 'age', 'company', 'companyId',
+    'planId', 'isActive', 'phone', 'firstName', 'lastName', 'isDependant',
+]
+
 class InsuranceCompany(Base):
     __tablename__ = 'insurance_companies'
 
     companyId = Column(Integer, primary_key=True)
     name = Column(String)
     phoneNumber = Column(String)
+    # Bumped in the same transaction as every write to this company's users
+    rosterVersion = Column(BigInteger, nullable=False, default=0, server_default='0')
 
     def serialize(self):
         return {
@@ -20,6 +28,12 @@ class InsuranceCompany(Base):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Serves per-company roster reads and documentId keyset pagination
+        Index('ix_users_companyId_documentId', 'companyId', 'documentId'),
+        # Per-company age recomputation and upcoming-birthday range scans
+        Index('ix_users_companyId_dob', 'companyId', 'dob'),
+    )
 
     documentId = Column(Integer, primary_key=True)
     username = Column(String)
@@ -28,7 +42,7 @@ class User(Base):
     lastName = Column(String)
     phone = Column(String)
     address = Column(Text)
-    dob = Column(String)
+    dob = Column(Date)
     age = Column(Integer)
     company = Column(String)
     companyId = Column(Integer, ForeignKey('insurance_companies.companyId'))
@@ -45,7 +59,7 @@ class User(Base):
             'username': self.username,
             'email': self.email,
             'address': self.address,
-            'dob': self.dob,
+            'dob': self.dob.isoformat() if self.dob else None,
             'age': self.age,
             'company': self.company,
             'companyId': self.companyId,
@@ -57,13 +71,14 @@ class User(Base):
 	    'isDependant': self.isDependant,
         }
 
-    def serialize_full(self):
+    def serialize_full(self, cache=None):
+        # `cache` is shared across a batch so each company and plan is serialized once
         return {
             'documentId': self.documentId,
             'username': self.username,
             'email': self.email,
             'address': self.address,
-            'dob': self.dob,
+            'dob': self.dob.isoformat() if self.dob else None,
             'age': self.age,
             'company': self.company,
             'companyId': self.companyId,
@@ -72,11 +87,29 @@ class User(Base):
             'phone': self.phone,
             'firstName': self.firstName,
             'lastName': self.lastName,
-            'insurance_company': self.insurance_company.serialize(),
-            'magic_pill_plan': self.magic_pill_plan.serialize(),
+            'insurance_company': serialize_cached(self.insurance_company, cache),
+            'magic_pill_plan': serialize_cached(self.magic_pill_plan, cache),
 	    'isDependant': self.isDependant,
         }
 
+    @staticmethod
+    def full_load_options():
+        # Loads both relationships up front; pair with serialize_full to avoid per-row lazy loads
+        return (selectinload(User.insurance_company), selectinload(User.magic_pill_plan))
+
+# Case-insensitive email lookups filter on lower(email)
+Index('ix_users_email_lower', func.lower(User.email))
+
+def serialize_cached(obj, cache=None):
+    if obj is None:
+        return None
+    if cache is None:
+        return obj.serialize()
+    key = (type(obj), inspect(obj).identity)
+    if key not in cache:
+        cache[key] = obj.serialize()
+    return cache[key]
+
 class MagicPillPlan(Base):
     __tablename__ = 'magic_pill_plans'
 
@@ -107,6 +140,9 @@ class Admin(Base):
             'companyId': self.companyId,
         }
 
+# The dashboard login looks admins up by lower(admin_email)
+Index('ix_admins_admin_email_lower', func.lower(Admin.admin_email))
+
 class Drug(Base):
     __tablename__ = 'drugs'
 
@@ -130,7 +166,7 @@ class Drug(Base):
             'drug_name': self.drug_name,
             'manufacturer_name': self.manufacturer_name,
             'brand_name': self.brand_name,
-            'cost': float(self.cost),
+            'cost': float(self.cost) if self.cost is not None else None,
             'is_urgent': self.is_urgent,
             'is_high_cost': self.is_high_cost,
             'is_free': self.is_free,
@@ -139,4 +175,90 @@ class Drug(Base):
             'dosage': self.dosage,
             'max_supply_30': self.max_supply_30,
             'max_supply_90': self.max_supply_90,
-        }
\ No newline at end of file
+        }
+
+class FormularyVersion(Base):
+    # One row per formulary import, written in the transaction that swaps the new drugs table in
+    __tablename__ = 'formulary_versions'
+
+    version = Column(Integer, primary_key=True)
+    source = Column(String)
+    drugs = Column(Integer)
+    loaded_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def serialize(self):
+        return {
+            'version': self.version,
+            'source': self.source,
+            'drugs': self.drugs,
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+        }
+
+class ChangeOutbox(Base):
+    # Change log records, JSON-encoded, written in the same transaction as the change they describe.
+    # oldApi.drain_change_outbox() moves them to the change log files after commit and deletes each
+    # chunk once it is on disk, so a failed file write loses nothing.
+    __tablename__ = 'change_outbox'
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    record = Column(Text, nullable=False)
+
+class CompanySummary(Base):
+    # Headcounts per company, plan, active flag and dependant flag, kept current by the triggers
+    # below in the same transaction as every write to users. A missing plan is planId 0 and a
+    # missing flag counts as false.
+    __tablename__ = 'company_summaries'
+
+    companyId = Column(Integer, ForeignKey('insurance_companies.companyId'), primary_key=True)
+    planId = Column(Integer, primary_key=True)
+    isActive = Column(Boolean, primary_key=True)
+    isDependant = Column(Boolean, primary_key=True)
+    members = Column(BigInteger, nullable=False, default=0, server_default='0')
+
+# Statement-level triggers with transition tables: one grouped upsert per INSERT, UPDATE or DELETE
+# statement, whatever its row count, so COPY merges and bulk writes are covered too.
+# migrations/0005_company_summaries.sql installs the same function and triggers.
+COMPANY_SUMMARY_TRIGGERS = """
+CREATE OR REPLACE FUNCTION apply_company_summary_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO company_summaries AS summary ("companyId", "planId", "isActive", "isDependant", members)
+        SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), count(*)
+        FROM new_rows WHERE "companyId" IS NOT NULL
+        GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        ON CONFLICT ("companyId", "planId", "isActive", "isDependant") DO UPDATE SET members = summary.members + excluded.members;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO company_summaries AS summary ("companyId", "planId", "isActive", "isDependant", members)
+        SELECT "companyId", "planId", "isActive", "isDependant", sum(change) FROM (
+            SELECT "companyId", coalesce("planId", 0) AS "planId", coalesce("isActive", false) AS "isActive",
+                   coalesce("isDependant", false) AS "isDependant", 1 AS change
+            FROM new_rows
+            UNION ALL
+            SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), -1
+            FROM old_rows
+        ) changes WHERE "companyId" IS NOT NULL
+        GROUP BY 1, 2, 3, 4 HAVING sum(change) <> 0 ORDER BY 1, 2, 3, 4
+        ON CONFLICT ("companyId", "planId", "isActive", "isDependant") DO UPDATE SET members = summary.members + excluded.members;
+    ELSE
+        INSERT INTO company_summaries AS summary ("companyId", "planId", "isActive", "isDependant", members)
+        SELECT "companyId", coalesce("planId", 0), coalesce("isActive", false), coalesce("isDependant", false), -count(*)
+        FROM old_rows WHERE "companyId" IS NOT NULL
+        GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+        ON CONFLICT ("companyId", "planId", "isActive", "isDependant") DO UPDATE SET members = summary.members + excluded.members;
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS users_company_summary_insert ON users;
+CREATE TRIGGER users_company_summary_insert AFTER INSERT ON users
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_company_summary_changes();
+DROP TRIGGER IF EXISTS users_company_summary_update ON users;
+CREATE TRIGGER users_company_summary_update AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_company_summary_changes();
+DROP TRIGGER IF EXISTS users_company_summary_delete ON users;
+CREATE TRIGGER users_company_summary_delete AFTER DELETE ON users
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_company_summary_changes();
+"""
+
+# create_all() installs them once every table exists
+event.listen(Base.metadata, "after_create", DDL(COMPANY_SUMMARY_TRIGGERS).execute_if(dialect="postgresql"))
\ No newline at end of file
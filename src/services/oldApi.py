@@ -1,50 +1,429 @@
 import os
+import json
+import tempfile
 import configparser
 import hashlib
-from flask import Flask, request, jsonify
+import uuid
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import Flask, Response, g, request, jsonify, has_request_context, stream_with_context
 from werkzeug.utils import secure_filename
-from sqlalchemy import create_engine, exc, func
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event, exc, func, or_, not_, any_, all_, bindparam, cast, column, select, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.types import Integer, String
+from sqlalchemy.orm import Session as OrmSession, sessionmaker, scoped_session
 from flask_cors import CORS
-from models import InsuranceCompany, User, MagicPillPlan
-from process_data import process_user_data, process_drug_data
-from models import Admin
-
-from datetime import datetime
+from models import InsuranceCompany, User, MagicPillPlan, USER_FIELDS
+from models import Admin, ChangeOutbox, Drug, FormularyVersion
+from bulk_validation import check_user_row, check_operations, with_age
+from bulk_stream import BulkJobRegistry, iter_json_array, iter_chunks
+from ingest import iter_roster_file, iter_normalized_rows, load_roster
+from roster_diff import diff_roster
+from staging_store import StagingStore, content_key
+from reference_cache import ReferenceCache
+from pool_metrics import MeteredQueuePool, instrument_pool
+from drug_index import DrugIndex
+from drug_loader import iter_formulary_batches, load_formulary
+from eligibility import PeriodicJob, recompute_company_ages, upcoming_birthdays
+from request_metrics import RequestMetrics, instrument_engine, instrument_requests
+from fast_json import FastJSONProvider, STREAM_BATCH_SIZE, iter_ndjson, iter_columnar
+from company_summary import company_summary
+from roster_export import CONTENT_TYPES, iter_csv, iter_xlsx, gzip_chunks
+from changelog import ChangeLog, encode_record, make_record, query as query_change_log, to_epoch_ms
+
+from datetime import date, datetime, timedelta
 import logging
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from email_validator import validate_email, EmailNotValidError
 
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
+app.json = FastJSONProvider(app)
+CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, expose_headers=["X-Last-Write"])
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Importing this module reads config.ini but connects to nothing: the engine is created on first
+# use (see get_engine), so scripts and tests can import it without a reachable database.
 config = configparser.ConfigParser()
 config.read("config.ini")
-db_host = config["database"]["host"]
-db_port = config["database"]["port"]
-db_name = config["database"]["database"]
-db_user = config["database"]["username"]
-db_password = config["database"]["password"]
-
-upload_folder = config["DEFAULT"]["uploads"]
-changelog_folder = config["DEFAULT"]["changelog"]
-
-db_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-engine = create_engine(db_url, pool_pre_ping=True)
-session_factory = sessionmaker(bind=engine)
+
+work_folder = os.path.join(tempfile.gettempdir(), "magic-pill-admin-portal")
+upload_folder = config.get("DEFAULT", "uploads", fallback=os.path.join(work_folder, "Uploads"))
+pending_folder = config.get("DEFAULT", "pending", fallback=os.path.join(upload_folder, "pending"))
+changelog_folder = config.get("DEFAULT", "changelog", fallback=os.path.join(work_folder, "Changelog"))
+
+roster_page_size = config.getint("roster", "page_size", fallback=100)
+roster_max_page_size = config.getint("roster", "max_page_size", fallback=1000)
+
+cache_ttl_seconds = config.getint("cache", "ttl_seconds", fallback=300)
+cache_max_entries = config.getint("cache", "max_entries", fallback=1024)
+
+bulk_chunk_size = config.getint("bulk", "chunk_size", fallback=500)
+bulk_max_chunk_size = config.getint("bulk", "max_chunk_size", fallback=5000)
+bulk_workers = config.getint("bulk", "workers", fallback=2)
+validation_workers = config.getint("bulk", "validation_workers", fallback=2)
+validation_min_parallel_rows = config.getint("bulk", "validation_min_parallel_rows", fallback=2000)
+validation_chunk_size = config.getint("bulk", "validation_chunk_size", fallback=1000)
+
+formulary_batch_size = config.getint("formulary", "batch_size", fallback=50000)
+
+eligibility_default_age = config.getint("eligibility", "default_age", fallback=26)
+eligibility_window_days = config.getint("eligibility", "window_days", fallback=90)
+eligibility_max_window_days = config.getint("eligibility", "max_window_days", fallback=366)
+age_recompute_hours = config.getfloat("eligibility", "recompute_interval_hours", fallback=24)
+
+request_metrics = instrument_requests(app, RequestMetrics(
+    slow_request_ms=config.getint("profiling", "slow_request_ms", fallback=1000),
+    profile_sample_rate=config.getfloat("profiling", "profile_sample_rate", fallback=0.0),
+    profile_folder=config.get("profiling", "profile_folder", fallback=None),
+))
+
+engine = None
+replica_engine = None
+engine_lock = threading.Lock()
+
+# Flask endpoints whose reads may go to the replica; everything else, and every write, uses the primary
+replica_endpoints = {
+    endpoint.strip().lower()
+    for endpoint in config.get("replica", "endpoints",
+                               fallback="company, get_user, get_all_magic_pill_plans, get_admin_by_email").split(",")
+    if endpoint.strip()
+}
+replica_sticky_seconds = config.getfloat("replica", "sticky_seconds", fallback=5)
+# A request that commits returns the time in this header and cookie; the client's requests that carry
+# it read from the primary for replica_sticky_seconds after it, on whichever worker they land
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+def postgres_url(section):
+    database = config[section]
+    return f"postgresql://{database['username']}:{database['password']}@{database['host']}:{database['port']}/{database['database']}"
+
+def database_url():
+    # DATABASE_URL points the app at another database, e.g. the local stand-in bench_api.py seeds
+    if os.environ.get("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
+    if not config.has_section("database"):
+        raise RuntimeError("No database configured: set DATABASE_URL or add a [database] section to config.ini.")
+    return postgres_url("database")
+
+def replica_database_url():
+    # REPLICA_DATABASE_URL or a [replica] section with a host; None means no replica
+    if os.environ.get("REPLICA_DATABASE_URL"):
+        return os.environ["REPLICA_DATABASE_URL"]
+    if config.has_section("replica") and config.get("replica", "host", fallback="").strip():
+        return postgres_url("replica")
+    return None
+
+def build_engine(url, section):
+    # Pool settings come from `section`, falling back to [pool]
+    def setting(get, key, fallback):
+        return get(section, key, fallback=get("pool", key, fallback=fallback))
+
+    created = create_engine(
+        url,
+        poolclass=MeteredQueuePool,
+        pool_size=setting(config.getint, "size", 5),
+        max_overflow=setting(config.getint, "max_overflow", 10),
+        pool_timeout=setting(config.getfloat, "timeout", 30),
+        pool_recycle=setting(config.getint, "recycle", -1),
+        pool_pre_ping=setting(config.getboolean, "pre_ping", True),
+    )
+    instrument_pool(created)
+    instrument_engine(created, request_metrics)
+    return created
+
+def get_engine():
+    # The primary, created once, on first use, with the pool and request metrics attached
+    global engine
+    if engine is None:
+        with engine_lock:
+            if engine is None:
+                created = build_engine(database_url(), "pool")
+                event.listen(created, "commit", record_primary_commit)
+                engine = created
+    return engine
+
+def get_replica_engine():
+    # The read replica, created like the primary; None when none is configured
+    global replica_engine
+    if replica_engine is None and replica_database_url() is not None:
+        with engine_lock:
+            if replica_engine is None:
+                replica_engine = build_engine(replica_database_url(), "replica")
+    return replica_engine
+
+def record_primary_commit(connection):
+    # Commits outside a request (bulk jobs, startup) have no client to tell
+    if has_request_context():
+        g.last_write = time.time()
+
+def client_last_write():
+    # Epoch seconds of the client's last write, from the header it echoes or the cookie; 0 when unknown
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def reads_from_replica():
+    # Replica-routed endpoint, not loading a shared cache entry, and the client has not written within
+    # the sticky window, so it sees its own writes
+    return (
+        has_request_context()
+        and not g.get("primary_reads", False)
+        and (request.endpoint or "").lower() in replica_endpoints
+        and time.time() - client_last_write() >= replica_sticky_seconds
+        and get_replica_engine() is not None
+    )
+
+def on_primary(loader):
+    # `loader` with this request's reads sent to the primary. Reference cache entries are shared by
+    # every client, so replica lag must not be cached for their whole TTL.
+    def load():
+        if not has_request_context():
+            return loader()
+        previous = g.get("primary_reads", False)
+        g.primary_reads = True
+        try:
+            return loader()
+        finally:
+            g.primary_reads = previous
+    return load
+
+@app.after_request
+def remember_last_write(response):
+    if "last_write" in g:
+        value = f"{g.last_write:.3f}"
+        response.headers[LAST_WRITE_HEADER] = value
+        response.set_cookie(LAST_WRITE_COOKIE, value, max_age=max(1, int(replica_sticky_seconds + 0.999)), httponly=True, samesite="Lax")
+    return response
+
+class EngineSession(OrmSession):
+    # Binds to get_engine(), so creating a session never creates the engine; its first query does.
+    # Reads on the endpoints in replica_endpoints go to the replica; flushes and DML never do.
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or (clause is not None and clause.is_dml) or not reads_from_replica():
+            return get_engine()
+        return get_replica_engine()
+
+session_factory = sessionmaker(class_=EngineSession)
 Session = scoped_session(session_factory)
 
+# Milliseconds, keyed by Flask endpoint name; "default" covers every other route and "background" the bulk jobs
+statement_timeouts = {
+    key: config.getint("statement_timeouts", key)
+    for key in (config.options("statement_timeouts") if config.has_section("statement_timeouts") else [])
+    if key not in config.defaults()
+}
+
+def current_statement_timeout():
+    default = statement_timeouts.get("default", 0)
+    if has_request_context():
+        return statement_timeouts.get((request.endpoint or "").lower(), default)
+    return statement_timeouts.get("background", default)
+
+@event.listens_for(session_factory, "after_begin")
+def apply_statement_timeout(session, transaction, connection):
+    # SET LOCAL lasts exactly as long as the transaction the session just began
+    timeout = current_statement_timeout()
+    if timeout and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
 ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
 app.config['UPLOAD_FOLDER'] = upload_folder
 app.secret_key = "super secret key"
 
-temporary_storage = {}
+staging_store = StagingStore(
+    pending_folder,
+    max_memory_bytes=config.getint("staging", "max_memory_bytes", fallback=64 * 1024 * 1024),
+    max_disk_bytes=config.getint("staging", "max_disk_bytes", fallback=1024 * 1024 * 1024),
+    ttl_seconds=config.getint("staging", "ttl_seconds", fallback=86400),
+)
+# Approving a staged roster that deactivates more users than this needs confirm=true
+staging_max_deactivations = config.getint("staging", "max_deactivations", fallback=100)
+
+bulk_jobs = BulkJobRegistry(
+    config.get("bulk", "jobs_folder", fallback=os.path.join(upload_folder, "bulk-jobs")),
+    ttl_seconds=config.getint("bulk", "job_ttl_seconds", fallback=7 * 86400),
+    stale_seconds=config.getint("bulk", "job_stale_seconds", fallback=900),
+)
+change_log = ChangeLog(changelog_folder, max_segment_bytes=config.getint("changelog", "max_segment_bytes", fallback=64 * 1024 * 1024))
+changelog_page_size = config.getint("changelog", "page_size", fallback=1000)
+changelog_max_page_size = config.getint("changelog", "max_page_size", fallback=10000)
+# Records go to change_outbox, and from there to the files, this many at a time
+change_outbox_chunk = config.getint("changelog", "outbox_chunk", fallback=1000)
+change_outbox_lock = threading.Lock()
+drug_index = DrugIndex()
+drug_index_lock = threading.Lock()
+reference_cache = ReferenceCache(max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds)
+bulk_executor = ThreadPoolExecutor(max_workers=bulk_workers, thread_name_prefix="bulk")
+validation_executor = None
+validation_executor_lock = threading.Lock()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# REFERENCE DATA CACHE
+
+def cached_companies(session):
+    return reference_cache.get_or_load("company_rows", on_primary(lambda: {company.companyId: company.serialize() for company in session.query(InsuranceCompany)}))
+
+def cached_plans(session):
+    return reference_cache.get_or_load("plan_rows", on_primary(lambda: {plan.planId: plan.serialize() for plan in session.query(MagicPillPlan)}))
+
+def known_ids(session, key, loader, ids):
+    # The subset of `ids` that exist. Companies and plans are added out-of-band, so a miss may only
+    # mean the cache predates the row: reload once before giving up, as cached_reference does
+    ids = set(ids)
+    rows = loader(session)
+    if not ids <= rows.keys():
+        reference_cache.invalidate(key)
+        rows = loader(session)
+    return ids & rows.keys()
+
+def known_company_ids(session, ids):
+    return known_ids(session, "company_rows", cached_companies, ids)
+
+def known_plan_ids(session, ids):
+    return known_ids(session, "plan_rows", cached_plans, ids)
+
+def cached_reference(session, key, loader, reference_id):
+    # A miss on a known id means the row is newer than the cache; reload once before giving up
+    rows = loader(session)
+    if reference_id is not None and reference_id not in rows:
+        reference_cache.invalidate(key)
+        rows = loader(session)
+    return rows.get(reference_id)
+
+def serialize_user_row(session, row):
+    # serialize_full() shape for a RETURNING row, with company and plan served from the reference cache
+    user = {field: row[field] for field in USER_FIELDS}
+    user["insurance_company"] = cached_reference(session, "company_rows", cached_companies, row["companyId"])
+    user["magic_pill_plan"] = cached_reference(session, "plan_rows", cached_plans, row["planId"])
+    return user
+
+def with_etag(payload):
+    body = json.dumps(payload, sort_keys=True, default=str)
+    return payload, hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+def cached_list_response(key, loader):
+    # Serialized once per TTL; clients revalidate with If-None-Match and get a 304 when unchanged
+    payload, etag = reference_cache.get_or_load(key, on_primary(lambda: with_etag(loader())))
+    response = jsonify(results=payload)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def invalidate_admin_cache():
+    reference_cache.invalidate("admins")
+    reference_cache.invalidate_prefix("admin_email")
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    pool = get_engine().pool
+    body = request_metrics.render_prometheus(pool.metrics.snapshot(pool))
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route("/metrics/queries", methods=["GET"])
+def get_query_metrics():
+    limit = min(request.args.get("limit", 20, type=int) or 20, 200)
+    return jsonify(results=request_metrics.top_queries(limit))
+
+@app.route("/metrics/pool", methods=["GET"])
+def get_pool_metrics():
+    pools = [("primary", get_engine().pool)]
+    if get_replica_engine() is not None:
+        pools.append(("replica", get_replica_engine().pool))
+    return jsonify(results=[dict(pool.metrics.snapshot(pool), pool=name) for name, pool in pools])
+
+@app.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify(results=[reference_cache.stats()])
+
+# CHANGE LOG
+
+def record_changes(session, op, rows, source=None):
+    # Written to change_outbox in the session's transaction, so the records commit or roll back with
+    # the change. At most change_outbox_chunk of them wait on the session, however large the write.
+    source = source or (request.endpoint if has_request_context() else "bulk_job")
+    pending = session.info.setdefault("changelog", [])
+    pending.extend(encode_record(make_record(op, source, row)) for row in rows)
+    if len(pending) >= change_outbox_chunk:
+        write_change_outbox(session)
+
+def write_change_outbox(session):
+    pending = session.info.pop("changelog", None)
+    if not pending:
+        return
+    outbox = ChangeOutbox.__table__
+    for start in range(0, len(pending), change_outbox_chunk):
+        session.execute(outbox.insert(), [{"record": record} for record in pending[start:start + change_outbox_chunk]])
+    session.info["changelog_written"] = True
+
+def drain_change_outbox():
+    # Moves committed records from change_outbox to the change log files, oldest first, one chunk per
+    # transaction. A chunk is deleted only once it is on disk, so a failed write leaves it for the
+    # next drain; a crash in between writes it twice, with the same "id".
+    outbox = ChangeOutbox.__table__
+    drained = 0
+    with change_outbox_lock:
+        while True:
+            with get_engine().begin() as connection:
+                rows = connection.execute(
+                    select(outbox.c.id, outbox.c.record)
+                    .order_by(outbox.c.id)
+                    .limit(change_outbox_chunk)
+                    .with_for_update(skip_locked=True)
+                ).all()
+                if not rows:
+                    return drained
+                change_log.append([dict(json.loads(row.record), id=row.id) for row in rows])
+                connection.execute(outbox.delete().where(outbox.c.id.in_([row.id for row in rows])))
+            drained += len(rows)
+
+@event.listens_for(session_factory, "before_commit")
+def write_pending_changes(session):
+    write_change_outbox(session)
+
+@event.listens_for(session_factory, "after_commit")
+def flush_change_log(session):
+    if session.info.pop("changelog_written", False):
+        try:
+            drain_change_outbox()
+        except (OSError, SQLAlchemyError):
+            logging.exception("Could not move change log records to %s; they stay in change_outbox", changelog_folder)
+
+@event.listens_for(session_factory, "after_rollback")
+def discard_change_log(session):
+    session.info.pop("changelog", None)
+    session.info.pop("changelog_written", None)
+
+@app.route("/changelog", methods=["GET"])
+def get_change_log():
+    try:
+        since = to_epoch_ms(request.args.get("since"))
+        until = to_epoch_ms(request.args.get("until"))
+    except ValueError:
+        return jsonify(results=[{"error": "Bad Request", "message": "'since' and 'until' should be ISO timestamps or epoch milliseconds."}]), 400
+    limit = request.args.get("limit", changelog_page_size, type=int)
+    if not limit or limit < 1 or limit > changelog_max_page_size:
+        return jsonify(results=[{"error": "Bad Request", "message": f"'limit' should be between 1 and {changelog_max_page_size}."}]), 400
+    # Committed records a failed drain left behind are moved first, so the page includes them
+    try:
+        drain_change_outbox()
+    except (OSError, SQLAlchemyError):
+        logging.exception("Could not move change log records to %s; they stay in change_outbox", changelog_folder)
+    records = query_change_log(
+        changelog_folder,
+        document_id=request.args.get("documentId", type=int),
+        company_id=request.args.get("companyId", type=int),
+        since=since,
+        until=until,
+        limit=limit,
+    )
+    return jsonify(results=list(records))
+
 @app.teardown_appcontext
 def cleanup(resp_or_exc):
     Session.remove()
@@ -73,136 +452,943 @@ def bulk_user_operations():
     user_insert_mappings = []
     user_update_mappings = []
     user_toggle_mappings = []
+    user_deactivate_mappings = []
 
     company_id = data[0]["user_data"]["companyId"] if data else None
 
-    for operation in data:
+    # Resolve every referenced company, plan and user up front so rows are validated in memory
+    with Session() as session:
+        lookups = load_bulk_lookups(session, data)
+    checks = check_bulk_operations(data)
+
+    for operation, checked in zip(data, checks):
         action = operation.get("action")
         
         if action == "add":
-            handle_add_action(operation, results, user_insert_mappings)
+            handle_add_action(operation, results, user_insert_mappings, lookups, checked)
         elif action == "update":
-            handle_update_action(operation, results, user_update_mappings)
+            handle_update_action(operation, results, user_update_mappings, lookups, checked)
         elif action == "toggle":
-            handle_toggle_action(operation, results, user_toggle_mappings)
+            handle_toggle_action(operation, results, user_toggle_mappings, lookups, checked)
+        elif action == "deactivate":
+            handle_deactivate_action(operation, results, user_deactivate_mappings, lookups, checked)
         else:
             results.append({"error": "Unknown Action", "message": f"Unknown action received: {action}"})
 
-    users = perform_bulk_operations(User, results, user_insert_mappings, user_update_mappings, user_toggle_mappings, company_id)
+    users, roster_version, base_version = perform_bulk_operations(results, user_insert_mappings, user_update_mappings, user_toggle_mappings, company_id, user_deactivate_mappings)
+
+    return jsonify(results=results, users=users, roster_version=roster_version, base_version=base_version)
+
+
+@app.route("/user/bulk/stream", methods=["POST"])
+def bulk_user_operations_stream():
+    chunk_size = request.args.get("chunk_size", bulk_chunk_size, type=int)
+    if not chunk_size or chunk_size < 1 or chunk_size > bulk_max_chunk_size:
+        return jsonify(results=[{"error": "Bad Request", "message": f"'chunk_size' should be between 1 and {bulk_max_chunk_size}."}]), 400
+
+    job = bulk_jobs.create(chunk_size)
+
+    # Spool the body to disk block by block so the worker never holds the whole payload
+    os.makedirs(upload_folder, exist_ok=True)
+    spool_path = os.path.join(upload_folder, f"bulk-{job.job_id}.json")
+    with open(spool_path, "wb") as spool:
+        while True:
+            block = request.stream.read(64 * 1024)
+            if not block:
+                break
+            spool.write(block)
+
+    bulk_executor.submit(run_bulk_stream_job, job, spool_path)
+    return jsonify(results=[{"success": True, "message": "Bulk job queued", "job": job.serialize()}]), 202
 
-    return jsonify(results=results, users=users)
+@app.route("/user/bulk/jobs/<job_id>", methods=["GET"])
+def get_bulk_job(job_id):
+    job = bulk_jobs.status(job_id)
+    if job is None:
+        return jsonify(results=[{"error": "Not Found", "message": "Bulk job not found."}]), 404
+    return jsonify(results=[job])
 
 
-def handle_add_action(operation, results, user_insert_mappings):
-    validation_result = validate_user_data(operation["user_data"], "add")
+def run_bulk_stream_job(job, spool_path):
+    job.start()
+    first_row = 0
+    try:
+        with open(spool_path, "rb") as spool:
+            for chunk in iter_chunks(iter_json_array(spool), job.chunk_size):
+                process_bulk_chunk(job, chunk, first_row)
+                first_row += len(chunk)
+        job.finish("completed")
+    except ValueError as e:
+        job.finish("failed", str(e))
+    except Exception as e:
+        logging.exception("Bulk job %s failed", job.job_id)
+        job.finish("failed", str(e))
+    finally:
+        Session.remove()
+        os.remove(spool_path)
+
+def process_bulk_chunk(job, chunk, first_row):
+    errors = []
+    inserts, updates, toggles, deactivations = [], [], [], []
+    pending_rows = []
+
+    with Session() as session:
+        lookups = load_bulk_lookups(session, chunk)
+        checks = check_bulk_operations(chunk)
+
+        for (row, operation), checked in zip(enumerate(chunk, start=first_row), checks):
+            if not isinstance(operation, dict) or not isinstance(operation.get("user_data"), dict):
+                errors.append((row, {"error": "Bad Request", "message": "Each operation needs an 'action' and 'user_data'."}))
+                continue
+            action = operation.get("action")
+            results = []
+
+            if action == "add":
+                handle_add_action(operation, results, inserts, lookups, checked)
+            elif action == "update":
+                handle_update_action(operation, results, updates, lookups, checked)
+            elif action == "toggle":
+                handle_toggle_action(operation, results, toggles, lookups, checked)
+            elif action == "deactivate":
+                handle_deactivate_action(operation, results, deactivations, lookups, checked)
+            else:
+                results.append({"error": "Unknown Action", "message": f"Unknown action received: {action}"})
+
+            if results:
+                errors.append((row, results[0]))
+            else:
+                pending_rows.append(row)
+
+        counts = {"rows": len(chunk), "added": 0, "updated": 0, "toggled": 0, "deactivated": 0}
+        try:
+            # One transaction per chunk: a failing chunk rolls back alone
+            write_bulk_chunk(session, inserts, updates, toggles, deactivations)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logging.error(f"Database Error in bulk job {job.job_id}: {str(e)}")
+            errors.extend((row, {"error": "Database Error", "message": str(e)}) for row in pending_rows)
+            job.record_chunk(counts, sorted(errors, key=lambda error: error[0]), committed=False)
+            return
+
+        counts.update(added=len(inserts), updated=len(updates), toggled=len(toggles), deactivated=len(deactivations))
+        job.record_chunk(counts, errors, committed=True)
+
+def write_bulk_chunk(session, inserts, updates, toggles, deactivations=()):
+    rows = []
+    if inserts:
+        rows.extend(insert_users(session, inserts))
+    if updates:
+        rows.extend(update_users(session, updates))
+    if toggles:
+        rows.extend(toggle_users(session, toggles))
+    if deactivations:
+        rows.extend(deactivate_users(session, deactivations))
+    bump_roster_versions(session, {row["companyId"] for row in rows})
+    return rows
+
+def toggle_users(session, toggles):
+    # Flips isActive in the database in one statement, so concurrent toggles cannot lose an update
+    ids = sorted({_lookup_key(toggle["documentId"]) for toggle in toggles})
+    statement = (
+        update(User.__table__)
+        .where(User.__table__.c.documentId == any_(bindparam("ids", ids, type_=ARRAY(Integer))))
+        .values(isActive=not_(func.coalesce(User.__table__.c.isActive, False)))
+        .returning(*User.__table__.c)
+    )
+    toggled = session.execute(statement).mappings().all()
+    record_changes(session, "toggle", toggled)
+    return toggled
+
+def deactivate_users(session, deactivations):
+    # Sets isActive to false rather than flipping it, so posting the same roster removals twice
+    # leaves them inactive
+    ids = sorted({_lookup_key(deactivation["documentId"]) for deactivation in deactivations})
+    statement = (
+        update(User.__table__)
+        .where(User.__table__.c.documentId == any_(bindparam("ids", ids, type_=ARRAY(Integer))))
+        .values(isActive=False)
+        .returning(*User.__table__.c)
+    )
+    deactivated = session.execute(statement).mappings().all()
+    record_changes(session, "toggle", deactivated)
+    return deactivated
+
+
+def _lookup_key(value):
+    # ids arrive as ints or numeric strings; anything else can never match a row
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+def load_bulk_lookups(session, operations):
+    company_ids, plan_ids, document_ids = set(), set(), set()
+    for operation in operations:
+        user_data = operation.get("user_data") if isinstance(operation, dict) else None
+        if not isinstance(user_data, dict):
+            continue
+        for ids, field in ((company_ids, "companyId"), (plan_ids, "planId"), (document_ids, "documentId")):
+            key = _lookup_key(user_data.get(field))
+            if key is not None:
+                ids.add(key)
+
+    lookups = {"companies": set(), "plans": set(), "users": {}, "user_companies": {}}
+    if company_ids:
+        lookups["companies"] = known_company_ids(session, company_ids)
+    if plan_ids:
+        lookups["plans"] = known_plan_ids(session, plan_ids)
+    if document_ids:
+        rows = session.query(User.documentId, User.isActive, User.companyId).filter(User.documentId.in_(document_ids)).all()
+        lookups["users"] = {row.documentId: row.isActive for row in rows}
+        lookups["user_companies"] = {row.documentId: row.companyId for row in rows}
+    return lookups
+
+def get_validation_executor():
+    # Started on first use with spawn, so workers never inherit the app's threads or DB connections
+    global validation_executor
+    if validation_workers < 1:
+        return None
+    with validation_executor_lock:
+        if validation_executor is None:
+            validation_executor = ProcessPoolExecutor(max_workers=validation_workers, mp_context=multiprocessing.get_context("spawn"))
+    return validation_executor
+
+def check_bulk_operations(operations):
+    # Field, type and email checks for every row; large payloads fan out across the validation pool
+    executor = get_validation_executor() if len(operations) >= validation_min_parallel_rows else None
+    return check_operations(operations, executor, validation_min_parallel_rows, validation_chunk_size)
+
+def handle_add_action(operation, results, user_insert_mappings, lookups=None, checked=None):
+    validation_result = validate_user_data(operation["user_data"], "add", lookups, checked)
     if "error" in validation_result:
         results.append(validation_result)
     else:
         user_insert_mappings.append(operation["user_data"])
 
-def handle_update_action(operation, results, user_update_mappings):
-    validation_result = validate_user_data(operation["user_data"], "update")
+def handle_update_action(operation, results, user_update_mappings, lookups=None, checked=None):
+    validation_result = validate_user_data(operation["user_data"], "update", lookups, checked)
     if "error" in validation_result:
         results.append(validation_result)
     else:
         documentId = operation["user_data"].get("documentId")  # Moved inside user_data
-        with Session() as session:
-            user = session.query(User).filter_by(documentId=documentId).first()
-            if user:
-                user_update_mappings.append(operation["user_data"])
-            else:
-                results.append({"error": "User Not Found", "message": f"User with ID {documentId} not found."})
+        if find_user_status(documentId, lookups) is not None:
+            user_update_mappings.append(operation["user_data"])
+        else:
+            results.append({"error": "User Not Found", "message": f"User with ID {documentId} not found."})
 
-def handle_toggle_action(operation, results, user_toggle_mappings):
-    validation_result = validate_user_data(operation["user_data"], "toggle")
+def handle_toggle_action(operation, results, user_toggle_mappings, lookups=None, checked=None):
+    validation_result = validate_user_data(operation["user_data"], "toggle", lookups, checked)
     if "error" in validation_result:
         results.append(validation_result)
     else:
         documentId = operation["user_data"].get("documentId")  # Moved inside user_data
-        with Session() as session:
-            user = session.query(User).filter_by(documentId=documentId).first()
-            if user:
-                user_toggle_mappings.append({"documentId": documentId, "isActive": not user.isActive})
-            else:
-                results.append({"error": "User Not Found", "message": f"User with ID {documentId} not found."})
+        if find_user_status(documentId, lookups) is not None:
+            user_toggle_mappings.append({"documentId": documentId})
+        else:
+            results.append({"error": "User Not Found", "message": f"User with ID {documentId} not found."})
+
+def handle_deactivate_action(operation, results, user_deactivate_mappings, lookups=None, checked=None):
+    validation_result = validate_user_data(operation["user_data"], "deactivate", lookups, checked)
+    if "error" in validation_result:
+        results.append(validation_result)
+    else:
+        documentId = operation["user_data"]["documentId"]
+        companyId = operation["user_data"]["companyId"]
+        if find_user_company(documentId, lookups) == companyId:
+            user_deactivate_mappings.append({"documentId": documentId})
+        else:
+            results.append({"error": "User Not Found", "message": f"User with ID {documentId} not found in company {companyId}."})
 
-def perform_bulk_operations(model, results, inserts, updates, toggles, company_id):
+def find_user_company(documentId, lookups=None):
+    # companyId of the user, or None when no such user exists
+    if lookups is not None:
+        return lookups["user_companies"].get(_lookup_key(documentId))
+    with Session() as session:
+        user = session.query(User).filter_by(documentId=documentId).first()
+        return user.companyId if user else None
+
+def find_user_status(documentId, lookups=None):
+    # Current isActive of the user, or None when no such user exists
+    if lookups is not None:
+        key = _lookup_key(documentId)
+        if key is None or key not in lookups["users"]:
+            return None
+        return bool(lookups["users"][key])
+    with Session() as session:
+        user = session.query(User).filter_by(documentId=documentId).first()
+        return bool(user.isActive) if user else None
+
+def perform_bulk_operations(results, inserts, updates, toggles, company_id, deactivations=()):
     bulk_ops = [
-        (inserts, "added", Session.bulk_insert_mappings),
-        (updates, "updated", Session.bulk_update_mappings),
-        (toggles, "toggled", Session.bulk_update_mappings)
+        (inserts, "added", insert_users),
+        (updates, "updated", update_users),
+        (toggles, "toggled", toggle_users),
+        (deactivations, "deactivated", deactivate_users)
     ]
+    affected = {}
+    bumps = []
     try:
         with Session() as session:
             for ops, message, method in bulk_ops:
                 if ops:
-                    method(model, ops)
+                    rows = method(session, ops)
+                    versions = bump_roster_versions(session, {row["companyId"] for row in rows})
+                    if company_id in versions:
+                        bumps.append(versions[company_id])
+                    affected.update((row["documentId"], row) for row in rows)
                     results.extend([{"success": True, "message": f"User {message} successfully"} for _ in ops])
                     session.commit()
-            users = session.query(User).filter(User.companyId == company_id).all()
-        return [user.serialize() for user in users]
+            roster_version = get_roster_version(session, company_id)
+        users = [{field: row[field] for field in USER_FIELDS} for row in affected.values()]
+        return users, roster_version, roster_base_version(bumps, roster_version)
     except IntegrityError as e:
         logging.error(f"Database Integrity Error: {str(e)}")
         results.extend([{"error": "Database Integrity Error", "message": str(e)} for _ in bulk_ops[-1][0]])
     except SQLAlchemyError as e:
         logging.error(f"Database Error: {str(e)}")
         results.extend([{"error": "Database Error", "message": str(e)} for _ in bulk_ops[-1][0]])  # Use the last ops for error message
+    return None, None, None
+
+def roster_base_version(bumps, roster_version):
+    # The version a client must hold for `users` to be a complete delta: only when no other writer
+    # bumped the roster between or after this request's own bumps. None means refetch the roster.
+    if not bumps:
+        return roster_version
+    if bumps == list(range(bumps[0], bumps[0] + len(bumps))) and bumps[-1] == roster_version:
+        return bumps[0] - 1
+    return None
+
+def insert_users(session, inserts):
+    users = User.__table__
+    rows = [{field: data.get(field) for field in USER_FIELDS if field != "documentId"} for data in map(with_age, inserts)]
+    inserted = session.execute(insert(users).values(rows).returning(*[users.c[field] for field in USER_FIELDS])).mappings().all()
+    record_changes(session, "add", inserted)
+    return inserted
+
+def update_users(session, updates):
+    # One UPDATE ... FROM (VALUES ...) RETURNING per set of updated columns (normally a single one);
+    # the last update wins for a repeated documentId, as with executemany
+    users = User.__table__
+    latest = {_lookup_key(data["documentId"]): with_age(data) for data in updates}
+    groups = {}
+    for document_id, data in latest.items():
+        fields = tuple(field for field in USER_FIELDS if field != "documentId" and field in data)
+        groups.setdefault(fields, []).append((document_id, *[data[field] for field in fields]))
+
+    updated = []
+    for fields, rows in groups.items():
+        incoming = values(column("documentId", Integer), *[column(field) for field in fields], name="incoming").data(rows)
+        statement = (
+            update(users)
+            .where(users.c.documentId == incoming.c.documentId)
+            .values({field: cast(incoming.c[field], users.c[field].type) for field in fields})
+            .returning(*[users.c[field] for field in USER_FIELDS])
+        )
+        updated.extend(session.execute(statement).mappings().all())
+    record_changes(session, "update", updated)
+    return updated
+
+def bump_roster_versions(session, company_ids):
+    # Runs in the writing transaction, so a version is only ever visible together with its rows
+    company_ids = sorted(company_id for company_id in company_ids if company_id is not None)
+    if not company_ids:
+        return {}
+    companies = InsuranceCompany.__table__
+    statement = (
+        update(companies)
+        .where(companies.c.companyId == any_(bindparam("ids", company_ids, type_=ARRAY(Integer))))
+        .values(rosterVersion=companies.c.rosterVersion + 1)
+        .returning(companies.c.companyId, companies.c.rosterVersion)
+    )
+    return {row.companyId: row.rosterVersion for row in session.execute(statement)}
 
+def get_roster_version(session, company_id):
+    if company_id is None:
+        return None
+    return session.query(InsuranceCompany.rosterVersion).filter(InsuranceCompany.companyId == company_id).scalar()
 
-def validate_user_data(data, action):
-    if action in ["update", "toggle"] and "documentId" not in data:
-        return {"error": "Bad Request", "message": "'documentId' is required for update and toggle operations."}
-
-    required_fields = {
-        "username": str,
-        "email": str,
-        "firstName": str,
-        "lastName": str,
-        "phone": str,
-        "address": str,
-        "dob": str,
-        "companyId": int,
-        "planId": int,
-        "isActive": bool,
-        "isDependant": bool
-    }
-    
-    for field, expected_type in required_fields.items():
-        value = data.get(field)
-        if value is None:
-            return {"error": "Bad Request", "message": f"'{field}' is required."}
-        if not isinstance(value, expected_type):
-            return {"error": "Bad Request", "message": f"'{field}' should be of type {expected_type.__name__}."}
 
-    with Session() as session:
-        insurance_company = session.get(InsuranceCompany, data["companyId"])
-        magic_pill_plan = session.get(MagicPillPlan, data["planId"])
+def validate_user_data(data, action, lookups=None, checked=None):
+    # `checked` is this row's check_user_row() result when check_operations() already ran it
+    row_error = check_user_row(data, action) if checked is None else checked
+    if row_error:
+        return row_error
+
+    if action == "deactivate":
+        if lookups is not None:
+            return {} if data["companyId"] in lookups["companies"] else {"error": "Not Found", "message": "Insurance company not found."}
+        with Session() as session:
+            if not known_company_ids(session, {data["companyId"]}):
+                return {"error": "Not Found", "message": "Insurance company not found."}
+        return {}
 
-        if not magic_pill_plan:
+    if lookups is not None:
+        if data["planId"] not in lookups["plans"]:
             return {"error": "Not Found", "message": "Provided Magic Pill Plan ID not found."}
 
-        if not insurance_company:
+        if data["companyId"] not in lookups["companies"]:
+            return {"error": "Not Found", "message": "Insurance company not found."}
+
+        return {}
+
+    with Session() as session:
+        if not known_plan_ids(session, {data["planId"]}):
+            return {"error": "Not Found", "message": "Provided Magic Pill Plan ID not found."}
+
+        if not known_company_ids(session, {data["companyId"]}):
             return {"error": "Not Found", "message": "Insurance company not found."}
 
     return {}
 
 @app.route("/company", methods=["GET"])
 def get_all_companies():
-    insurance_companies = Session.query(InsuranceCompany).all()
-    return jsonify(results=[company.serialize() for company in insurance_companies])
+    return cached_list_response("companies", lambda: [company.serialize() for company in Session.query(InsuranceCompany).all()])
 
 @app.route("/company/<company_id>", methods=["GET"])
 def company(company_id):
     insurance_company = Session.query(InsuranceCompany).get(company_id)
     if not insurance_company:
         return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
-    users = Session.query(User).filter_by(companyId=company_id).all()
+    # Plain column tuples; company and plan come from the reference cache instead of per-row ORM objects
+    rows = Session.query(*[getattr(User, field) for field in USER_FIELDS]).filter_by(companyId=insurance_company.companyId).all()
+    with request_metrics.serialization_timer():
+        users = [serialize_user_row(Session, row._mapping) for row in rows]  # Serialize with all attributes
     return jsonify(results=[
         {
             "company": insurance_company.serialize(),
-            "users": [user.serialize_full() for user in users]  # Serialize with all attributes
+            "users": users,
+            "roster_version": insurance_company.rosterVersion
         }
     ])
+def parse_bool_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if value.lower() in ("true", "1"):
+        return True
+    if value.lower() in ("false", "0"):
+        return False
+    raise ValueError(f"'{name}' should be true or false.")
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@app.route("/company/<int:company_id>/version", methods=["GET"])
+def company_roster_version(company_id):
+    with Session() as session:
+        roster_version = get_roster_version(session, company_id)
+    if roster_version is None:
+        return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+    return jsonify(results=[{"companyId": company_id, "roster_version": roster_version}])
+
+@app.route("/company/<int:company_id>/summary", methods=["GET"])
+def get_company_summary(company_id):
+    # Headcounts from company_summaries; the cost does not grow with the roster
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if insurance_company is None:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+        summary = company_summary(session, company_id, cached_plans(session))
+        roster_version = insurance_company.rosterVersion
+    return jsonify(results=[dict(summary, companyId=company_id, roster_version=roster_version)])
+
+def parse_roster_filters():
+    # Query-string options shared by the paged and streamed roster reads; raises ValueError
+    fields = request.args.get("fields")
+    fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else USER_FIELDS
+    unknown = [field for field in fields if field not in USER_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}.")
+    if "documentId" not in fields:
+        fields = ["documentId"] + fields
+    return fields, {
+        "isActive": parse_bool_arg("isActive"),
+        "isDependant": parse_bool_arg("isDependant"),
+        "planId": request.args.get("planId", type=int),
+        "email": request.args.get("email"),
+        "name": request.args.get("name"),
+    }
+
+def roster_query(session, company_id, fields, filters):
+    # Only the requested columns are selected; no ORM objects or relationship loads per row
+    query = session.query(*[getattr(User, field) for field in fields]).filter(User.companyId == company_id)
+    if filters["isActive"] is not None:
+        query = query.filter(User.isActive == filters["isActive"])
+    if filters["isDependant"] is not None:
+        query = query.filter(User.isDependant == filters["isDependant"])
+    if filters["planId"] is not None:
+        query = query.filter(User.planId == filters["planId"])
+    if filters["email"]:
+        query = query.filter(User.email.ilike(escape_like(filters["email"]) + "%", escape="\\"))
+    if filters["name"]:
+        prefix = escape_like(filters["name"]) + "%"
+        query = query.filter(or_(User.firstName.ilike(prefix, escape="\\"), User.lastName.ilike(prefix, escape="\\")))
+    return query.order_by(User.documentId)
+
+@app.route("/company/<int:company_id>/users", methods=["GET"])
+def company_users_page(company_id):
+    try:
+        limit = request.args.get("limit", roster_page_size, type=int)
+        if not limit or limit < 1 or limit > roster_max_page_size:
+            raise ValueError(f"'limit' should be between 1 and {roster_max_page_size}.")
+        cursor = request.args.get("cursor", type=int)
+        fields, filters = parse_roster_filters()
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if not insurance_company:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+
+        query = roster_query(session, company_id, fields, filters)
+        if cursor is not None:
+            query = query.filter(User.documentId > cursor)
+
+        # One extra row tells us whether another page exists
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        users = [dict(zip(fields, row)) for row in rows[:limit]]
+
+        plan_ids = {user["planId"] for user in users if user.get("planId") is not None}
+        plans = session.query(MagicPillPlan).filter(MagicPillPlan.planId.in_(plan_ids)).all() if plan_ids else []
+
+        return jsonify(results=[{
+            "company": insurance_company.serialize(),
+            "plans": [plan.serialize() for plan in plans],
+            "users": users,
+            "limit": limit,
+            "next_cursor": users[-1]["documentId"] if has_more else None,
+            "roster_version": insurance_company.rosterVersion,
+        }])
+
+@app.route("/company/<int:company_id>/users/stream", methods=["GET"])
+def company_users_stream(company_id):
+    # The whole (filtered) roster from a server-side cursor, encoded and sent in batches:
+    #   format=ndjson    one user object per line
+    #   format=columnar  {"company", "roster_version", "fields", "rows"} with each user as an array
+    output = request.args.get("format", "ndjson")
+    try:
+        if output not in ("ndjson", "columnar"):
+            raise ValueError("'format' should be ndjson or columnar.")
+        fields, filters = parse_roster_filters()
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if not insurance_company:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+        head = {"company": insurance_company.serialize(), "roster_version": insurance_company.rosterVersion}
+
+    def generate():
+        # Own session: the rows are read while the response is being sent
+        with session_factory() as session:
+            rows = roster_query(session, company_id, fields, filters).yield_per(STREAM_BATCH_SIZE)
+            if output == "ndjson":
+                yield from iter_ndjson(fields, rows)
+            else:
+                yield from iter_columnar(fields, rows, head)
+
+    response = Response(stream_with_context(generate()),
+                        mimetype="application/x-ndjson" if output == "ndjson" else "application/json")
+    response.headers["X-Roster-Version"] = str(head["roster_version"])
+    return response
+
+@app.route("/company/<int:company_id>/export", methods=["GET"])
+def company_roster_export(company_id):
+    # The (filtered) roster with each user's plan name as a CSV or XLSX download, streamed from a
+    # server-side cursor. CSV is gzip-compressed when the client accepts it, unless gzip=false.
+    output = request.args.get("format", "csv")
+    try:
+        if output not in CONTENT_TYPES:
+            raise ValueError("'format' should be csv or xlsx.")
+        fields, filters = parse_roster_filters()
+        compress = output == "csv" and parse_bool_arg("gzip") is not False and "gzip" in request.accept_encodings
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if not insurance_company:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+        roster_version = insurance_company.rosterVersion
+
+    def generate():
+        # Own session; yield_per streams the rows (stream_results) instead of buffering the result set
+        with session_factory() as session:
+            rows = (roster_query(session, company_id, fields, filters)
+                    .outerjoin(MagicPillPlan, User.planId == MagicPillPlan.planId)
+                    .add_columns(MagicPillPlan.planName)
+                    .execution_options(stream_results=True)
+                    .yield_per(STREAM_BATCH_SIZE))
+            chunks = (iter_csv if output == "csv" else iter_xlsx)(fields + ["planName"], rows, STREAM_BATCH_SIZE)
+            yield from gzip_chunks(chunks) if compress else chunks
+
+    # No Content-Length, so the response goes out with chunked transfer encoding
+    response = Response(stream_with_context(generate()), content_type=CONTENT_TYPES[output])
+    response.headers["Content-Disposition"] = f'attachment; filename="company-{company_id}-roster.{output}"'
+    response.headers["X-Roster-Version"] = str(roster_version)
+    response.vary.add("Accept-Encoding")
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+def save_upload(file):
+    # werkzeug streams the upload to disk; rows are read back from the saved copy
+    os.makedirs(upload_folder, exist_ok=True)
+    path = os.path.join(upload_folder, f"{uuid.uuid4().hex}-{secure_filename(file.filename)}")
+    file.save(path)
+    return path
+
+def load_plan_lookups(session):
+    # Read fresh for every upload (one small query each), so a plan added out-of-band is accepted
+    # straight away; this also refreshes the cached copies
+    reference_cache.invalidate("plans_by_name", "plan_rows")
+
+    def load():
+        plans = session.query(MagicPillPlan.planId, MagicPillPlan.planName).all()
+        return {plan.planName.lower(): plan.planId for plan in plans if plan.planName}
+    return reference_cache.get_or_load("plans_by_name", on_primary(load)), cached_plans(session).keys()
+
+def check_roster_upload(file):
+    if file is None or file.filename == "":
+        return jsonify(results=[{"error": "Bad Request", "message": "No file provided."}]), 400
+    if not allowed_file(file.filename):
+        return jsonify(results=[{"error": "Bad Request", "message": "Only .csv and .xlsx files are supported."}]), 400
+    return None
+
+@app.route("/company/<int:company_id>/ingest", methods=["POST"])
+def ingest_roster(company_id):
+    file = request.files.get("file")
+    upload_error = check_roster_upload(file)
+    if upload_error:
+        return upload_error
+
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if not insurance_company:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+
+        path = save_upload(file)
+        try:
+            plans_by_name, plan_ids = load_plan_lookups(session)
+            errors = {"count": 0, "rows": []}
+
+            rows = iter_normalized_rows(iter_roster_file(path), insurance_company, plans_by_name, plan_ids, errors)
+            outcome = load_roster(session, rows, lambda inserted, row: record_changes(session, "add" if inserted else "update", [row]), errors)
+            if outcome["added"] or outcome["updated"]:
+                bump_roster_versions(session, {company_id})
+            session.commit()
+        except ValueError as e:
+            session.rollback()
+            return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+        except SQLAlchemyError as e:
+            session.rollback()
+            logging.error(f"Database Error during roster ingest: {str(e)}")
+            return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
+        finally:
+            os.remove(path)
+
+    return jsonify(results=[{
+        "success": True,
+        "message": "Roster ingested successfully",
+        "added": outcome["added"],
+        "updated": outcome["updated"],
+        "skipped": outcome["skipped"],
+        "rejected": errors["count"],
+        "errors": errors["rows"],
+    }])
+
+@app.route("/company/<int:company_id>/diff", methods=["POST"])
+def diff_company_roster(company_id):
+    file = request.files.get("file")
+    upload_error = check_roster_upload(file)
+    if upload_error:
+        return upload_error
+
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if not insurance_company:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+
+        path = save_upload(file)
+        try:
+            plans_by_name, plan_ids = load_plan_lookups(session)
+            errors = {"count": 0, "rows": []}
+
+            rows = iter_normalized_rows(iter_roster_file(path), insurance_company, plans_by_name, plan_ids, errors)
+            delta = diff_roster(session, company_id, rows)
+        except ValueError as e:
+            return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+        except SQLAlchemyError as e:
+            logging.error(f"Database Error during roster diff: {str(e)}")
+            return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
+        finally:
+            os.remove(path)
+
+    return jsonify(results=[dict(delta, rejected=errors["count"], errors=errors["rows"])])
+
+# STAGED ROSTER UPLOADS
+#
+# Upload once, review the diff, approve by staging id: the parsed rows are kept in staging_store
+# under the hash of the company id and the file, so re-uploading the same file skips parsing and
+# approving never needs the file again.
+
+def staged_roster_response(session, entry, reused):
+    delta = diff_roster(session, entry["company_id"], entry["rows"])
+    return jsonify(results=[dict(
+        delta,
+        staging_id=entry["key"],
+        reused=reused,
+        filename=entry["filename"],
+        staged_rows=len(entry["rows"]),
+        rejected=entry["rejected"],
+        errors=entry["errors"],
+        warnings=approval_warnings(entry, len(delta["removals"])),
+        roster_version=get_roster_version(session, entry["company_id"]),
+        expires_at=datetime.fromtimestamp(entry["created_at"] + staging_store.ttl_seconds).isoformat(),
+    )])
+
+def get_staged_roster(company_id, staging_id):
+    entry = staging_store.get(staging_id)
+    if entry is None or entry["company_id"] != company_id:
+        return None
+    return entry
+
+@app.route("/company/<int:company_id>/stage", methods=["POST"])
+def stage_company_roster(company_id):
+    file = request.files.get("file")
+    upload_error = check_roster_upload(file)
+    if upload_error:
+        return upload_error
+
+    with Session() as session:
+        insurance_company = session.get(InsuranceCompany, company_id)
+        if not insurance_company:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+
+        staging_store.purge_expired()
+        path = save_upload(file)
+        try:
+            key = content_key(path, str(company_id))
+            entry = staging_store.get(key)
+            reused = entry is not None
+            if not reused:
+                plans_by_name, plan_ids = load_plan_lookups(session)
+                errors = {"count": 0, "rows": []}
+                rows = list(iter_normalized_rows(iter_roster_file(path), insurance_company, plans_by_name, plan_ids, errors))
+                entry = staging_store.put(key, {
+                    "company_id": company_id,
+                    "filename": file.filename,
+                    "rows": rows,
+                    "rejected": errors["count"],
+                    "errors": errors["rows"],
+                })
+            return staged_roster_response(session, entry, reused)
+        except ValueError as e:
+            return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+        except SQLAlchemyError as e:
+            logging.error(f"Database Error during roster staging: {str(e)}")
+            return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
+        finally:
+            os.remove(path)
+
+@app.route("/company/<int:company_id>/stage/<staging_id>", methods=["GET"])
+def review_staged_roster(company_id, staging_id):
+    entry = get_staged_roster(company_id, staging_id)
+    if entry is None:
+        return jsonify(results=[{"error": "Not Found", "message": "Staged upload not found or expired."}]), 404
+    with Session() as session:
+        # The diff is recomputed against the roster as it is now
+        return staged_roster_response(session, entry, True)
+
+def missing_users_filter(company_id, emails):
+    # The company's active users whose lower-cased email is not in `emails`: diff_roster's removals.
+    # An empty `emails` matches every active user.
+    users = User.__table__
+    return (
+        users.c.companyId == company_id,
+        users.c.isActive.is_(True),
+        func.coalesce(func.lower(users.c.email), "") != all_(bindparam("emails", sorted(emails), type_=ARRAY(String))),
+    )
+
+def count_missing_users(session, company_id, emails):
+    return session.execute(select(func.count()).select_from(User.__table__).where(*missing_users_filter(company_id, emails))).scalar()
+
+def deactivate_missing_users(session, company_id, emails):
+    # Deactivates the users count_missing_users() counts, in one UPDATE ... RETURNING
+    users = User.__table__
+    statement = update(users).where(*missing_users_filter(company_id, emails)).values(isActive=False).returning(*users.c)
+    deactivated = session.execute(statement).mappings().all()
+    record_changes(session, "toggle", deactivated)
+    return deactivated
+
+def approval_warnings(entry, deactivations):
+    # Why approving `entry` needs confirm=true; an empty list when it does not
+    warnings = []
+    if not entry["rows"]:
+        warnings.append("The staged roster has no valid rows, so approving it deactivates every active user of the company.")
+    elif entry["rejected"]:
+        warnings.append(f"{entry['rejected']} rows of the staged roster were rejected; approving it deactivates any active users they listed.")
+    if deactivations > staging_max_deactivations:
+        warnings.append(f"Approving deactivates {deactivations} users, more than the {staging_max_deactivations} allowed without confirmation.")
+    return warnings
+
+@app.route("/company/<int:company_id>/stage/<staging_id>/approve", methods=["POST"])
+def approve_staged_roster(company_id, staging_id):
+    entry = get_staged_roster(company_id, staging_id)
+    if entry is None:
+        if staging_store.is_approved(staging_id):
+            return jsonify(results=[{"error": "Conflict", "message": "Staged upload was already approved."}]), 409
+        return jsonify(results=[{"error": "Not Found", "message": "Staged upload not found or expired."}]), 404
+
+    try:
+        confirmed = parse_bool_arg("confirm") or False
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+
+    emails = {row["email"].lower() for _, row in entry["rows"]}
+    claimed = approved = False
+    with Session() as session:
+        try:
+            deactivations = count_missing_users(session, company_id, emails)
+            warnings = [] if confirmed else approval_warnings(entry, deactivations)
+            if warnings:
+                session.rollback()
+                return jsonify(results=[{
+                    "error": "Conflict",
+                    "message": " ".join(warnings) + " Approve with confirm=true to go ahead.",
+                    "warnings": warnings,
+                    "deactivations": deactivations,
+                }]), 409
+
+            # Only one worker can claim the upload; the claim is released below if the approve fails
+            if not staging_store.claim(staging_id):
+                session.rollback()
+                return jsonify(results=[{"error": "Conflict", "message": "Staged upload is being approved or was already approved."}]), 409
+            claimed = True
+
+            # Rows the merge rejects are reported alongside those rejected at staging time
+            errors = {"count": entry["rejected"], "rows": list(entry["errors"])}
+            outcome = load_roster(session, iter(entry["rows"]), lambda inserted, row: record_changes(session, "add" if inserted else "update", [row]), errors)
+            # The review diff's removals: active users the file no longer lists
+            deactivated = deactivate_missing_users(session, company_id, emails)
+            roster_version = get_roster_version(session, company_id)
+            if outcome["added"] or outcome["updated"] or deactivated:
+                roster_version = bump_roster_versions(session, {company_id})[company_id]
+            session.commit()
+            approved = True
+        except SQLAlchemyError as e:
+            session.rollback()
+            logging.error(f"Database Error approving staged roster {staging_id}: {str(e)}")
+            return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
+        finally:
+            if claimed and not approved:
+                staging_store.release(staging_id)
+
+    staging_store.mark_approved(staging_id)
+    return jsonify(results=[{
+        "success": True,
+        "message": "Staged roster approved",
+        "added": outcome["added"],
+        "updated": outcome["updated"],
+        "deactivated": len(deactivated),
+        "skipped": outcome["skipped"],
+        "rejected": errors["count"],
+        "errors": errors["rows"],
+        "roster_version": roster_version,
+    }])
+
+@app.route("/company/<int:company_id>/stage/<staging_id>", methods=["DELETE"])
+def discard_staged_roster(company_id, staging_id):
+    if get_staged_roster(company_id, staging_id) is None:
+        return jsonify(results=[{"error": "Not Found", "message": "Staged upload not found or expired."}]), 404
+    staging_store.delete(staging_id)
+    return jsonify(results=[{"success": True, "message": "Staged upload discarded"}])
+
+@app.route("/staging/stats", methods=["GET"])
+def get_staging_stats():
+    return jsonify(results=[staging_store.stats()])
+
+# AGES AND ELIGIBILITY
+
+def parse_day_arg(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"'{name}' should be a date in YYYY-MM-DD format.") from None
+
+@app.route("/company/<int:company_id>/eligibility", methods=["GET"])
+def company_eligibility_changes(company_id):
+    # Users turning `age` between `from` and `to` (inclusive), e.g. dependants ageing out at 26
+    try:
+        age = request.args.get("age", eligibility_default_age, type=int)
+        if age < 0 or age > 150:
+            raise ValueError("'age' should be between 0 and 150.")
+        start = parse_day_arg("from", date.today())
+        end = parse_day_arg("to", start + timedelta(days=eligibility_window_days))
+        if end < start:
+            raise ValueError("'to' should not be before 'from'.")
+        if (end - start).days > eligibility_max_window_days:
+            raise ValueError(f"The window from 'from' to 'to' should be at most {eligibility_max_window_days} days.")
+        is_dependant = parse_bool_arg("isDependant")
+        is_active = parse_bool_arg("isActive")
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+
+    with Session() as session:
+        if session.get(InsuranceCompany, company_id) is None:
+            return jsonify(results=[{"error": "Not Found", "message": "Company not found."}]), 404
+        users = upcoming_birthdays(session, company_id, age, start, end, is_dependant, is_active)
+
+    return jsonify(results=[{
+        "companyId": company_id,
+        "age": age,
+        "from": start,
+        "to": end,
+        "count": len(users),
+        "users": users,
+    }])
+
+def recompute_ages(as_of=None):
+    # One set-based UPDATE per company, each in its own short transaction, so no run holds locks
+    # on more than one company's users at a time
+    as_of = as_of or date.today()
+    outcome = {"companies": 0, "skipped": 0, "updated": 0}
+    with session_factory() as session:
+        company_ids = [company_id for (company_id,) in session.query(InsuranceCompany.companyId).order_by(InsuranceCompany.companyId)]
+    for company_id in company_ids:
+        with session_factory() as session:
+            rows = recompute_company_ages(session, company_id, as_of)
+            if rows is None:
+                session.rollback()
+                outcome["skipped"] += 1
+                continue
+            if rows:
+                record_changes(session, "update", rows, source="age_recompute")
+                bump_roster_versions(session, {company_id})
+            session.commit()
+        outcome["companies"] += 1
+        outcome["updated"] += len(rows)
+    logging.info("Recomputed ages as of %s: %s", as_of, outcome)
+    return outcome
+
+# Started and stopped by asgi.py; None when recompute_interval_hours is 0
+age_recompute_job = PeriodicJob(
+    "age-recompute", recompute_ages, age_recompute_hours * 3600, initial_delay=60,
+) if age_recompute_hours > 0 else None
+
+@app.route("/users/ages/recompute", methods=["POST"])
+def recompute_user_ages():
+    bulk_executor.submit(recompute_ages)
+    return jsonify(results=[{"success": True, "message": "Age recompute started"}]), 202
+
 # USER ROUTES
 
 @app.route("/user/add", methods=["POST"])
@@ -220,38 +1406,44 @@ def add_user():
         if field not in data:
             return jsonify(results=[{"error": "Bad Request", "message": f"'{field}' is required."}]), 400
 
-    # Check for the existence of the referenced insurance company and magic pill plan
-    insurance_company = Session.query(InsuranceCompany).get(data["companyId"])
-    magic_pill_plan = Session.query(MagicPillPlan).get(data["planId"])
+    try:
+        data = with_age(data)
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
 
-    if not insurance_company or not magic_pill_plan:
+    # Check for the existence of the referenced insurance company and magic pill plan
+    if not known_company_ids(Session, {data["companyId"]}) or not known_plan_ids(Session, {data["planId"]}):
         return jsonify(results=[{"error": "Not Found", "message": "Insurance company or Magic Pill Plan not found."}]), 404
 
-    # Create the new user with required and optional fields
-    new_user = User(
+    # Insert and echo the row back in one statement; an existing email yields no row
+    users = User.__table__
+    statement = insert(users).values(
         username=data["username"],
         email=data["email"],
         companyId=data["companyId"],
         planId=data["planId"],
         isActive=data["isActive"],
         dob=data.get("dob"),
+        age=data.get("age"),
         company=data.get("company"),
         firstName=data.get("firstName"),
         lastName=data.get("lastName"),
         phone=data.get("phone"),
 	    isDependant=data["isDependant"], #change to is_dependant later potentially
         address=data.get("address")
-    )
+    ).on_conflict_do_nothing(index_elements=["email"]).returning(*[users.c[field] for field in USER_FIELDS])
 
     try:
         with Session() as session:
-            session.add(new_user)
+            added_user = session.execute(statement).mappings().first()
+            if added_user is not None:
+                bump_roster_versions(session, {added_user["companyId"]})
+                record_changes(session, "add", [added_user])
             session.commit()
-            added_user = session.query(User).filter(User.username == data["username"]).one_or_none()
 
             if added_user is None:
-                return jsonify(results=[{"error": "User not found after add", "message": "There was an error adding the user."}]), 500
-            added_user_data = added_user.serialize()
+                return jsonify(results=[{"error": "Database Integrity Error", "message": f"A user with email {data['email']} already exists."}]), 500
+            added_user_data = {field: added_user[field] for field in USER_FIELDS}
 
             return jsonify(results=[{"success": True, "message": "User added successfully", "user": added_user_data}])
     except exc.IntegrityError as e:
@@ -263,42 +1455,64 @@ def add_user():
 @app.route("/user/update/<documentId>", methods=["POST"])
 def update_user(documentId):
     data = request.get_json()
+    if not data:
+        return jsonify(results=[{"error": "Bad Request", "message": "No data provided."}]), 400
+    try:
+        data = with_age(dict(data, dob=data.get("dob")))
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+
+    users = User.__table__
+    statement = update(users).where(users.c.documentId == documentId).values(
+        username=data.get("username"),
+        email=data.get("email"),
+        companyId=data.get("companyId"),
+        planId=data.get("planId"),
+        isActive=data.get("isActive"),
+        address=data.get("address"),
+        dob=data.get("dob"),
+        age=data.get("age"),
+        company=data.get("company"),
+        firstName=data.get("firstName"),
+        lastName=data.get("lastName"),
+        phone=data.get("phone"),
+        isDependant=data.get("isDependant"),
+    ).returning(*[users.c[field] for field in USER_FIELDS])
 
     with Session() as session:
-        user = session.query(User).get(documentId)
-        if not user:
-            return jsonify(results=[{"error": "Not Found", "message": "User not found."}]), 404
-
-        user.username = data.get("username")
-        user.email = data.get("email")
-        user.companyId = data.get("companyId")
-        user.planId = data.get("planId")
-        user.isActive = data.get("isActive")
-        user.address = data.get("address")
-        user.dob = data.get("dob")
-        user.company = data.get("company")
-        user.firstName = data.get("firstName")
-        user.lastName = data.get("lastName")
-        user.phone = data.get("phone")
-        user.isDependant =data.get("isDependant")
-
         try:
+            updated_user = session.execute(statement).mappings().first()
+            if updated_user is None:
+                session.rollback()
+                return jsonify(results=[{"error": "Not Found", "message": "User not found."}]), 404
+            bump_roster_versions(session, {updated_user["companyId"]})
+            record_changes(session, "update", [updated_user])
             session.commit()
-            return jsonify(results=[{"success": True, "message": "User updated successfully", "user": user.serialize_full()}])
+            return jsonify(results=[{"success": True, "message": "User updated successfully", "user": serialize_user_row(session, updated_user)}])
         except exc.SQLAlchemyError as e:
             session.rollback()
             return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
 
 @app.route("/user/toggle/<documentId>", methods=["POST"])
 def toggle_user(documentId):
+    users = User.__table__
+    statement = (
+        update(users)
+        .where(users.c.documentId == documentId)
+        .values(isActive=not_(func.coalesce(users.c.isActive, False)))
+        .returning(users.c.documentId, users.c.companyId, users.c.isActive)
+    )
+
     with Session() as session:
-        user = session.query(User).get(documentId)
-        if not user:
-            return jsonify(results=[{"error": "Not Found", "message": "User not found."}]), 404
-        user.isActive = not user.isActive
         try:
+            toggled = session.execute(statement).first()
+            if toggled is None:
+                session.rollback()
+                return jsonify(results=[{"error": "Not Found", "message": "User not found."}]), 404
+            bump_roster_versions(session, {toggled.companyId})
+            record_changes(session, "toggle", [toggled._mapping])
             session.commit()
-            return jsonify(results=[{"success": True, "message": "User status toggled successfully", "isActive": user.isActive}])
+            return jsonify(results=[{"success": True, "message": "User status toggled successfully", "isActive": toggled.isActive}])
         except exc.SQLAlchemyError as e:
             session.rollback()
             return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
@@ -306,17 +1520,26 @@ def toggle_user(documentId):
     
 @app.route("/user/<documentId>", methods=["GET"])
 def get_user(documentId):
-    user = Session.query(User).get(documentId)
+    user = Session.query(User).options(*User.full_load_options()).get(documentId)
     if not user:
         return jsonify(results=[{"error": "Not Found", "message": "User not found."}]), 404
     return jsonify(results=[user.serialize_full()])  # Serialize with all attributes
 
+@app.route("/user/email/<email>", methods=["GET"])
+def get_user_by_email(email):
+    # Matches the expression of ix_users_email_lower so the lookup is an index seek
+    user = Session.query(User).options(*User.full_load_options()).filter(func.lower(User.email) == email.lower()).first()
+    if not user:
+        return jsonify(results=[{"error": "Not Found", "message": "User not found."}]), 404
+    return jsonify(results=[user.serialize_full()])
+
 # ADMIN ROUTES
 @app.route("/admins", methods=["GET"])
 def get_all_admins():
-    with Session() as session:
-        admins = session.query(Admin).all()
-    return jsonify([admin.serialize() for admin in admins])
+    def load():
+        with Session() as session:
+            return [admin.serialize() for admin in session.query(Admin).all()]
+    return jsonify(reference_cache.get_or_load("admins", on_primary(load)))
 
 @app.route("/admins/<int:admin_id>", methods=["GET"])
 def get_admin(admin_id):
@@ -328,35 +1551,39 @@ def get_admin(admin_id):
 @app.route("/admins", methods=["POST"])
 def create_admin():
     data = request.json
-    new_admin = Admin(
-        admin_username=data.get('admin_username'),
-        admin_email=data.get('admin_email'),
-        companyId=data.get('companyId')
-    )
-    session.add(new_admin)
-    session.commit()
-    return jsonify(new_admin.serialize()), 201
+    with Session() as session:
+        new_admin = Admin(
+            admin_username=data.get('admin_username'),
+            admin_email=data.get('admin_email'),
+            companyId=data.get('companyId')
+        )
+        session.add(new_admin)
+        session.commit()
+        invalidate_admin_cache()
+        return jsonify(new_admin.serialize()), 201
 @app.route("/admins/<int:admin_id>", methods=["PUT"])
 def update_admin(admin_id):
     with Session() as session:
         admin = session.query(Admin).get(admin_id)
-    if admin is None:
-        return jsonify({"error": "Admin not found"}), 404
-    data = request.json
-    admin.admin_username = data.get('admin_username', admin.admin_username)
-    admin.admin_email = data.get('admin_email', admin.admin_email)
-    admin.companyId = data.get('companyId', admin.companyId)
-    session.commit()
-    return jsonify(admin.serialize())
+        if admin is None:
+            return jsonify({"error": "Admin not found"}), 404
+        data = request.json
+        admin.admin_username = data.get('admin_username', admin.admin_username)
+        admin.admin_email = data.get('admin_email', admin.admin_email)
+        admin.companyId = data.get('companyId', admin.companyId)
+        session.commit()
+        invalidate_admin_cache()
+        return jsonify(admin.serialize())
 
 @app.route("/admins/<int:admin_id>", methods=["DELETE"])
 def delete_admin(admin_id):
     with Session() as session:
         admin = session.query(Admin).get(admin_id)
-    if admin is None:
-        return jsonify({"error": "Admin not found"}), 404
-    session.delete(admin)
-    session.commit()
+        if admin is None:
+            return jsonify({"error": "Admin not found"}), 404
+        session.delete(admin)
+        session.commit()
+        invalidate_admin_cache()
     return jsonify({"message": "Admin deleted successfully"}), 200
 
 
@@ -414,26 +1641,159 @@ def remove_insurance_company_from_admin(admin_id):
 @app.route("/admins/email/<admin_email>", methods=["GET"])
 def get_admin_by_email(admin_email):
     standardized_email = admin_email.lower()
-    with Session() as session:
-        admin = session.query(Admin).filter(func.lower(Admin.admin_email) == standardized_email).first()
-
-    if admin:
-        return jsonify({
-            "exists": True,
-            "admin_id": admin.admin_id,
-            "email": admin.admin_email,
-            "username": admin.admin_username,
-            "company_id": admin.companyId
-        })
-    else:
+
+    cached = reference_cache.get(("admin_email", standardized_email))
+    if cached is not None:
+        return jsonify(cached)
+
+    def load():
+        with Session() as session:
+            # Matches the expression of ix_admins_admin_email_lower so the lookup is an index seek
+            return session.query(Admin).filter(func.lower(Admin.admin_email) == standardized_email).first()
+
+    # Misses are not cached: an admin created on another worker, or outside this API, would
+    # otherwise stay "missing" here until the entry expired
+    admin = on_primary(load)()
+    if not admin:
         return jsonify({"exists": False})
+    found = {
+        "exists": True,
+        "admin_id": admin.admin_id,
+        "email": admin.admin_email,
+        "username": admin.admin_username,
+        "company_id": admin.companyId
+    }
+    reference_cache.set(("admin_email", standardized_email), found)
+    return jsonify(found)
     
+# DRUG FORMULARY
+
+def ensure_drug_index():
+    if drug_index.built:
+        return
+    with drug_index_lock:
+        if not drug_index.built:
+            refresh_drug_index(full=True)
+
+def refresh_drug_index(full=True):
+    # drugs has no change marker, so both modes read every row; the incremental one only reindexes
+    # rows that differ from the index, and leaves the rest of it in place
+    with Session() as session:
+        drugs = (drug.serialize() for drug in session.query(Drug).yield_per(5000))
+        if full:
+            drug_index.build(drugs)
+        else:
+            drug_index.sync(drugs)
+
+def rebuild_drug_index():
+    try:
+        with drug_index_lock:
+            refresh_drug_index(full=True)
+    except Exception:
+        logging.exception("Could not rebuild the drug search index after a formulary import")
+
+@app.route("/drugs/search", methods=["GET"])
+def search_drugs():
+    try:
+        is_free = parse_bool_arg("is_free")
+        is_high_cost = parse_bool_arg("is_high_cost")
+    except ValueError as e:
+        return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+    limit = min(request.args.get("limit", 20, type=int) or 20, 100)
+
+    ensure_drug_index()
+    drugs = drug_index.search(
+        request.args.get("q", ""),
+        limit=limit,
+        plan_type=request.args.get("plan_type"),
+        is_free=is_free,
+        is_high_cost=is_high_cost,
+    )
+    return jsonify(results=drugs)
+
+@app.route("/drugs/index/refresh", methods=["POST"])
+def refresh_drugs_index():
+    full = request.args.get("full", "true").lower() in ("true", "1")
+    with drug_index_lock:
+        refresh_drug_index(full=full)
+    return jsonify(results=[{"success": True, "message": "Drug index refreshed", "drugs": len(drug_index)}])
+
+@app.route("/drugs/import", methods=["POST"])
+def import_drug_formulary():
+    file = request.files.get("file")
+    upload_error = check_roster_upload(file)
+    if upload_error:
+        return upload_error
+
+    path = save_upload(file)
+    with Session() as session:
+        try:
+            errors = {"count": 0, "rows": []}
+            outcome = load_formulary(session, iter_formulary_batches(path, formulary_batch_size), file.filename, errors)
+            session.commit()
+        except ValueError as e:
+            session.rollback()
+            return jsonify(results=[{"error": "Bad Request", "message": str(e)}]), 400
+        except SQLAlchemyError as e:
+            session.rollback()
+            logging.error(f"Database Error during formulary import: {str(e)}")
+            return jsonify(results=[{"error": "Database Error", "message": str(e)}]), 500
+        finally:
+            os.remove(path)
+
+    # The old index describes the replaced table. Rebuild it off the request; searches keep using
+    # the old one until the new one is swapped in.
+    bulk_executor.submit(rebuild_drug_index)
+
+    return jsonify(results=[{
+        "success": True,
+        "message": "Formulary imported successfully",
+        "version": outcome["version"],
+        "loaded": outcome["loaded"],
+        "rejected": errors["count"],
+        "errors": errors["rows"],
+    }])
+
+@app.route("/drugs/versions", methods=["GET"])
+def get_formulary_versions():
+    versions = Session.query(FormularyVersion).order_by(FormularyVersion.version.desc()).limit(20).all()
+    return jsonify(results=[version.serialize() for version in versions])
+
     # Plans
 @app.route("/plans", methods=["GET"])
 def get_all_magic_pill_plans():
-    magic_pill_plans = Session.query(MagicPillPlan).all()
-    return jsonify(results=[plan.serialize() for plan in magic_pill_plans])
+    return cached_list_response("plans", lambda: [plan.serialize() for plan in Session.query(MagicPillPlan).all()])
+
+
+# STARTUP
+
+def warm_up(connections=None):
+    # Opens `connections` pool connections (default [startup] warm_connections, else the pool size)
+    # on the primary and on the replica, if any, and loads the reference caches, so the first requests after a deploy don't pay for either
+    started = time.perf_counter()
+    pool_engine = get_engine()
+    if connections is None:
+        connections = config.getint("startup", "warm_connections", fallback=pool_engine.pool.size())
+    engines = [pool_engine] + ([get_replica_engine()] if get_replica_engine() is not None else [])
+    opened = [warm_engine.connect() for warm_engine in engines for _ in range(connections)]
+    for connection in opened:
+        connection.close()
+    with session_factory() as session:
+        cached_companies(session)
+        load_plan_lookups(session)
+    return {"connections": connections, "seconds": round(time.perf_counter() - started, 3)}
+
+def create_app(warm=False):
+    # Entry point for servers and scripts. Routes are registered when this module is imported;
+    # the engine, its connections and the caches are created on first use, or here with `warm`.
+    # An unreachable database only costs the warm-up: the app still starts and connects on use.
+    if warm:
+        try:
+            logging.info("Warm-up: %s", warm_up())
+        except SQLAlchemyError as e:
+            logging.warning("Could not warm up the database pool and reference caches: %s", e)
+    return app
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=3000)
\ No newline at end of file
+    create_app(warm=True).run(host="0.0.0.0", port=3000)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    # Checkout wait times and connection counters for one engine's pool
+    def __init__(self, sample_size=1000):
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_errors = 0
+        self.connections_opened = 0
+        self.connections_invalidated = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._waits = deque(maxlen=sample_size)
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self._waits.append(seconds)
+
+    def record_checkout_error(self):
+        with self._lock:
+            self.checkout_errors += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def record_invalidate(self):
+        with self._lock:
+            self.connections_invalidated += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_errors': self.checkout_errors,
+                'connections_opened': self.connections_opened,
+                'connections_invalidated': self.connections_invalidated,
+                'wait_ms_avg': 1000 * self.wait_total / self.checkouts if self.checkouts else 0.0,
+                'wait_ms_p50': 1000 * _percentile(waits, 0.50),
+                'wait_ms_p95': 1000 * _percentile(waits, 0.95),
+                'wait_ms_p99': 1000 * _percentile(waits, 0.99),
+                'wait_ms_max': 1000 * self.wait_max,
+            }
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class MeteredQueuePool(QueuePool):
+    # QueuePool that times how long each checkout waited for a free connection
+    def __init__(self, *args, metrics=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics or PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        except Exception:
+            # e.g. the database refused a new connection: not a wait for a free one
+            self.metrics.record_checkout_error()
+            raise
+        self.metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def instrument_pool(engine):
+    metrics = engine.pool.metrics
+    event.listen(engine, "connect", lambda dbapi_connection, record: metrics.record_connect())
+    event.listen(engine, "invalidate", lambda dbapi_connection, record, exception: metrics.record_invalidate())
+    return metrics
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class ReferenceCache:
+    # Small TTL + LRU cache for rarely changing reference rows (plans, companies, admins)
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        # The loader runs outside the lock; two concurrent misses may both load, which is harmless here
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, _MISSING) is not _MISSING:
+                    self.invalidations += 1
+
+    def invalidate_prefix(self, prefix):
+        # Keys are tuples whose first item names the kind of row, e.g. ("admin_email", email)
+        with self._lock:
+            for key in [key for key in self._entries if isinstance(key, tuple) and key[0] == prefix]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,320 @@
+import cProfile
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Per-request SQL and serialization accounting, aggregated per Flask endpoint.
+#
+# Engine events time every statement and charge it to the request running on that thread; Flask
+# hooks open and close the per-request record. Requests slower than `slow_request_ms` are logged
+# with the fingerprints of their statements, and a `profile_sample_rate` fraction of requests runs
+# under cProfile with the stats dumped to `profile_folder`.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_FINGERPRINTS = 500
+SLOW_LOG_QUERIES = 5
+# Statements are normalized from their first this-many characters; the rest of a multi-row VALUES
+# or a long literal list adds nothing to the query's shape
+MAX_STATEMENT_CHARS = 4096
+
+_IN_LIST = re.compile(r"\bIN\s*\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)*\s*\)", re.IGNORECASE)
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\?")
+_NUMBER = re.compile(r"\b\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement):
+    # Same shape of query -> same text: parameters, literals and IN lists collapse to placeholders.
+    # Capped before the cache, which would otherwise keep up to 2048 statements of any size alive.
+    if len(statement) <= MAX_STATEMENT_CHARS:
+        return _normalize(statement)
+    head = statement[:MAX_STATEMENT_CHARS]
+    if head.count("'") % 2:
+        # Cut inside a literal; drop it rather than show its text unnormalized
+        head = head[:head.rindex("'")]
+    return _normalize(head) + " ..."
+
+
+@lru_cache(maxsize=2048)
+def _normalize(statement):
+    normalized = _IN_LIST.sub("IN (?)", statement)
+    normalized = _STRING.sub("?", normalized)
+    normalized = _PARAMETER.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    return _SPACE.sub(" ", normalized).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.md5(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.serialization_seconds = 0.0
+        self.statements = {}
+
+    def record_query(self, statement, seconds, rows):
+        self.queries += 1
+        self.db_seconds += seconds
+        self.rows += rows
+        entry = self.statements.get(statement)
+        if entry is None:
+            entry = self.statements[statement] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def top_statements(self, limit):
+        # [(fingerprint, count, seconds, normalized sql)], slowest first
+        grouped = {}
+        for statement, (count, seconds) in self.statements.items():
+            normalized = normalize_statement(statement)
+            entry = grouped.setdefault(normalized, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+        ranked = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [(fingerprint(sql), count, seconds, sql) for sql, (count, seconds) in ranked]
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.requests = {}
+        self.duration_buckets = [0] * len(LATENCY_BUCKETS)
+        self.duration_count = 0
+        self.duration_sum = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.serialization_seconds = 0.0
+        self.slow_requests = 0
+
+    def record(self, status, seconds, stats, slow):
+        self.requests[status] = self.requests.get(status, 0) + 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.duration_buckets[index] += 1
+        self.duration_count += 1
+        self.duration_sum += seconds
+        self.queries += stats.queries
+        self.db_seconds += stats.db_seconds
+        self.rows += stats.rows
+        self.serialization_seconds += stats.serialization_seconds
+        if slow:
+            self.slow_requests += 1
+
+
+class RequestMetrics:
+    def __init__(self, slow_request_ms=1000, profile_sample_rate=0.0, profile_folder=None):
+        self.slow_request_ms = slow_request_ms
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_folder = profile_folder
+        self.profiles_written = 0
+        self._routes = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    # Hooks
+
+    def start_request(self):
+        g.request_stats = RequestStats()
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this process (Python 3.12+ allows one)
+                return
+            g.request_profiler = profiler
+
+    def finish_request(self, response):
+        stats = g.pop("request_stats", None)
+        profiler = g.pop("request_profiler", None)
+        if stats is None:
+            return response
+        if profiler is not None:
+            profiler.disable()
+            self._dump_profile(profiler)
+
+        seconds = time.perf_counter() - stats.started
+        slow = seconds * 1000 >= self.slow_request_ms
+        endpoint = request.endpoint or "unmatched"
+        with self._lock:
+            route = self._routes.setdefault((endpoint, request.method), RouteMetrics())
+            route.record(response.status_code, seconds, stats, slow)
+            for statement, (count, total) in stats.statements.items():
+                self._record_fingerprint(statement, count, total)
+        if slow:
+            self._log_slow_request(endpoint, seconds, stats)
+        return response
+
+    def abandon_request(self, exception=None):
+        # after_request did not run (the request failed before a response existed)
+        profiler = g.pop("request_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+        g.pop("request_stats", None)
+
+    def record_query(self, statement, seconds, rows):
+        if has_request_context():
+            stats = g.get("request_stats")
+            if stats is not None:
+                stats.record_query(statement, seconds, rows)
+
+    @contextmanager
+    def serialization_timer(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if has_request_context():
+                stats = g.get("request_stats")
+                if stats is not None:
+                    stats.serialization_seconds += time.perf_counter() - started
+
+    # Aggregation
+
+    def _record_fingerprint(self, statement, count, seconds):
+        normalized = normalize_statement(statement)
+        entry = self._fingerprints.get(normalized)
+        if entry is None:
+            if len(self._fingerprints) >= MAX_FINGERPRINTS:
+                return
+            entry = self._fingerprints[normalized] = {"count": 0, "seconds": 0.0}
+        entry["count"] += count
+        entry["seconds"] += seconds
+
+    def top_queries(self, limit=20):
+        with self._lock:
+            ranked = sorted(self._fingerprints.items(), key=lambda item: item[1]["seconds"], reverse=True)[:limit]
+            return [{
+                'fingerprint': fingerprint(sql),
+                'count': entry["count"],
+                'total_ms': round(1000 * entry["seconds"], 3),
+                'mean_ms': round(1000 * entry["seconds"] / entry["count"], 3),
+                'sql': sql,
+            } for sql, entry in ranked]
+
+    def _log_slow_request(self, endpoint, seconds, stats):
+        statements = "; ".join(
+            f"{key} x{count} {1000 * total:.1f}ms [{sql[:200]}]"
+            for key, count, total, sql in stats.top_statements(SLOW_LOG_QUERIES)
+        )
+        logging.warning(
+            "Slow request %s %s: %.1f ms, %d queries, %.1f ms in DB, %d rows, %.1f ms serializing. Top queries: %s",
+            request.method, endpoint, 1000 * seconds, stats.queries, 1000 * stats.db_seconds, stats.rows,
+            1000 * stats.serialization_seconds, statements or "none",
+        )
+
+    def _dump_profile(self, profiler):
+        if not self.profile_folder:
+            return
+        try:
+            os.makedirs(self.profile_folder, exist_ok=True)
+            name = f"{request.endpoint or 'unmatched'}-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.prof"
+            profiler.dump_stats(os.path.join(self.profile_folder, name))
+            self.profiles_written += 1
+        except OSError:
+            logging.exception("Could not write a request profile to %s", self.profile_folder)
+
+    # Exposition
+
+    def render_prometheus(self, pool_snapshot=None):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            routes = sorted(self._routes.items())
+            family("http_requests_total", "counter", "Requests by endpoint, method and status.")
+            for (endpoint, method), route in routes:
+                for status, count in sorted(route.requests.items()):
+                    lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            family("http_request_duration_seconds", "histogram", "Request latency up to the response being returned.")
+            for (endpoint, method), route in routes:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, count in zip(LATENCY_BUCKETS, route.duration_buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {route.duration_count}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {route.duration_sum:.6f}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {route.duration_count}")
+
+            for name, attribute, help_text in (
+                ("app_db_queries_total", "queries", "SQL statements executed while serving requests."),
+                ("app_db_seconds_total", "db_seconds", "Time spent executing SQL while serving requests."),
+                ("app_db_rows_total", "rows", "Rows returned or affected by SQL while serving requests."),
+                ("app_serialization_seconds_total", "serialization_seconds", "Time spent building and encoding response bodies."),
+                ("app_slow_requests_total", "slow_requests", "Requests slower than the slow request threshold."),
+            ):
+                family(name, "counter", help_text)
+                for (endpoint, method), route in routes:
+                    value = getattr(route, attribute)
+                    value = f"{value:.6f}" if isinstance(value, float) else value
+                    lines.append(f'{name}{{endpoint="{endpoint}",method="{method}"}} {value}')
+
+        if pool_snapshot is not None:
+            for key in ("size", "checked_out", "checked_in", "overflow"):
+                family(f"app_db_pool_{key}", "gauge", f"Connection pool {key.replace('_', ' ')}.")
+                lines.append(f"app_db_pool_{key} {pool_snapshot[key]}")
+            family("app_db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.")
+            lines.append(f"app_db_pool_checkout_timeouts_total {pool_snapshot['checkout_timeouts']}")
+            family("app_db_pool_checkout_errors_total", "counter", "Checkouts that failed for another reason, e.g. a refused connection.")
+            lines.append(f"app_db_pool_checkout_errors_total {pool_snapshot['checkout_errors']}")
+        return "\n".join(lines) + "\n"
+
+
+def instrument_engine(engine, metrics):
+    # Times every statement `engine` runs and charges it to the request running on that thread
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+        metrics.record_query(statement, time.perf_counter() - started, rows)
+
+    @event.listens_for(engine, "handle_error")
+    def abandon_query(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+    return engine
+
+
+def instrument_requests(app, metrics):
+    # Wires `metrics` into the app's request hooks and JSON encoding; engines are added with
+    # instrument_engine() when they are created
+
+    app.before_request(metrics.start_request)
+    app.after_request(metrics.finish_request)
+    app.teardown_request(metrics.abandon_request)
+
+    # jsonify() encoding counts as serialization time
+    encode = app.json.dumps
+
+    def timed_dumps(obj, **kwargs):
+        with metrics.serialization_timer():
+            return encode(obj, **kwargs)
+
+    app.json.dumps = timed_dumps
+    return metrics
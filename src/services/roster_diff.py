@@ -0,0 +1,128 @@
+import hashlib
+import re
+
+from sqlalchemy import Boolean, Text, case, cast, func
+
+from models import User
+
+# Roster-controlled User.serialize() fields; username is not in most rosters so it is left out
+FINGERPRINT_COLUMNS = [
+    "email", "firstName", "lastName", "phone", "address",
+    "dob", "planId", "isActive", "isDependant",
+]
+
+_SEPARATOR = "\x1f"
+
+# Rosters carry phone numbers as digits (see ingest.normalize_roster_row) while stored ones may still
+# be formatted, so both sides compare digits only
+_NOT_DIGIT = "[^0-9]"
+
+
+def _column_expression(column):
+    if column == "dob":
+        # date::text follows the session's DateStyle; row_fingerprint() renders dates as ISO
+        return func.coalesce(func.to_char(User.dob, "YYYY-MM-DD"), "")
+    value = getattr(User, column)
+    if isinstance(value.type, Boolean):
+        # Spelled out rather than cast, so every database renders them as _fingerprint_text() does
+        value = case((value.is_(True), "true"), (value.is_(False), "false"))
+    else:
+        value = cast(value, Text)
+    if column == "phone":
+        value = func.regexp_replace(value, _NOT_DIGIT, "", "g")
+    return func.coalesce(value, "")
+
+
+def fingerprint_expression():
+    # md5 over the same text rendering row_fingerprint() uses, computed inside Postgres
+    parts = [_column_expression(column) for column in FINGERPRINT_COLUMNS]
+    return func.md5(func.concat_ws(_SEPARATOR, *parts))
+
+
+def _fingerprint_text(column, value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if column == "phone":
+        return re.sub(_NOT_DIGIT, "", str(value))
+    return str(value)
+
+
+def row_fingerprint(row):
+    text = _SEPARATOR.join(_fingerprint_text(column, row.get(column)) for column in FINGERPRINT_COLUMNS)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def diff_roster(session, company_id, rows):
+    # `rows` are normalized roster rows (see ingest.normalize_roster_row); last row wins per email
+    uploaded = {}
+    for _, row in rows:
+        uploaded[row["email"].lower()] = row
+
+    existing = session.query(
+        User.documentId,
+        func.lower(User.email).label("email_key"),
+        User.isActive,
+        fingerprint_expression().label("fingerprint"),
+    ).filter(User.companyId == company_id)
+
+    adds, changed_ids, removed_ids = [], {}, []
+    unchanged = 0
+    seen = set()
+    for user in existing:
+        row = uploaded.get(user.email_key)
+        if row is None:
+            if user.isActive:
+                removed_ids.append(user.documentId)
+            continue
+        seen.add(user.email_key)
+        if row_fingerprint(row) == user.fingerprint:
+            unchanged += 1
+        else:
+            changed_ids[user.documentId] = row
+
+    for email_key, row in uploaded.items():
+        if email_key not in seen:
+            adds.append(row)
+
+    # Only the rows that actually changed are loaded in full
+    current = {}
+    wanted = list(changed_ids) + removed_ids
+    if wanted:
+        current = {user.documentId: user.serialize() for user in session.query(User).filter(User.documentId.in_(wanted))}
+
+    edits = []
+    for documentId, row in changed_ids.items():
+        old = current[documentId]
+        # Stored users may have no username; /user/bulk requires one, so take the roster's then
+        updated = dict(row, documentId=documentId, username=old["username"] or row["username"])
+        changes = {}
+        for column in FINGERPRINT_COLUMNS:
+            if _fingerprint_text(column, old[column]) == _fingerprint_text(column, updated[column]):
+                # Equal once normalized: keep the stored value, e.g. a formatted phone number
+                updated[column] = old[column]
+            else:
+                changes[column] = {"oldValue": old[column], "newValue": updated[column]}
+        edits.append({"id": documentId, "changes": changes, "updatedObject": updated})
+
+    removals = [dict(current[documentId], isActive=False) for documentId in removed_ids]
+
+    # Ready to post to /user/bulk as-is once the admin approves. Removals are deactivate operations:
+    # they only name the user, so they never fail validation on fields the stored user lacks.
+    operations = (
+        [{"action": "add", "user_data": row} for row in adds]
+        + [{"action": "update", "user_data": edit["updatedObject"]} for edit in edits]
+        + [
+            {"action": "deactivate", "user_data": {"documentId": documentId, "companyId": company_id}}
+            for documentId in removed_ids
+        ]
+    )
+
+    return {
+        "adds": adds,
+        "edits": edits,
+        "removals": removals,
+        "unchanged": unchanged,
+        "operations": operations,
+    }
@@ -0,0 +1,239 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Parsed uploads waiting for review, keyed by the hash of what was uploaded.
+#
+# Every entry is written through to <folder>/<key>.json.gz, so entries survive restarts and are
+# visible to every worker process. A size-bounded LRU keeps recently used entries decoded in
+# memory; entries pushed out of it are read back from disk when next needed. The file is the
+# source of truth: a cached entry is only served while its file is still there, unchanged, so a
+# delete or approve on another worker is seen at once. Entries older than `ttl_seconds` are gone
+# from both, and the oldest files go first when the folder passes `max_disk_bytes`.
+#
+# Approving claims an entry by renaming its file to <key>.approving, which only one worker can
+# do; a successful approve leaves an empty <key>.approved marker (until the TTL) so approving
+# the same upload again is refused rather than reported as expired.
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def content_key(path, namespace=""):
+    # sha256 of `namespace` and the file's bytes, read in 1 MB blocks
+    digest = hashlib.sha256(namespace.encode("utf-8") + b"\0")
+    with open(path, "rb") as upload:
+        for block in iter(lambda: upload.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StagingStore:
+    def __init__(self, folder, max_memory_bytes=64 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024, ttl_seconds=86400):
+        self.folder = folder
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_reads = 0
+        self.misses = 0
+        self.spills = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key, suffix="json.gz"):
+        return os.path.join(self.folder, f"{key}.{suffix}")
+
+    def _signature(self, key):
+        # Identifies the file an entry was read from; None once it is gone
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _expired(self, entry):
+        return entry["created_at"] + self.ttl_seconds <= time.time()
+
+    def _remember(self, key, entry, size, signature):
+        # Callers hold the lock
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= previous[1]
+        self._entries[key] = (entry, size, signature)
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.memory_bytes -= evicted_size
+            self.spills += 1
+
+    def _forget(self, key):
+        # Callers hold the lock
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self.memory_bytes -= cached[1]
+        return cached
+
+    def put(self, key, entry):
+        # `entry` must be JSON-serializable; created_at is set here
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid staging key: {key}")
+        entry = dict(entry, key=key, created_at=time.time())
+        body = json.dumps(entry, separators=(",", ":"), default=str).encode("utf-8")
+        os.makedirs(self.folder, exist_ok=True)
+        temporary = f"{self._path(key)}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(temporary, "wb", compresslevel=5) as staged:
+            staged.write(body)
+        os.replace(temporary, self._path(key))
+        # Staging the same upload again starts over, even after it was approved
+        self._remove_file(key, "approved")
+        with self._lock:
+            self._remember(key, entry, len(body), self._signature(key))
+        self._trim_disk()
+        return entry
+
+    def get(self, key):
+        if not KEY_PATTERN.match(key):
+            return None
+        signature = self._signature(key)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                if signature is not None and cached[2] == signature and not self._expired(cached[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cached[0]
+                self._forget(key)
+            if signature is None:
+                self.misses += 1
+                return None
+
+        try:
+            with gzip.open(self._path(key), "rb") as staged:
+                body = staged.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        entry = json.loads(body)
+        if self._expired(entry):
+            self.delete(key)
+            with self._lock:
+                self.expirations += 1
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_reads += 1
+            self._remember(key, entry, len(body), signature)
+        return entry
+
+    def delete(self, key):
+        if not KEY_PATTERN.match(key):
+            return False
+        with self._lock:
+            cached = self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            return cached is not None
+        return True
+
+    def _remove_file(self, key, suffix):
+        try:
+            os.remove(self._path(key, suffix))
+        except FileNotFoundError:
+            pass
+
+    def claim(self, key):
+        # Takes the entry for approval; False when it is gone or another worker claimed it first
+        if not KEY_PATTERN.match(key):
+            return False
+        with self._lock:
+            self._forget(key)
+        try:
+            os.rename(self._path(key), self._path(key, "approving"))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, key):
+        # Puts back an entry whose approval failed, so it can be approved again
+        try:
+            os.rename(self._path(key, "approving"), self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def mark_approved(self, key):
+        with open(self._path(key, "approved"), "wb"):
+            pass
+        self._remove_file(key, "approving")
+
+    def is_approved(self, key):
+        return bool(KEY_PATTERN.match(key)) and os.path.exists(self._path(key, "approved"))
+
+    def _staged_files(self):
+        if not os.path.isdir(self.folder):
+            return []
+        files = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".json.gz") and KEY_PATTERN.match(name[:-len(".json.gz")]):
+                try:
+                    stat = os.stat(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name[:-len(".json.gz")]))
+        return sorted(files)
+
+    def _trim_disk(self):
+        files = self._staged_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, key in files:
+            if total <= self.max_disk_bytes:
+                break
+            self.delete(key)
+            total -= size
+
+    def purge_expired(self):
+        # Files carry their age in their mtime, so expired ones are removed without being opened
+        cutoff = time.time() - self.ttl_seconds
+        purged = 0
+        for modified, _, key in self._staged_files():
+            if modified <= cutoff and self.delete(key):
+                purged += 1
+        # Approval markers, and claims left by a worker that died mid-approve
+        for name in os.listdir(self.folder) if os.path.isdir(self.folder) else []:
+            key, _, suffix = name.partition(".")
+            if suffix in ("approved", "approving") and KEY_PATTERN.match(key):
+                try:
+                    if os.stat(os.path.join(self.folder, name)).st_mtime <= cutoff:
+                        os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+        with self._lock:
+            self.expirations += purged
+        return purged
+
+    def stats(self):
+        files = self._staged_files()
+        with self._lock:
+            return {
+                'memory_entries': len(self._entries),
+                'memory_bytes': self.memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'disk_entries': len(files),
+                'disk_bytes': sum(size for _, size, _ in files),
+                'max_disk_bytes': self.max_disk_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'disk_reads': self.disk_reads,
+                'misses': self.misses,
+                'spills': self.spills,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# The services import each other as top-level modules, as they do when run from src/services
+SERVICES = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICES)
+
+# oldApi creates its engine on first use from DATABASE_URL; point it at a throwaway SQLite file
+# before any test imports it
+DATABASE = os.path.join(tempfile.mkdtemp(prefix="magic-pill-tests-"), "api.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE}"
+os.environ.pop("REPLICA_DATABASE_URL", None)
@@ -0,0 +1,88 @@
+import io
+import json
+import os
+
+import pytest
+
+from bulk_stream import BulkJobRegistry, iter_chunks, iter_json_array
+
+# Payloads are read a block at a time; any element may be cut anywhere by a block boundary.
+
+PAYLOAD = [
+    {"action": "add", "user_data": {"firstName": "Zoë", "address": "1 Main St, [Apt 2]", "note": "say \"hi\" \\ ]},"}},
+    {"action": "toggle", "user_data": {"documentId": 12345}},
+    [],
+    "日本語",
+    -1.5e3,
+    2.5e+10,
+    123456,
+    True,
+    None,
+]
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64 * 1024])
+def test_elements_survive_every_block_boundary(read_size):
+    body = json.dumps(PAYLOAD, ensure_ascii=False).encode("utf-8")
+    assert list(iter_json_array(io.BytesIO(body), read_size=read_size)) == PAYLOAD
+
+
+def test_text_streams_and_whitespace_are_accepted():
+    assert list(iter_json_array(io.StringIO(' \n[ 1 ,\t"a" ]\n'), read_size=2)) == [1, "a"]
+    assert list(iter_json_array(io.BytesIO(b"[ ]"), read_size=1)) == []
+
+
+@pytest.mark.parametrize("body", [b"", b"{}", b"1", b"[1,", b"[1 2]", b"[1,]", b'["open', b"[{]", b"[1}"])
+def test_malformed_payloads_raise_value_error(body):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(body), read_size=2))
+
+
+def test_chunks_keep_order_and_the_last_partial_chunk():
+    assert list(iter_chunks(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_chunks([], 3)) == []
+
+
+# Jobs run in one worker; their status is written through to a file every worker can read.
+
+
+def counts(rows, added):
+    return {"rows": rows, "added": added, "updated": 0, "toggled": 0, "deactivated": 0}
+
+
+def test_job_status_is_visible_to_other_workers_and_after_restart(tmp_path):
+    running, other = BulkJobRegistry(str(tmp_path)), BulkJobRegistry(str(tmp_path))
+    job = running.create(chunk_size=2)
+    assert other.get(job.job_id) is None
+    assert other.status(job.job_id)["status"] == "queued"
+
+    job.start()
+    job.record_chunk(counts(2, 1), [(1, {"error": "Bad Request", "message": "bad row"})], committed=True)
+    assert other.status(job.job_id)["added"] == 1
+
+    job.finish("completed")
+    restarted = BulkJobRegistry(str(tmp_path))
+    assert restarted.status(job.job_id) == job.serialize()
+    assert restarted.status(job.job_id)["errors"] == [{"error": "Bad Request", "message": "bad row", "row": 1}]
+
+
+def test_unknown_and_invalid_job_ids_are_not_found(tmp_path):
+    registry = BulkJobRegistry(str(tmp_path))
+    assert registry.status("0" * 32) is None
+    assert registry.status("../secrets") is None
+
+
+def test_jobs_left_running_by_a_dead_worker_are_interrupted(tmp_path):
+    job = BulkJobRegistry(str(tmp_path)).create(chunk_size=2)
+    job.start()
+    os.utime(job.path, (0, 0))
+    assert BulkJobRegistry(str(tmp_path), stale_seconds=60).status(job.job_id)["status"] == "interrupted"
+
+
+def test_old_job_files_are_purged(tmp_path):
+    registry = BulkJobRegistry(str(tmp_path), ttl_seconds=60)
+    job = registry.create(chunk_size=2)
+    job.finish("completed")
+    os.utime(job.path, (0, 0))
+    assert registry.purge_expired() == 1
+    assert BulkJobRegistry(str(tmp_path)).status(job.job_id) is None
@@ -0,0 +1,56 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from bulk_validation import check_operations, check_user_row
+
+# Large payloads are checked in chunks across a process pool; results must come back one per
+# operation, in input order, exactly as the inline checks would give them. The rows below fail
+# before the email check, so email_validator is not needed.
+
+
+def operations(count):
+    made = []
+    for n in range(count):
+        kind = n % 4
+        if kind == 0:
+            made.append({"action": "deactivate", "user_data": {"documentId": n, "companyId": 1}})
+        elif kind == 1:
+            made.append({"action": "deactivate", "user_data": {"documentId": str(n), "companyId": 1}})
+        elif kind == 2:
+            made.append({"action": "add", "user_data": {"username": f"user{n}"}})
+        else:
+            made.append("not an operation")
+    return made
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def test_parallel_results_match_inline_and_keep_order(executor):
+    payload = operations(50)
+    inline = check_operations(payload)
+    assert check_operations(payload, executor, min_parallel_rows=10, chunk_size=7) == inline
+    assert inline[:4] == [
+        {},
+        {"error": "Bad Request", "message": "'documentId' should be of type int."},
+        {"error": "Bad Request", "message": "'email' is required."},
+        None,
+    ]
+
+
+def test_small_payloads_are_checked_inline():
+    class NoPool:
+        def map(self, *args):
+            raise AssertionError("the pool should not be used")
+
+    payload = operations(8)
+    assert check_operations(payload, NoPool(), min_parallel_rows=10) == check_operations(payload)
+
+
+def test_deactivate_needs_the_user_and_company():
+    assert check_user_row({"documentId": 1}, "deactivate")["message"] == "'companyId' is required for deactivate operations."
+    assert check_user_row({"documentId": True, "companyId": 1}, "deactivate")["message"] == "'documentId' should be of type int."
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+from sqlalchemy import func, select
+
+import changelog
+import oldApi
+from changelog import ChangeLog, query
+from models import Base, ChangeOutbox
+
+# Several workers append to the same folder; each owns its segments and queries see all of them in time order.
+
+
+def record(n, document_id, company_id=1):
+    return {"op": "update", "source": "test", "documentId": document_id, "companyId": company_id, "data": {"n": n}}
+
+
+def test_writers_keep_separate_segments_and_queries_merge_them(tmp_path):
+    first, second = ChangeLog(str(tmp_path), max_segment_bytes=200), ChangeLog(str(tmp_path), max_segment_bytes=200)
+    for n in range(10):
+        first.append([record(n, document_id=1)])
+        second.append([record(n, document_id=2, company_id=2)])
+    first.close()
+    second.close()
+
+    segments = changelog.list_segments(str(tmp_path))
+    assert sorted(segments) == sorted([first.writer, second.writer])
+    assert all(len(sequences) > 1 for sequences in segments.values())
+
+    records = list(query(str(tmp_path)))
+    assert len(records) == 20
+    assert [r["ts"] for r in records] == sorted(r["ts"] for r in records)
+    assert [r["data"]["n"] for r in records if r["documentId"] == 1] == list(range(10))
+    assert [r["data"]["n"] for r in query(str(tmp_path), company_id=2)] == list(range(10))
+    assert [r["data"]["n"] for r in query(str(tmp_path), document_id=1, limit=3)] == [0, 1, 2]
+
+
+def test_ts_is_stamped_on_append_and_never_goes_back(tmp_path, monkeypatch):
+    log = ChangeLog(str(tmp_path))
+    clock = iter([2.0, 1.0, 3.0])
+    monkeypatch.setattr(changelog.time, "time", lambda: next(clock))
+    stamped = [log.append([record(n, document_id=1), record(n, document_id=2)]) for n in range(3)]
+    assert [[r["ts"] for r in batch] for batch in stamped] == [[2000, 2000], [2000, 2000], [3000, 3000]]
+
+
+def test_limit_zero_returns_nothing(tmp_path):
+    log = ChangeLog(str(tmp_path))
+    log.append([record(1, document_id=1)])
+    assert list(query(str(tmp_path), limit=0)) == []
+
+
+def test_partial_and_corrupt_lines_are_skipped(tmp_path):
+    log = ChangeLog(str(tmp_path))
+    log.append([record(1, document_id=1)])
+    path = os.path.join(str(tmp_path), f"changes-{log.writer}-000001.ndjson")
+    with open(path, "ab") as segment:
+        segment.write(b'{"ts": 2, "docu\n{"ts": 3')
+    assert [r["data"]["n"] for r in query(str(tmp_path))] == [1]
+
+
+# Writes record their changes in change_outbox within their own transaction; commits move them to the files
+
+
+@pytest.fixture
+def outbox_log(tmp_path, monkeypatch):
+    Base.metadata.create_all(oldApi.get_engine())
+    log = ChangeLog(str(tmp_path))
+    monkeypatch.setattr(oldApi, "change_log", log)
+    monkeypatch.setattr(oldApi, "change_outbox_chunk", 3)
+    return log
+
+
+def outbox_size():
+    with oldApi.session_factory() as session:
+        return session.execute(select(func.count()).select_from(ChangeOutbox)).scalar()
+
+
+def test_committed_changes_reach_the_change_log(outbox_log):
+    with oldApi.session_factory() as session:
+        oldApi.record_changes(session, "update", [{"documentId": n, "companyId": 7} for n in range(8)], source="test")
+        # Every full chunk is already in the outbox, so the session holds fewer than a chunk
+        assert len(session.info.get("changelog", [])) < 3
+        session.commit()
+
+    records = list(query(outbox_log.folder, company_id=7))
+    assert [r["documentId"] for r in records] == list(range(8))
+    assert len({r["id"] for r in records}) == 8
+    assert outbox_size() == 0
+
+
+def test_rolled_back_changes_are_dropped(outbox_log):
+    with oldApi.session_factory() as session:
+        oldApi.record_changes(session, "update", [{"documentId": n, "companyId": 8} for n in range(5)], source="test")
+        session.rollback()
+    assert list(query(outbox_log.folder, company_id=8)) == []
+    assert outbox_size() == 0
+
+
+def test_unwritable_change_log_keeps_records_in_the_outbox(outbox_log, monkeypatch):
+    def fail(records):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(outbox_log, "append", fail)
+    with oldApi.session_factory() as session:
+        oldApi.record_changes(session, "toggle", [{"documentId": 1, "companyId": 9}], source="test")
+        session.commit()
+    assert outbox_size() == 1
+
+    monkeypatch.delattr(outbox_log, "append")
+    assert oldApi.drain_change_outbox() == 1
+    assert [r["op"] for r in query(outbox_log.folder, company_id=9)] == ["toggle"]
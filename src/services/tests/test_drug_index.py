@@ -0,0 +1,65 @@
+from drug_index import DrugIndex
+
+# Type-ahead search: every query word matches a word prefix (or, for a typo, a similar word), and
+# results come back in name order with names starting with the query first.
+
+
+def drug(drug_id, name, brand=None, manufacturer=None, plan_type="basic", is_free=False):
+    return {
+        "drug_id": drug_id, "drug_name": name, "brand_name": brand, "manufacturer_name": manufacturer,
+        "plan_type": plan_type, "is_free": is_free, "is_high_cost": False,
+    }
+
+
+DRUGS = [
+    drug(1, "Amoxicillin 500 mg", brand="Amoxil", manufacturer="Sandoz"),
+    drug(2, "Atorvastatin 20 mg", brand="Lipitor", manufacturer="Pfizer", is_free=True),
+    drug(3, "Metformin 500 mg", manufacturer="Sandoz", plan_type="premium"),
+    drug(4, "Children's Amoxicillin", manufacturer="Teva"),
+]
+
+
+def names(results):
+    return [result["drug_name"] for result in results]
+
+
+def build():
+    index = DrugIndex()
+    index.build(DRUGS)
+    return index
+
+
+def test_prefixes_of_every_word_match():
+    index = build()
+    assert names(index.search("amox")) == ["Amoxicillin 500 mg", "Children's Amoxicillin"]
+    assert names(index.search("500 sand")) == ["Amoxicillin 500 mg", "Metformin 500 mg"]
+    assert names(index.search("lipi")) == ["Atorvastatin 20 mg"]
+    assert index.search("amox pfizer") == []
+
+
+def test_typos_fall_back_to_similar_words():
+    assert names(build().search("metfromin")) == ["Metformin 500 mg"]
+
+
+def test_names_starting_with_the_query_come_first():
+    assert names(build().search("children amox", limit=1)) == ["Children's Amoxicillin"]
+    assert names(build().search("", limit=2)) == ["Amoxicillin 500 mg", "Atorvastatin 20 mg"]
+
+
+def test_facets_filter_results():
+    index = build()
+    assert names(index.search("", is_free=True)) == ["Atorvastatin 20 mg"]
+    assert names(index.search("sandoz", plan_type="premium")) == ["Metformin 500 mg"]
+
+
+def test_incremental_changes_match_a_full_build():
+    index = build()
+    changed = [drug(1, "Amoxicillin 250 mg", brand="Amoxil", manufacturer="Sandoz")] + DRUGS[1:3]
+    assert index.sync(changed) == 2
+    assert names(index.search("amox")) == ["Amoxicillin 250 mg"]
+    assert index.search("teva") == []
+
+    rebuilt = DrugIndex()
+    rebuilt.build(changed)
+    for query in ("amox", "250", "sandoz", "lip", ""):
+        assert index.search(query) == rebuilt.search(query)
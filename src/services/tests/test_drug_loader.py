@@ -0,0 +1,59 @@
+import pytest
+
+pandas = pytest.importorskip("pandas")
+
+from drug_loader import normalize_drug_batch
+
+# Formulary batches are cleaned column-at-a-time; bad rows are reported by row number and dropped,
+# the rest come out in DRUG_COLUMNS.
+
+
+def batch(rows):
+    return pandas.DataFrame(rows, dtype=str)
+
+
+def new_errors():
+    return {"count": 0, "rows": []}
+
+
+def test_rows_are_cleaned_and_bad_rows_reported():
+    frame = batch([
+        {"Drug ID": "10", "Name": " Amoxicillin ", "Price": "$1,200.456", "Free": "yes", "Max Supply 30": "30"},
+        {"Drug ID": "11", "Name": "", "Price": "3", "Free": "no", "Max Supply 30": "30"},
+        {"Drug ID": "x", "Name": "Metformin", "Price": "3", "Free": "no", "Max Supply 30": "30"},
+        {"Drug ID": "13", "Name": "Lipitor", "Price": "-1", "Free": "maybe", "Max Supply 30": "2.5"},
+        {"Drug ID": "14", "Name": "Ibuprofen", "Price": "", "Free": "", "Max Supply 30": ""},
+    ])
+    errors = new_errors()
+    clean = normalize_drug_batch(frame, first_row=1, errors=errors)
+
+    assert clean["drug_id"].tolist() == [10, 14]
+    assert clean["drug_name"].tolist() == ["Amoxicillin", "Ibuprofen"]
+    assert clean["cost"].iloc[0] == 1200.46 and pandas.isna(clean["cost"].iloc[1])
+    assert clean["is_free"].tolist() == [True, False]
+    assert clean["max_supply_30"].iloc[0] == 30 and pandas.isna(clean["max_supply_30"].iloc[1])
+
+    # One message per bad row: the first problem found with it
+    assert errors["count"] == 3
+    assert [(error["row"], error["message"]) for error in errors["rows"]] == [
+        (2, "'drug_name' is required."),
+        (3, "'x' is not a valid drug_id."),
+        (4, "'-1' is not a valid cost."),
+    ]
+
+
+def test_repeated_ids_are_rejected_across_batches():
+    seen, errors = {}, new_errors()
+    first = normalize_drug_batch(batch([{"drug_id": "1", "drug_name": "A"}, {"drug_id": "1", "drug_name": "B"}]), 1, errors, seen)
+    second = normalize_drug_batch(batch([{"drug_id": "1", "drug_name": "C"}, {"drug_id": "2", "drug_name": "D"}]), 3, errors, seen)
+    assert first["drug_name"].tolist() == ["A"]
+    assert second["drug_name"].tolist() == ["D"]
+    assert [error["message"] for error in errors["rows"]] == [
+        "drug_id 1 is repeated; it first appears on row 1.",
+        "drug_id 1 is repeated; it first appears on row 1.",
+    ]
+
+
+def test_a_file_without_drug_names_is_refused():
+    with pytest.raises(ValueError):
+        normalize_drug_batch(batch([{"drug_id": "1"}]), 1, new_errors())
@@ -0,0 +1,102 @@
+import hashlib
+import re
+from datetime import date
+
+import pytest
+from sqlalchemy.orm import Session
+
+import oldApi
+from models import Base, InsuranceCompany, MagicPillPlan, User
+from roster_diff import diff_roster
+
+# Uploaded rows are compared to the stored roster by email: new emails are adds, changed rows are
+# edits, and active users missing from the upload are deactivated. The fingerprint is computed in
+# the database, so the Postgres functions it uses are provided to SQLite here.
+
+COMPANY_ID = 40
+
+
+def postgres_functions(connection):
+    connection.create_function("md5", 1, lambda text: hashlib.md5(text.encode("utf-8")).hexdigest())
+    connection.create_function("concat_ws", -1, lambda separator, *parts: separator.join(p for p in parts if p is not None))
+    connection.create_function("regexp_replace", 4, lambda text, pattern, replacement, flags: None if text is None else re.sub(pattern, replacement, text))
+    # SQLite keeps dates as ISO text already
+    connection.create_function("to_char", 2, lambda value, pattern: value)
+
+
+@pytest.fixture
+def session():
+    engine = oldApi.get_engine()
+    Base.metadata.create_all(engine)
+    with engine.connect() as connection:
+        postgres_functions(connection.connection.driver_connection)
+        with Session(bind=connection) as session:
+            session.add(InsuranceCompany(companyId=COMPANY_ID, name="Diff Co"))
+            session.add(MagicPillPlan(planId=COMPANY_ID, planName="Diff Plan"))
+            session.add_all([
+                stored_user(1, "same@example.com"),
+                stored_user(2, "edited@example.com", phone="(555) 010-0200", username=None),
+                stored_user(3, "formatted@example.com", phone="555-010-0300"),
+                stored_user(4, "removed@example.com"),
+                stored_user(5, "inactive@example.com", isActive=False),
+            ])
+            session.flush()
+            yield session
+            session.rollback()
+
+
+def stored_user(document_id, email, **fields):
+    values = dict(
+        documentId=document_id + COMPANY_ID * 100, username=email, email=email, firstName="Avery", lastName="Kim",
+        phone="5550100", address="1 Main St", dob=date(1990, 1, 2), age=35, company="Diff Co",
+        companyId=COMPANY_ID, planId=COMPANY_ID, isActive=True, isDependant=False,
+    )
+    values.update(fields)
+    return User(**values)
+
+
+def roster_row(email, **fields):
+    row = dict(
+        username=email, email=email, firstName="Avery", lastName="Kim", phone="5550100", address="1 Main St",
+        dob="1990-01-02", age=35, company="Diff Co", companyId=COMPANY_ID, planId=COMPANY_ID, isActive=True, isDependant=False,
+    )
+    row.update(fields)
+    return row
+
+
+def test_rows_are_classified_as_adds_edits_and_removals(session):
+    rows = [
+        roster_row("same@example.com"),
+        roster_row("edited@example.com", lastName="Kim-Lee", phone="5550100200"),
+        roster_row("formatted@example.com", phone="5550100300"),
+        roster_row("new@example.com"),
+    ]
+    delta = diff_roster(session, COMPANY_ID, list(enumerate(rows)))
+
+    # A phone number that only differs in formatting is unchanged
+    assert delta["unchanged"] == 2
+    assert [row["email"] for row in delta["adds"]] == ["new@example.com"]
+
+    [edit] = delta["edits"]
+    assert edit["id"] == 4002
+    assert edit["changes"] == {"lastName": {"oldValue": "Kim", "newValue": "Kim-Lee"}}
+    # The stored formatting is kept, and the stored user has no username so the roster's is used
+    assert edit["updatedObject"]["phone"] == "(555) 010-0200"
+    assert edit["updatedObject"]["username"] == "edited@example.com"
+
+    # Inactive users missing from the upload are already gone
+    assert [user["documentId"] for user in delta["removals"]] == [4004]
+    assert [operation["action"] for operation in delta["operations"]] == ["add", "update", "deactivate"]
+    assert delta["operations"][-1]["user_data"] == {"documentId": 4004, "companyId": COMPANY_ID}
+
+
+def test_emails_match_whatever_their_case(session):
+    delta = diff_roster(session, COMPANY_ID, [(0, roster_row("Same@Example.com"))])
+    assert delta["adds"] == []
+    assert [edit["changes"] for edit in delta["edits"]] == [{"email": {"oldValue": "same@example.com", "newValue": "Same@Example.com"}}]
+
+
+def test_later_rows_win_for_the_same_email(session):
+    rows = [roster_row("new@example.com", firstName="First"), roster_row("NEW@example.com", firstName="Second")]
+    delta = diff_roster(session, COMPANY_ID, list(enumerate(rows)))
+    assert [row["firstName"] for row in delta["adds"]] == ["Second"]
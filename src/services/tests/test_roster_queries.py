@@ -0,0 +1,69 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+import oldApi
+from models import Base, InsuranceCompany, MagicPillPlan, User
+
+# GET /company/<id> must run the same number of statements however large the roster is: users are
+# read as column tuples and their company and plan come from the reference cache, never one query per row.
+
+MAX_STATEMENTS = 2
+
+
+@pytest.fixture(scope="module")
+def client():
+    engine = oldApi.get_engine()
+    Base.metadata.create_all(engine)
+    with oldApi.session_factory() as session:
+        session.add_all([MagicPillPlan(planId=plan_id, planName=f"Plan {plan_id}") for plan_id in (1, 2, 3)])
+        session.commit()
+    return oldApi.create_app().test_client()
+
+
+def seed_company(company_id, users):
+    with oldApi.session_factory() as session:
+        session.add(InsuranceCompany(companyId=company_id, name=f"Company {company_id}", phoneNumber="5550100"))
+        session.add_all([
+            User(
+                username=f"user{company_id}-{n}", email=f"user{company_id}-{n}@example.com",
+                firstName="Jordan", lastName=f"Lee{n}", phone="5550100", address="1 Main St",
+                dob=date(1990, 1, 1), age=35, company=f"Company {company_id}", companyId=company_id,
+                planId=n % 3 + 1, isActive=True, isDependant=n % 2 == 0,
+            )
+            for n in range(users)
+        ])
+        session.commit()
+
+
+def count_statements(client, path):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = oldApi.get_engine()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return response.get_json(), statements
+
+
+@pytest.mark.parametrize("users", [1, 10, 500])
+def test_company_roster_statements_do_not_grow_with_roster(client, users):
+    company_id = 100 + users
+    seed_company(company_id, users)
+    # The first request may load the company and plan caches; the second shows the steady state
+    client.get(f"/company/{company_id}")
+
+    body, statements = count_statements(client, f"/company/{company_id}")
+
+    roster = body["results"][0]["users"]
+    assert len(roster) == users
+    assert all(user["magic_pill_plan"]["planId"] == user["planId"] for user in roster)
+    assert all(user["insurance_company"]["companyId"] == company_id for user in roster)
+    assert len(statements) <= MAX_STATEMENTS, statements
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from staging_store import StagingStore, content_key
+
+# Staged uploads are written through to disk: every worker's store sees the same entries, and the
+# file, not the in-memory copy, decides whether an entry still exists.
+
+KEY = "a" * 64
+
+
+def entry(rows=3):
+    return {"company_id": 1, "filename": "roster.csv", "rows": [[n, {"email": f"user{n}@example.com"}] for n in range(rows)]}
+
+
+def test_entries_round_trip_between_workers(tmp_path):
+    first, second = StagingStore(str(tmp_path)), StagingStore(str(tmp_path))
+    stored = first.put(KEY, entry())
+    assert stored["key"] == KEY
+
+    assert second.get(KEY) == stored
+    assert second.get(KEY) == stored
+    assert (second.stats()["disk_reads"], second.stats()["hits"]) == (1, 1)
+
+    # Deleting on one worker is seen at once by the other, despite its cached copy
+    first.delete(KEY)
+    assert second.get(KEY) is None
+
+
+def test_replaced_entries_are_reread(tmp_path):
+    first, second = StagingStore(str(tmp_path)), StagingStore(str(tmp_path))
+    first.put(KEY, entry(rows=1))
+    assert len(second.get(KEY)["rows"]) == 1
+    first.put(KEY, entry(rows=2))
+    assert len(second.get(KEY)["rows"]) == 2
+
+
+def test_only_one_worker_can_claim_an_entry(tmp_path):
+    first, second = StagingStore(str(tmp_path)), StagingStore(str(tmp_path))
+    first.put(KEY, entry())
+    assert first.claim(KEY)
+    assert not second.claim(KEY)
+    assert second.get(KEY) is None
+
+    # A failed approval puts the entry back
+    first.release(KEY)
+    assert second.claim(KEY)
+    second.mark_approved(KEY)
+    assert first.is_approved(KEY)
+    assert first.get(KEY) is None
+
+    # Staging the same upload again makes it approvable again
+    first.put(KEY, entry())
+    assert not second.is_approved(KEY)
+
+
+def test_expired_entries_are_gone(tmp_path):
+    store = StagingStore(str(tmp_path), ttl_seconds=60)
+    store.put(KEY, entry())
+    os.utime(os.path.join(str(tmp_path), f"{KEY}.json.gz"), (0, 0))
+    assert store.purge_expired() == 1
+    assert store.get(KEY) is None
+
+
+def test_invalid_keys_are_rejected(tmp_path):
+    store = StagingStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.put("../escape", entry())
+    assert store.get("../escape") is None
+    assert not store.claim("../escape")
+
+
+def test_content_key_depends_on_namespace_and_bytes(tmp_path):
+    upload = tmp_path / "roster.csv"
+    upload.write_bytes(b"email\nuser@example.com\n")
+    assert content_key(str(upload), "1") == content_key(str(upload), "1")
+    assert content_key(str(upload), "1") != content_key(str(upload), "2")